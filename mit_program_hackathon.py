@@ -76,9 +76,12 @@ from sklearn.model_selection import RandomizedSearchCV, train_test_split, GridSe
 
 from sklearn.metrics import log_loss, accuracy_score, confusion_matrix, precision_score, recall_score, ConfusionMatrixDisplay
 
-# Mount Google Drive to Colab
-from google.colab import drive
-drive.mount('/content/drive', force_remount=True)
+# Mount Google Drive to Colab (skipped when running outside Colab)
+try:
+  from google.colab import drive
+  drive.mount('/content/drive', force_remount=True)
+except ImportError:
+  pass
 
 # Commented out IPython magic to ensure Python compatibility.
 # Command to tell Python to actually display the graphs
@@ -0,0 +1,8 @@
+"""Shinkansen passenger satisfaction pipeline.
+
+Headless counterpart of the ``MIT Program Hackathon`` notebook: the same
+data cleaning and modeling steps, packaged so they can run as batch jobs
+outside Colab. Run ``python -m shinkansen --help`` for the entry points.
+"""
+
+__version__ = '0.1.0'
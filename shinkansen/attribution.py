@@ -0,0 +1,206 @@
+"""Gain importance and per-passenger TreeSHAP attributions of a trained model.
+
+The notebook reports LightGBM's ``feature_importances_``, which counts how
+often each dummy column is split on. This module reports:
+
+* gain importance: the loss reduction credited to each column, from the
+  booster (LightGBM ``gain``, XGBoost ``total_gain``) or the forest's
+  impurity decrease;
+* TreeSHAP contributions: each passenger's prediction split into one
+  log-odds contribution per column plus the bias, computed by the boosting
+  libraries' own ``pred_contrib`` implementations.
+
+Both are summed back from the ~100 dummy columns to the 23 source features;
+SHAP values are additive, so the sum of a feature's dummies is that
+feature's contribution. Contributions are computed in row batches spread
+over threads, since both libraries release the GIL while predicting. With
+``max_rows`` or ``budget`` only a random sample of the rows is explained, so
+the cost of a large scoring batch stays bounded.
+
+Only the three trained families can be explained. Ensembles and distilled
+students raise a ValueError: an ensemble's members attribute in different
+spaces (log-odds for the boosters, probability for the forest), so their
+contributions do not add up to one explanation.
+
+Results are kept in the stage cache under the digest of the model artifact
+and the data, so explaining the same model version again is a file read.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from shinkansen import instrument
+
+BIAS = 'bias'
+
+
+def source_features(preprocessor):
+    """Source feature of every encoded column, in :attr:`Preprocessor.feature_names` order."""
+    sources = list(preprocessor.numeric_col)
+    for col in preprocessor.category_col:
+        sources += [col] * (1 if preprocessor.encoding == 'ordinal' else len(preprocessor.vocabulary[col]))
+    return sources
+
+
+def _group_matrix(preprocessor):
+    """(encoded columns, source features) 0/1 matrix that sums dummies into their source."""
+    sources = source_features(preprocessor)
+    names = list(preprocessor.numeric_col) + list(preprocessor.category_col)
+    groups = np.zeros((len(sources), len(names)), dtype=np.float64)
+    groups[np.arange(len(sources)), [names.index(source) for source in sources]] = 1
+    return groups, names
+
+
+def check_explainable(model, name):
+    """Raise ValueError unless ``model`` is a family this module can explain."""
+    from shinkansen.models import MODEL_NAMES
+
+    if name not in MODEL_NAMES:
+        raise ValueError(f"cannot explain {name!r} artifacts; explain supports {', '.join(MODEL_NAMES)}")
+    if name == 'random_forest' and not hasattr(model, 'estimators_'):
+        raise ValueError('cannot explain a compact forest (train --max-model-mb); TreeSHAP needs the '
+                         'scikit-learn forest')
+
+
+def gain_importance(model, name, preprocessor):
+    """Share of the total gain per source feature, largest first."""
+    n_columns = len(preprocessor.feature_names)
+    if name == 'lightgbm':
+        gain = model.booster_.feature_importance(importance_type='gain')
+    elif name == 'xgboost':
+        scores = model.get_booster().get_score(importance_type='total_gain')
+        gain = np.zeros(n_columns)
+        for column, value in scores.items():
+            # Columns are named f0, f1, ... when the model was fitted on an array
+            gain[int(column[1:]) if column.startswith('f') and column[1:].isdigit() else
+                 preprocessor.feature_names.index(column)] = value
+    else:
+        gain = model.feature_importances_
+    groups, names = _group_matrix(preprocessor)
+    totals = np.asarray(gain, dtype=np.float64) @ groups
+    return pd.Series(totals / totals.sum(), index=names).sort_values(ascending=False)
+
+
+def _contrib_batch(model, name, X, n_jobs):
+    """(rows, columns + 1) TreeSHAP values of one batch, bias last."""
+    if name == 'lightgbm':
+        return model.predict(X, pred_contrib=True, num_threads=n_jobs)
+    if name == 'xgboost':
+        import xgboost as xgb
+
+        booster = model.get_booster()
+        try:
+            rounds = (0, model.best_iteration + 1)
+        except AttributeError:
+            rounds = (0, 0)
+        return booster.predict(xgb.DMatrix(X, nthread=n_jobs), pred_contribs=True, iteration_range=rounds)
+    try:
+        import shap
+    except ImportError:
+        raise ValueError('TreeSHAP for random_forest needs the shap package; only lightgbm and xgboost '
+                         'compute it natively') from None
+    explainer = shap.TreeExplainer(model)
+    values = explainer.shap_values(X, check_additivity=False)
+    # Probability-space values of the positive class, with its expected value as the bias
+    values = values[..., 1] if np.ndim(values) == 3 else values[1]
+    return np.column_stack([values, np.full(len(X), np.ravel(explainer.expected_value)[-1])])
+
+
+def contributions(model, name, preprocessor, X, batch_size=10000, workers=None, cores=None, max_rows=None,
+                  budget=None, random_state=0):
+    """TreeSHAP values summed to source features, plus the bias column.
+
+    Rows are explained ``batch_size`` at a time on ``workers`` threads
+    sharing ``cores``. ``max_rows`` explains a random sample of that many
+    rows; ``budget`` (seconds) stops starting new batches once spent, so
+    with either the result covers only the returned row positions. Returns
+    (frame of contributions, explained row positions).
+    """
+    rows = np.arange(len(X))
+    if max_rows is not None and max_rows < len(rows) or budget is not None:
+        # Random order, so whatever the budget covers is a uniform sample
+        rows = np.random.default_rng(random_state).permutation(rows)[:max_rows]
+    batches = [rows[start:start + batch_size] for start in range(0, len(rows), batch_size)]
+    cores = cores or os.cpu_count() or 1
+    workers = max(1, min(workers or cores, len(batches)))
+    n_jobs = max(1, cores // workers)
+    deadline = None if budget is None else time.perf_counter() + budget
+
+    def explain(batch):
+        if deadline is not None and time.perf_counter() > deadline:
+            return None
+        return _contrib_batch(model, name, X[np.sort(batch)], n_jobs)
+
+    groups, names = _group_matrix(preprocessor)
+    with instrument.stage('contributions', detail=name) as record:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(explain, batches))
+        done = [(np.sort(batch), values) for batch, values in zip(batches, results) if values is not None]
+        record['rows'] = sum(len(batch) for batch, _ in done)
+    if not done:
+        return pd.DataFrame(columns=names + [BIAS]), np.empty(0, dtype=np.int64)
+    explained = np.concatenate([batch for batch, _ in done])
+    values = np.concatenate([values for _, values in done])
+    order = np.argsort(explained, kind='stable')
+    values = values[order]
+    summed = np.column_stack([values[:, :-1] @ groups, values[:, -1]])
+    return pd.DataFrame(summed, columns=names + [BIAS]), explained[order]
+
+
+def summarize(frame):
+    """Mean absolute and mean signed contribution of each source feature, largest first."""
+    features = frame.drop(columns=BIAS)
+    return pd.DataFrame({'mean_abs': features.abs().mean(), 'mean': features.mean()}).sort_values(
+        'mean_abs', ascending=False)
+
+
+def explain(model_path, travel_path, survey_path, cache_dir=None, batch_size=10000, workers=None, cores=None,
+            max_rows=None, budget=None, random_state=0):
+    """Gain importance and source-feature contributions of a saved model on a file pair.
+
+    Returns (gain shares, contributions indexed by ID, summary). With a
+    ``cache_dir`` the result is stored under the digest of the artifact,
+    the files and the settings, and read back for the same model version.
+    A time ``budget`` makes the result depend on the machine, so it is not
+    cached.
+    """
+    from shinkansen import pipeline, stages
+    from shinkansen.matrix import FeatureMatrix
+
+    cache = stages.StageCache(cache_dir) if cache_dir and budget is None else None
+    key = None
+    if cache is not None:
+        settings = {'max_rows': max_rows, 'random_state': random_state if max_rows else None}
+        key = cache.key('attribution', [model_path, travel_path, survey_path], settings)
+        path = cache.get('attribution', key)
+        if path is not None:
+            with open(os.path.join(path, 'attribution.json')) as f:
+                meta = json.load(f)
+            frame = pd.DataFrame(np.load(os.path.join(path, 'values.npy')), columns=meta['columns'],
+                                 index=pd.Index(np.load(os.path.join(path, 'ids.npy')), name='ID'))
+            return pd.Series(meta['gain']), frame, summarize(frame)
+
+    artifact = pipeline.load_model(model_path)
+    name = artifact['report']['model']
+    check_explainable(artifact['model'], name)
+    preprocessor = artifact['preprocessor']
+    data = pipeline.merge(*pipeline.load_raw(travel_path, survey_path, cache_dir))
+    matrix = FeatureMatrix.build(data, preprocessor)
+    gain = gain_importance(artifact['model'], name, preprocessor)
+    frame, rows = contributions(artifact['model'], name, preprocessor, matrix.X, batch_size, workers, cores,
+                                max_rows, budget, random_state)
+    frame.index = pd.Index(matrix.ids[rows], name='ID')
+    if cache is not None:
+        def write(directory):
+            with open(os.path.join(directory, 'attribution.json'), 'w') as f:
+                json.dump({'gain': gain.to_dict(), 'columns': list(frame.columns)}, f)
+            np.save(os.path.join(directory, 'values.npy'), frame.to_numpy(np.float32))
+            np.save(os.path.join(directory, 'ids.npy'), frame.index.to_numpy())
+
+        cache.put('attribution', key, write)
+    return gain, frame, summarize(frame)
@@ -0,0 +1,254 @@
+"""Benchmarks comparing pipeline variants on the same training data.
+
+The ``pipeline`` suite runs every stage end to end on synthetic files at
+multiples of the real size (see :mod:`shinkansen.synth`) and records wall
+time, CPU time and peak RSS per stage. Its results are written as JSON with
+the commit they were measured on, and can be compared against an earlier
+result file to catch regressions.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from shinkansen import config, ingest, instrument, pipeline
+from shinkansen.matrix import FeatureMatrix, traced_call
+from shinkansen.models import MODEL_NAMES, make_model
+from shinkansen.preprocess import Preprocessor
+
+SUITES = ('encodings', 'matrix', 'pipeline')
+
+# (label, encoding, native LightGBM categoricals)
+ENCODING_VARIANTS = [
+    ('onehot', 'onehot', False),
+    ('ordinal', 'ordinal', False),
+    ('ordinal+native', 'ordinal', True),
+]
+
+
+def _single_row_latency(model, X, n_rows=200):
+    """Median seconds for predict_proba on one row at a time."""
+    timings = []
+    for i in range(min(n_rows, len(X))):
+        row = X[i:i + 1]
+        start = time.perf_counter()
+        model.predict_proba(row)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def _fit_kwargs(name, matrix, preprocessor, native):
+    if native and name == 'lightgbm':
+        return {'categorical_feature': matrix.positions(preprocessor.categorical_features)}
+    return {}
+
+
+def encodings(data, models=MODEL_NAMES, n_estimators=500, test_size=0.2, random_state=0):
+    """Compare the one-hot and ordinal layouts on a merged training frame.
+
+    Reports matrix width and memory, fit time, batch and single-row predict
+    latency, log loss and accuracy for every model and encoding. Native
+    categoricals only apply to LightGBM.
+    """
+    from sklearn.metrics import accuracy_score, log_loss
+
+    rows = []
+    for label, encoding, native in ENCODING_VARIANTS:
+        preprocessor = Preprocessor(encoding=encoding).fit(data)
+        start = time.perf_counter()
+        matrix = FeatureMatrix.build(data, preprocessor)
+        transform_seconds = time.perf_counter() - start
+        train, test = matrix.split(test_size=test_size, random_state=random_state, stratify=True)
+        for name in models:
+            if native and name != 'lightgbm':
+                continue
+            model = make_model(name, n_estimators=n_estimators, random_state=random_state)
+            start = time.perf_counter()
+            model.fit(train.X, train.y, **_fit_kwargs(name, matrix, preprocessor, native))
+            fit_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            proba = model.predict_proba(test.X)[:, 1]
+            batch_seconds = time.perf_counter() - start
+            rows.append({
+                'model': name,
+                'encoding': label,
+                'columns': matrix.X.shape[1],
+                'matrix_mb': matrix.nbytes / 2**20,
+                'transform_s': transform_seconds,
+                'fit_s': fit_seconds,
+                'batch_us_per_row': batch_seconds / len(test) * 1e6,
+                'single_row_ms': _single_row_latency(model, test.X) * 1e3,
+                'logloss': log_loss(test.y, proba),
+                'accuracy': accuracy_score(test.y, (proba > 0.5).astype(int)),
+            })
+    return pd.DataFrame(rows)
+
+
+def matrix(data, models=MODEL_NAMES, n_estimators=500, test_size=0.2, random_state=0):
+    """Compare mixed-dtype DataFrame input with the shared float32 matrix.
+
+    Each model is fitted and scored twice, once on the notebook's frame of
+    uint8 dummies and float columns and once on :class:`FeatureMatrix`.
+    Peak allocations are traced with tracemalloc, so the difference is the
+    input conversion each library performs per call.
+    """
+    preprocessor = Preprocessor().fit(data)
+    shared = FeatureMatrix.build(data, preprocessor)
+    train_rows, test_rows = shared.split_rows(test_size=test_size, random_state=random_state)
+    train, test = shared.take(train_rows), shared.take(test_rows)
+    frame = preprocessor.transform(data)
+    frame_train, frame_test = frame.iloc[train_rows], frame.iloc[test_rows]
+
+    rows = []
+    for name in models:
+        for label, X_train, X_test in (('frame', frame_train, frame_test), ('float32', train.X, test.X)):
+            model = make_model(name, n_estimators=n_estimators, random_state=random_state)
+            _, fit_seconds, fit_peak = traced_call(model.fit, X_train, train.y)
+            proba, predict_seconds, predict_peak = traced_call(model.predict_proba, X_test)
+            rows.append({
+                'model': name,
+                'input': label,
+                'fit_s': fit_seconds,
+                'fit_peak_mb': fit_peak / 2**20,
+                'predict_proba_s': predict_seconds,
+                'predict_peak_mb': predict_peak / 2**20,
+                'checksum': float(proba[:, 1].sum()),
+            })
+    table = pd.DataFrame(rows)
+    # Memory the float32 matrix saves per call, relative to the frame input
+    peaks = table.set_index(['model', 'input'])[['fit_peak_mb', 'predict_peak_mb']]
+    saved = peaks.xs('frame', level='input') - peaks.xs('float32', level='input')
+    print(f"Shared float32 matrix: {shared.nbytes / 2**20:.1f} MB for {len(shared)} rows")
+    print('Peak allocation saved per call (MB):')
+    print(saved.to_string(float_format='%.2f'))
+    return table
+
+
+# Always on, whatever SHINKANSEN_INSTRUMENT says
+_RECORDER = instrument.Recorder()
+
+
+def _timed(results, stage, rows, func, *args, model='', **kwargs):
+    """Run one stage, append its timing and memory row and return its result."""
+    with _RECORDER.stage(stage, detail=model or None, rows=rows) as record:
+        result = func(*args, **kwargs)
+    results.append(dict({'stage': stage, 'model': model, 'rows': rows},
+                        **{key: record[key] for key in ('seconds', 'cpu_seconds', 'peak_rss_mb', 'rss_delta_mb')}))
+    return result
+
+
+def _pipeline_stages(paths, models, n_estimators, random_state, output_path):
+    """Every pipeline stage on one synthetic data set; runs in a fresh process."""
+    from shinkansen import scoring
+
+    results = []
+    travel = _timed(results, 'csv_load:travel', None, ingest.read_csv, paths['travel_train'])
+    survey = _timed(results, 'csv_load:survey', None, ingest.read_csv, paths['survey_train'])
+    results[0]['rows'], results[1]['rows'] = len(travel), len(survey)
+    data = _timed(results, 'merge', len(travel), pipeline.merge, travel, survey)
+    del travel, survey
+    preprocessor = _timed(results, 'impute_fit', len(data), Preprocessor().fit, data)
+    _timed(results, 'impute', len(data), preprocessor.impute, data)
+    matrix = _timed(results, 'encode', len(data), FeatureMatrix.build, data, preprocessor)
+    del data
+    train, test = matrix.split(random_state=random_state)
+    del matrix
+
+    fitted = {}
+    for name in models:
+        model = make_model(name, n_estimators=n_estimators, random_state=random_state)
+        fitted[name] = _timed(results, 'fit', len(train), model.fit, train.X, train.y, model=name)
+        _timed(results, 'predict_proba', len(test), model.predict_proba, test.X, model=name)
+
+    artifact = {'model': fitted[models[0]], 'preprocessor': preprocessor}
+    stats = _timed(results, 'score_stream', None, scoring.score_stream, artifact, paths['travel_test'],
+                   paths['survey_test'], output_path, report_every=0, model=models[0])
+    results[-1]['rows'] = stats['rows']
+    return results
+
+
+def pipeline_suite(scales=(1, 10), models=MODEL_NAMES, n_estimators=200, work_dir=None, random_state=0,
+                   profile=None):
+    """Time and memory-profile every stage at each multiple of the training set size.
+
+    Synthetic files are generated under ``work_dir/<scale>x`` unless they
+    exist already. Each scale runs in its own process, so peak RSS reflects
+    that scale alone.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    from shinkansen import synth
+
+    work_dir = work_dir or os.path.join(config.CACHE_DIR, 'synthetic')
+    tables = []
+    for scale in scales:
+        data_dir = os.path.join(work_dir, f'{scale:g}x')
+        names = [config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE, config.TRAVEL_TEST_FILE,
+                 config.SURVEY_TEST_FILE]
+        if all(os.path.exists(os.path.join(data_dir, name)) for name in names):
+            paths = dict(zip(['travel_train', 'survey_train', 'travel_test', 'survey_test'],
+                             [os.path.join(data_dir, name) for name in names]))
+        else:
+            start = time.perf_counter()
+            paths = synth.generate(data_dir, scale, profile, seed=random_state)
+            print(f"Generated {scale:g}x data in {data_dir} in {time.perf_counter() - start:.1f}s")
+        output = os.path.join(data_dir, 'scored.csv')
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            rows = pool.submit(_pipeline_stages, paths, list(models), n_estimators, random_state, output).result()
+        print(f"Benchmarked {scale:g}x in {time.perf_counter() - start:.1f}s")
+        table = pd.DataFrame(rows)
+        table.insert(0, 'scale', scale)
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+
+def write_results(table, path):
+    """Write a results table as JSON with the commit and environment it was measured on."""
+    with open(path, 'w') as f:
+        json.dump({'meta': instrument.metadata(), 'results': table.to_dict(orient='records')}, f, indent=1)
+
+
+def read_results(path):
+    with open(path) as f:
+        return pd.DataFrame(json.load(f)['results'])
+
+
+def compare(baseline, table, tolerance=0.2, min_seconds=0.05, min_mb=8.0):
+    """Stage-by-stage ratios of ``table`` to ``baseline``, flagging regressions.
+
+    A stage regresses when it is more than ``tolerance`` slower (or larger
+    in peak RSS) and the difference is above the noise floor of
+    ``min_seconds`` (or ``min_mb``).
+    """
+    keys = ['scale', 'stage', 'model']
+    baseline = baseline.fillna({'model': ''}).groupby(keys, as_index=False)[['seconds', 'peak_rss_mb']].sum()
+    current = table.fillna({'model': ''}).groupby(keys, as_index=False)[['seconds', 'peak_rss_mb']].sum()
+    merged = current.merge(baseline, on=keys, suffixes=('', '_base'))
+    merged['time_ratio'] = merged['seconds'] / merged['seconds_base']
+    merged['rss_ratio'] = merged['peak_rss_mb'] / merged['peak_rss_mb_base']
+    slower = (merged['time_ratio'] > 1 + tolerance) & (merged['seconds'] - merged['seconds_base'] > min_seconds)
+    larger = (merged['rss_ratio'] > 1 + tolerance) & (merged['peak_rss_mb'] - merged['peak_rss_mb_base'] > min_mb)
+    merged['regression'] = slower | larger
+    return merged
+
+
+def run(suite, travel_path, survey_path, cache_dir=None, **kwargs):
+    """Run one benchmark suite on a training file pair and return its table.
+
+    The ``pipeline`` suite makes its own synthetic files and ignores the pair.
+    """
+    if suite == 'pipeline':
+        return pipeline_suite(**kwargs)
+    data = pipeline.merge(*pipeline.load_raw(travel_path, survey_path, cache_dir))
+    if suite == 'encodings':
+        return encodings(data, **kwargs)
+    if suite == 'matrix':
+        return matrix(data, **kwargs)
+    raise ValueError(f'unknown benchmark suite {suite!r}')
+
@@ -0,0 +1,796 @@
+"""Command line entry point: ``python -m shinkansen <command>``.
+
+Every subcommand imports its stage lazily, so ``predict`` only loads pandas
+and the model libraries and ``eda`` is the only path that loads the plotting
+stack.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from shinkansen import config
+from shinkansen.models import MODEL_NAMES
+
+# Reference point for the cold-start measurement of `predict`
+_START = time.perf_counter()
+
+
+def _add_data_args(parser, travel_file, survey_file):
+    parser.add_argument('--data-dir', default=config.DATA_DIR,
+                        help='directory holding the hackathon .csv files (default: %(default)s)')
+    parser.add_argument('--travel', help=f'Traveldata file (default: <data-dir>/{travel_file})')
+    parser.add_argument('--survey', help=f'Surveydata file (default: <data-dir>/{survey_file})')
+
+
+def _add_registry_args(parser):
+    parser.add_argument('--registry', metavar='NAME', help='use a model from the registry instead of --model')
+    parser.add_argument('--version', type=int, default=None, help='registry version (default: the latest)')
+    parser.add_argument('--native', action='store_true',
+                        help='score a registered booster with its own library instead of its flat trees')
+
+
+def _data_paths(args, travel_file, survey_file):
+    travel = args.travel or config.data_path(args.data_dir, travel_file)
+    survey = args.survey or config.data_path(args.data_dir, survey_file)
+    return travel, survey
+
+
+def _cache_dir(args):
+    return None if args.no_cache else args.cache_dir
+
+
+def _model_path(args):
+    return args.model or config.data_path(args.model_dir, config.MODEL_FILE)
+
+
+def cmd_train(args):
+    from shinkansen import pipeline
+
+    travel, survey = _data_paths(args, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    pipeline.train(travel, survey, _model_path(args), model_name=args.family, n_estimators=args.n_estimators,
+                   test_size=args.test_size, random_state=args.seed, cache_dir=_cache_dir(args),
+                   encoding=args.encoding, native_categorical=args.native_categorical,
+                   early_stopping_rounds=args.early_stopping_rounds, checkpoint_dir=args.checkpoint_dir,
+                   checkpoint_every=args.checkpoint_every, resume=args.resume, max_model_mb=args.max_model_mb)
+    return 0
+
+
+def cmd_zoo(args):
+    from shinkansen import zoo
+
+    travel, survey = _data_paths(args, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    zoo.run(travel, survey, _model_path(args), names=args.models, cores=args.cores,
+            compare_sequential=args.compare_sequential, test_size=args.test_size, random_state=args.seed,
+            cache_dir=_cache_dir(args), encoding=args.encoding, n_estimators=args.n_estimators,
+            early_stopping_rounds=args.early_stopping_rounds)
+    return 0
+
+
+def cmd_tune(args):
+    from shinkansen import tuning
+
+    travel, survey = _data_paths(args, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    store = args.store or config.data_path(args.model_dir, 'tuning.sqlite')
+    history = tuning.run(travel, survey, name=args.family, test_size=args.test_size, random_state=args.seed,
+                         cache_dir=_cache_dir(args), encoding=args.encoding, store_path=store, study=args.study,
+                         n_trials=args.trials, workers=args.workers, cores=args.cores, max_rounds=args.max_rounds,
+                         min_rounds=args.min_rounds, eta=args.eta, early_stopping_rounds=args.early_stopping_rounds)
+    if args.output:
+        history.to_csv(args.output, index=False)
+    return 0
+
+
+def cmd_cv(args):
+    from shinkansen import cv
+
+    travel, survey = _data_paths(args, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    table = cv.run(travel, survey, names=args.models, n_folds=args.folds, random_state=args.seed,
+                   cache_dir=_cache_dir(args), encoding=args.encoding, num_boost_round=args.n_estimators,
+                   early_stopping_rounds=args.early_stopping_rounds, workers=args.workers, cores=args.cores,
+                   compare_naive=args.compare_naive)
+    if args.output:
+        table.to_csv(args.output, index=False)
+    return 0
+
+
+def _registry(args):
+    from shinkansen.registry import Registry
+
+    return Registry(os.path.join(args.model_dir, 'registry'))
+
+
+def _load_artifact(args):
+    """The --registry version if one is named, else the --model artifact."""
+    if args.registry:
+        return _registry(args).load(args.registry, args.version, native=args.native).artifact()
+    from shinkansen import pipeline
+
+    return pipeline.load_model(_model_path(args), mmap_mode='r')
+
+
+def cmd_predict(args):
+    from shinkansen import pipeline
+
+    artifact = _load_artifact(args)
+    if args.registry:
+        # Registry models load lazily; count the model file in the cold start too
+        artifact['model'].load()
+    cold_start = time.perf_counter() - _START
+    loaded = [name for name in config.PLOTTING_MODULES if name in sys.modules]
+    print(f"Cold start: {cold_start:.3f}s (budget {args.cold_start_budget:.3f}s)")
+    if loaded:
+        print(f"Warning: plotting modules loaded during predict: {', '.join(loaded)}", file=sys.stderr)
+    if cold_start > args.cold_start_budget:
+        print(f"Warning: cold start exceeded the budget by {cold_start - args.cold_start_budget:.3f}s",
+              file=sys.stderr)
+        if args.strict_budget:
+            return 3
+
+    travel, survey = _data_paths(args, config.TRAVEL_TEST_FILE, config.SURVEY_TEST_FILE)
+    if args.chunk_size:
+        from shinkansen import scoring
+
+        scoring.score_stream(artifact, travel, survey, args.output, chunk_size=args.chunk_size)
+    else:
+        pipeline.predict(artifact, travel, survey, args.output, cache_dir=_cache_dir(args))
+    return 0
+
+
+def cmd_serve(args):
+    import asyncio
+
+    from shinkansen import serve
+
+    artifact = _load_artifact(args)
+    try:
+        asyncio.run(serve.serve(artifact, host=args.host, port=args.port, max_batch=args.max_batch,
+                                max_wait=args.max_wait_ms / 1e3, registry=_registry(args) if args.registry else None,
+                                name=args.registry))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def cmd_eda(args):
+    from shinkansen import eda
+
+    travel, survey = _data_paths(args, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    eda.run(travel, survey, args.output_dir, cache_dir=_cache_dir(args), mode='full' if args.full else 'aggregate',
+            workers=args.workers, sample_size=args.sample_size)
+    return 0
+
+
+def cmd_fit_stream(args):
+    from shinkansen import pipeline
+
+    travel, survey = _data_paths(args, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    start = time.perf_counter()
+    streamed = pipeline.fit_streaming(travel, survey, args.chunk_size, args.encoding, args.k)
+    print(f"Fitted in one pass of {args.chunk_size}-row chunks in {time.perf_counter() - start:.2f}s")
+    if args.compare:
+        data = pipeline.merge(*pipeline.load_raw(travel, survey, _cache_dir(args)))
+        exact = pipeline.Preprocessor(encoding=args.encoding).fit(data)
+        table = pipeline.compare_fits(streamed, exact, data)
+        print(table.to_string(index=False))
+        if streamed.vocabulary != exact.vocabulary:
+            print("Vocabularies differ from the in-memory fit")
+    else:
+        for col, value in streamed.fill_values.items():
+            print(f"{col}: {value}")
+    if args.output:
+        streamed.save(args.output)
+        print(f"Preprocessing written to {args.output}")
+    return 0
+
+
+def cmd_explain(args):
+    from shinkansen import attribution
+
+    travel, survey = _data_paths(args, config.TRAVEL_TEST_FILE, config.SURVEY_TEST_FILE)
+    start = time.perf_counter()
+    try:
+        gain, frame, summary = attribution.explain(
+            _model_path(args), travel, survey, cache_dir=_cache_dir(args), batch_size=args.batch_size,
+            workers=args.workers, cores=args.cores, max_rows=args.max_rows, budget=args.budget)
+    except ValueError as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+    print(f"Explained {len(frame)} rows in {time.perf_counter() - start:.2f}s")
+    table = summary.join(gain.rename('gain_share'))
+    print(table.head(args.top).to_string(float_format='%.4f'))
+    if args.output:
+        if args.output.endswith('.parquet'):
+            frame.to_parquet(args.output)
+        else:
+            frame.to_csv(args.output)
+        print(f"Contributions written to {args.output}")
+    return 0
+
+
+def cmd_evaluate(args):
+    from shinkansen import evaluation
+
+    travel, survey = _data_paths(args, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    evaluation.run(travel, survey, names=args.models, artifacts=args.artifacts, cores=args.cores,
+                   test_size=args.test_size, random_state=args.seed, cache_dir=_cache_dir(args),
+                   encoding=args.encoding, n_boot=args.n_boot, confidence=args.confidence, workers=args.workers,
+                   threshold=args.threshold, curves_path=args.curves, output_path=args.output,
+                   n_estimators=args.n_estimators, early_stopping_rounds=args.early_stopping_rounds)
+    return 0
+
+
+def cmd_distill(args):
+    from shinkansen import distill
+
+    travel, survey = _data_paths(args, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    unlabeled = None
+    if not args.no_unlabeled:
+        unlabeled = _data_paths(args, config.TRAVEL_TEST_FILE, config.SURVEY_TEST_FILE)
+        if not all(os.path.exists(path) for path in unlabeled):
+            unlabeled = None
+    students = [tuple(int(part) for part in spec.split('x')) for spec in args.students] if args.students else None
+    holdout = (args.holdout_travel, args.holdout_survey) if args.holdout_travel else None
+    distill.run(_model_path(args), travel, survey, unlabeled_paths=unlabeled, holdout_paths=holdout,
+                test_size=args.test_size, random_state=args.seed, cache_dir=_cache_dir(args), students=students,
+                linear=not args.no_linear, latency_rows=args.latency_rows, max_p99_ms=args.max_p99_ms,
+                max_bytes=args.max_bytes, output_path=args.output, report_path=args.report)
+    return 0
+
+
+def cmd_load_bench(args):
+    from shinkansen import forest, pipeline
+    from shinkansen.matrix import FeatureMatrix
+
+    travel, survey = _data_paths(args, config.TRAVEL_TEST_FILE, config.SURVEY_TEST_FILE)
+    artifact = pipeline.load_model(_model_path(args), mmap_mode='r')
+    data = pipeline.merge(*pipeline.load_raw(travel, survey, _cache_dir(args)))
+    X = FeatureMatrix.build(data.head(args.rows), artifact['preprocessor']).X
+    del artifact
+    table = forest.load_benchmark(_model_path(args), X, processes=args.processes)
+    if args.output:
+        table.to_csv(args.output, index=False)
+    return 0
+
+
+def cmd_register(args):
+    from shinkansen import pipeline
+    from shinkansen.matrix import FeatureMatrix
+
+    artifact = pipeline.load_model(_model_path(args))
+    extra = {key: value for key, value in artifact.items() if key not in ('model', 'preprocessor', 'report')}
+    paths = _data_paths(args, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    # Rows on which the flat copy of a booster must reproduce it
+    data = pipeline.merge(*pipeline.load_raw(*paths, _cache_dir(args)))
+    check = FeatureMatrix.build(data.head(args.check_rows), artifact['preprocessor']).X
+    registry = _registry(args)
+    version = registry.register(args.name, artifact['model'], artifact['preprocessor'], artifact['report'],
+                                data_paths=paths, cache_dir=_cache_dir(args), check=check, **extra)
+    meta = registry.meta(args.name, version)
+    print(f"Registered {_model_path(args)} as {args.name} v{version} ({meta['format']} format"
+          f"{', with flat trees' if meta['flat'] else ''}) in {registry.path(args.name, version)}")
+    return 0
+
+
+def cmd_registry(args):
+    table = _registry(args).table()
+    if table.empty:
+        print('No registered models')
+    else:
+        print(table.to_string(index=False, float_format='%.5f'))
+    return 0
+
+
+def cmd_ensemble(args):
+    from shinkansen import ensemble
+
+    travel, survey = _data_paths(args, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    ensemble.run(travel, survey, _model_path(args), names=args.models, cores=args.cores, test_size=args.test_size,
+                 random_state=args.seed, cache_dir=_cache_dir(args), encoding=args.encoding, mode=args.cascade_mode,
+                 cheap=args.cheap, tolerance=args.tolerance, n_estimators=args.n_estimators,
+                 early_stopping_rounds=args.early_stopping_rounds)
+    return 0
+
+
+def cmd_update(args):
+    from shinkansen import incremental
+
+    travel, survey = _data_paths(args, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    holdout = (args.holdout_travel, args.holdout_survey) if args.holdout_travel else None
+    base = None
+    if args.compare_full:
+        base = (os.path.join(args.compare_full, config.TRAVEL_TRAIN_FILE),
+                os.path.join(args.compare_full, config.SURVEY_TRAIN_FILE))
+    report = incremental.update(_model_path(args), travel, survey, output_path=args.output, holdout_paths=holdout,
+                                n_estimators=args.n_estimators, early_stopping_rounds=args.early_stopping_rounds,
+                                test_size=args.test_size, tolerance=args.tolerance, cache_dir=_cache_dir(args),
+                                compare_full=base)
+    if not report['accepted']:
+        print(f"Update rejected; {args.output or _model_path(args)} was not written", file=sys.stderr)
+        return 1
+    return 0
+
+
+def cmd_store(args):
+    from shinkansen import ingest
+    from shinkansen.store import RecordStore
+
+    # Load the model before touching the store, so a bad --model or --registry changes nothing
+    artifact = _load_artifact(args) if args.predictions else None
+    store = RecordStore(args.store)
+    for side, paths in (('travel', args.travel), ('survey', args.survey)):
+        for path in paths:
+            queued = store.upsert(ingest.load(path, _cache_dir(args)), side)
+            print(f"Upserted {path}; {queued} passengers completed")
+    if args.output or args.predictions:
+        batch = store.pending()
+        if args.output:
+            batch.to_csv(args.output, index=False)
+            print(f"{len(batch)} merged rows written to {args.output}")
+        if args.predictions:
+            import numpy as np
+            import pandas as pd
+
+            from shinkansen.matrix import FeatureMatrix
+
+            matrix = FeatureMatrix.build(batch, artifact['preprocessor'])
+            pred = artifact['model'].predict(matrix.X) if len(matrix) else np.empty(0, dtype=np.int64)
+            pd.DataFrame({config.ID_COL: matrix.ids, config.TARGET_COL: np.asarray(pred)}).to_csv(
+                args.predictions, index=False)
+            print(f"{len(matrix)} predictions written to {args.predictions}")
+        # Only now are the passengers taken; a failure above leaves them queued for the next run
+        store.commit(batch)
+    summary = store.summary()
+    print(', '.join(f'{key} {value}' for key, value in summary.items()))
+    return 0
+
+
+def cmd_store_bench(args):
+    from shinkansen import store
+
+    travel, survey = _data_paths(args, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    table = store.benchmark(travel, survey, args.store, batches=args.batches, lag=args.lag, seed=args.seed,
+                            cache_dir=_cache_dir(args))
+    print(table.to_string(index=False, float_format='%.4f'))
+    print(f"Total: store {table['store_seconds'].sum():.3f}s, re-merge {table['merge_seconds'].sum():.3f}s; "
+          f"same rows at every step: {bool(table['same'].all())}")
+    if args.output:
+        table.to_csv(args.output, index=False)
+    return 0 if table['same'].all() else 1
+
+
+def cmd_nullity(args):
+    from shinkansen import stages
+
+    travel, survey = _data_paths(args, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    index = stages.nullity(travel, survey, _cache_dir(args))
+    summary = index.summary()
+    print(summary[summary['missing'] > 0].to_string(float_format='%.3f'))
+    patterns = index.patterns().head(args.top)
+    print(f"\n{len(index.patterns())} missingness patterns over {len(index)} rows; most frequent:")
+    for rows, missing in zip(patterns['rows'], patterns['missing']):
+        print(f"{rows:>9}  {', '.join(missing) or '(complete)'}")
+    if args.output:
+        index.save(args.output)
+        print(f"Nullity index written to {args.output}")
+    return 0
+
+
+def cmd_ingest(args):
+    from shinkansen import ingest
+
+    names = [config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE, config.TRAVEL_TEST_FILE, config.SURVEY_TEST_FILE]
+    paths = args.files or [config.data_path(args.data_dir, name) for name in names]
+    if args.benchmark:
+        print(ingest.benchmark(paths, args.cache_dir).to_string(index=False, float_format='%.3f'))
+    else:
+        for path in paths:
+            ingest.load(path, args.cache_dir)
+            print(f"Cached {path} in {ingest.cache_path(path, args.cache_dir)}")
+    return 0
+
+
+def cmd_cache(args):
+    from shinkansen import stages
+
+    cache = stages.StageCache(args.cache_dir)
+    if args.clear:
+        cache.clear()
+        print(f"Cleared {cache.root}")
+        return 0
+    entries = cache.entries()
+    for path, size, used in entries:
+        print(f"{os.path.basename(path):<40} {size / 2**20:9.1f} MB  used {time.time() - used:,.0f}s ago")
+    total = sum(size for _, size, _ in entries)
+    print(f"{len(entries)} entries, {total / 2**20:.1f} of {cache.max_bytes / 2**20:.0f} MB")
+    return 0
+
+
+def cmd_bench(args):
+    from shinkansen import bench
+
+    kwargs = {'models': args.models}
+    if args.n_estimators:
+        kwargs['n_estimators'] = args.n_estimators
+    if args.suite == 'pipeline':
+        from shinkansen import synth
+
+        kwargs.update(scales=args.scales, work_dir=args.work_dir or os.path.join(args.cache_dir, 'synthetic'),
+                      profile=synth.load_profile(args.profile) if args.profile else None)
+    travel, survey = _data_paths(args, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    table = bench.run(args.suite, travel, survey, cache_dir=_cache_dir(args), **kwargs)
+    print(table.to_string(index=False, float_format='%.4f'))
+    if args.output:
+        if args.output.endswith('.json'):
+            bench.write_results(table, args.output)
+        else:
+            table.to_csv(args.output, index=False)
+    if args.baseline:
+        comparison = bench.compare(bench.read_results(args.baseline), table, tolerance=args.tolerance)
+        print(comparison[['scale', 'stage', 'model', 'seconds_base', 'seconds', 'time_ratio', 'peak_rss_mb_base',
+                          'peak_rss_mb', 'rss_ratio', 'regression']].to_string(index=False, float_format='%.3f'))
+        regressions = comparison[comparison['regression']]
+        if len(regressions):
+            print(f"{len(regressions)} stages regressed against {args.baseline}", file=sys.stderr)
+            return 1
+    return 0
+
+
+def cmd_synth(args):
+    from shinkansen import synth
+
+    if args.save_profile:
+        travel, survey = _data_paths(args, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+        synth.save_profile(synth.profile(travel, survey), args.save_profile)
+        print(f"Profile of {travel} and {survey} written to {args.save_profile}")
+        return 0
+    profile = synth.load_profile(args.profile) if args.profile else None
+    for path in synth.generate(args.output_dir, args.scale, profile, seed=args.seed).values():
+        print(f"Wrote {path}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='shinkansen', description=__doc__.splitlines()[0])
+    parser.add_argument('--model-dir', default=config.MODEL_DIR,
+                        help='directory for trained artifacts (default: %(default)s)')
+    parser.add_argument('--cache-dir', default=config.CACHE_DIR,
+                        help='directory for the columnar .csv cache (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true', help='always parse the .csv files')
+    parser.add_argument('--model', help=f'model artifact path (default: <model-dir>/{config.MODEL_FILE})')
+    parser.add_argument('--metrics', default=os.environ.get('SHINKANSEN_METRICS'),
+                        help='write wall time, CPU time, peak RSS and rows of every stage to this .json or .csv '
+                             '(default: $SHINKANSEN_METRICS)')
+    parser.add_argument('--profile-stage', help='profile the first run of this stage, e.g. fit or train/prepare')
+    parser.add_argument('--profile-output',
+                        help='profile file: .prof for cProfile, anything else for collapsed stacks '
+                             '(default: <stage>.prof)')
+    parser.add_argument('--no-instrument', action='store_true', help='do not record stage metrics')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('train', help='fit a model on the training files')
+    _add_data_args(p, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    p.add_argument('--family', choices=MODEL_NAMES, default='lightgbm', help='model family (default: %(default)s)')
+    p.add_argument('--n-estimators', type=int, default=None,
+                   help='most trees to build (default: 10000 boosting rounds, 1000 forest trees)')
+    p.add_argument('--early-stopping-rounds', type=int, default=150,
+                   help='stop after this many trees without a better validation log loss (default: %(default)s)')
+    p.add_argument('--checkpoint-dir', help='save the partially trained model here while training')
+    p.add_argument('--checkpoint-every', type=int, default=500, help='trees between checkpoints (default: %(default)s)')
+    p.add_argument('--resume', action='store_true', help='continue from the checkpoint in --checkpoint-dir')
+    p.add_argument('--test-size', type=float, default=0.2)
+    p.add_argument('--seed', type=int, default=None, help='random state of the train/test split')
+    p.add_argument('--encoding', choices=['onehot', 'ordinal'], default='onehot',
+                   help='dummy columns per level, or one int8 code per categorical column')
+    p.add_argument('--native-categorical', action='store_true',
+                   help='pass ordinal-encoded columns to LightGBM as categorical features')
+    p.add_argument('--max-model-mb', type=float, default=None,
+                   help='grow the random_forest within this model size and save it as memory-mappable arrays')
+    p.set_defaults(func=cmd_train)
+
+    p = sub.add_parser('zoo', help='fit every model family in parallel and keep the best')
+    _add_data_args(p, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    p.add_argument('--models', nargs='+', choices=MODEL_NAMES, default=list(MODEL_NAMES))
+    p.add_argument('--cores', type=int, default=None, help='cores shared by the models (default: all)')
+    p.add_argument('--compare-sequential', action='store_true',
+                   help='train the zoo again one model at a time and compare the wall clock')
+    p.add_argument('--n-estimators', type=int, default=None,
+                   help='most trees to build (default: 10000 boosting rounds, 1000 forest trees)')
+    p.add_argument('--early-stopping-rounds', type=int, default=150,
+                   help='stop after this many trees without a better validation log loss (default: %(default)s)')
+    p.add_argument('--test-size', type=float, default=0.2)
+    p.add_argument('--seed', type=int, default=None, help='random state of the train/test split')
+    p.add_argument('--encoding', choices=['onehot', 'ordinal'], default='onehot',
+                   help='dummy columns per level, or one int8 code per categorical column')
+    p.set_defaults(func=cmd_zoo)
+
+    p = sub.add_parser('tune', help='search hyperparameters with hyperopt, resuming a stored search')
+    _add_data_args(p, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    p.add_argument('--family', choices=['lightgbm', 'xgboost'], default='lightgbm',
+                   help='model family (default: %(default)s)')
+    p.add_argument('--trials', type=int, default=50,
+                   help='trials to finish, counting resumed ones (default: %(default)s)')
+    p.add_argument('--store', help='SQLite trial store (default: <model-dir>/tuning.sqlite)')
+    p.add_argument('--study', help='name of the search within the store (default: the family)')
+    p.add_argument('--workers', type=int, default=None, help='trials run at once (default: one per core)')
+    p.add_argument('--cores', type=int, default=None, help='cores shared by the workers (default: all)')
+    p.add_argument('--max-rounds', type=int, default=2000, help='most boosting rounds per trial (default: %(default)s)')
+    p.add_argument('--min-rounds', type=int, default=100,
+                   help='rounds at the first successive-halving rung (default: %(default)s)')
+    p.add_argument('--eta', type=int, default=3,
+                   help='rung spacing; the best 1/eta of trials pass each rung (default: %(default)s)')
+    p.add_argument('--early-stopping-rounds', type=int, default=50,
+                   help='stop a trial after this many rounds without improvement (default: %(default)s)')
+    p.add_argument('--test-size', type=float, default=0.2)
+    p.add_argument('--seed', type=int, default=None, help='random state of the split and the search (default: 0)')
+    p.add_argument('--encoding', choices=['onehot', 'ordinal'], default='onehot',
+                   help='dummy columns per level, or one int8 code per categorical column')
+    p.add_argument('--output', help='also write the trial history to this .csv')
+    p.set_defaults(func=cmd_tune)
+
+    p = sub.add_parser('cv', help='k-fold cross-validation on datasets binned once')
+    _add_data_args(p, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    p.add_argument('--models', nargs='+', choices=['lightgbm', 'xgboost'], default=['lightgbm', 'xgboost'])
+    p.add_argument('--folds', type=int, default=5, help='number of stratified folds (default: %(default)s)')
+    p.add_argument('--workers', type=int, default=None, help='folds trained at once (default: one per core)')
+    p.add_argument('--cores', type=int, default=None, help='cores shared by the folds (default: all)')
+    p.add_argument('--n-estimators', type=int, default=None, help='most boosting rounds (default: 10000)')
+    p.add_argument('--early-stopping-rounds', type=int, default=150,
+                   help='stop a fold after this many rounds without improvement (default: %(default)s)')
+    p.add_argument('--seed', type=int, default=0, help='random state of the folds (default: %(default)s)')
+    p.add_argument('--encoding', choices=['onehot', 'ordinal'], default='onehot',
+                   help='dummy columns per level, or one int8 code per categorical column')
+    p.add_argument('--compare-naive', action='store_true',
+                   help='also refit every fold from the raw matrix and compare the wall clock')
+    p.add_argument('--output', help='also write the per-fold table to this .csv')
+    p.set_defaults(func=cmd_cv)
+
+    p = sub.add_parser('predict', help='score the test files with a trained model')
+    _add_data_args(p, config.TRAVEL_TEST_FILE, config.SURVEY_TEST_FILE)
+    p.add_argument('--output', default=config.RESULTS_FILE,
+                   help='submission .csv, or .parquet with --chunk-size (default: %(default)s)')
+    p.add_argument('--chunk-size', type=int, default=None,
+                   help='stream both files in chunks of this many rows instead of loading them whole')
+    p.add_argument('--cold-start-budget', type=float, default=config.PREDICT_COLD_START_BUDGET,
+                   help='seconds allowed until the model is loaded (default: %(default)s)')
+    p.add_argument('--strict-budget', action='store_true',
+                   help='exit with status 3 instead of warning when the budget is exceeded')
+    _add_registry_args(p)
+    p.set_defaults(func=cmd_predict)
+
+    p = sub.add_parser('serve', help='run the HTTP scoring service')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8000)
+    p.add_argument('--max-batch', type=int, default=256, help='records per micro-batch (default: %(default)s)')
+    p.add_argument('--max-wait-ms', type=float, default=5.0,
+                   help='longest wait for a micro-batch to fill, in ms (default: %(default)s)')
+    _add_registry_args(p)
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser('eda', help='render the exploratory analysis figures')
+    _add_data_args(p, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    p.add_argument('--output-dir', default='eda', help='figure directory (default: %(default)s)')
+    p.add_argument('--full', action='store_true',
+                   help='draw every figure from the full frames, as the notebook does, instead of from one '
+                        'pass of counts and a sample')
+    p.add_argument('--workers', type=int, help='figures rendered in parallel (default: all cores)')
+    p.add_argument('--sample-size', type=int, default=5000,
+                   help='rows in the stratified sample behind the scatter and pair plots '
+                        '(default: %(default)s)')
+    p.set_defaults(func=cmd_eda)
+
+    p = sub.add_parser('fit-stream', help='fit the imputation values in one streaming pass over chunks')
+    _add_data_args(p, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    p.add_argument('--chunk-size', type=int, default=50000, help='rows per chunk (default: %(default)s)')
+    p.add_argument('--encoding', choices=['onehot', 'ordinal'], default='onehot')
+    p.add_argument('-k', type=int, default=1000,
+                   help='quantile sketch size; larger is more accurate (default: %(default)s)')
+    p.add_argument('--compare', action='store_true',
+                   help='also fit in memory and report the error of every imputation value')
+    p.add_argument('--output', help='write the fitted preprocessing to this .json file')
+    p.set_defaults(func=cmd_fit_stream)
+
+    p = sub.add_parser('explain', help='gain importance and per-passenger TreeSHAP contributions')
+    _add_data_args(p, config.TRAVEL_TEST_FILE, config.SURVEY_TEST_FILE)
+    p.add_argument('--batch-size', type=int, default=10000, help='rows per batch (default: %(default)s)')
+    p.add_argument('--workers', type=int, help='batches explained at once (default: one per core)')
+    p.add_argument('--cores', type=int, help='threads shared by the batches (default: all cores)')
+    p.add_argument('--max-rows', type=int, help='explain a random sample of this many rows')
+    p.add_argument('--budget', type=float, help='stop starting batches after this many seconds (not cached)')
+    p.add_argument('--top', type=int, default=23, help='features to print (default: %(default)s)')
+    p.add_argument('--output', help='write the per-passenger contributions to this .csv or .parquet file')
+    p.set_defaults(func=cmd_explain)
+
+    p = sub.add_parser('evaluate', help='compare models on held-out rows with bootstrap confidence intervals')
+    _add_data_args(p, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    p.add_argument('--artifacts', nargs='+', metavar='MODEL',
+                   help='score these saved models on the data files instead of fitting the zoo on a split')
+    p.add_argument('--models', nargs='+', choices=MODEL_NAMES, default=list(MODEL_NAMES))
+    p.add_argument('--cores', type=int, default=None, help='cores shared by the models (default: all)')
+    p.add_argument('--n-estimators', type=int, default=None,
+                   help='most trees to build (default: 10000 boosting rounds, 1000 forest trees)')
+    p.add_argument('--early-stopping-rounds', type=int, default=150,
+                   help='stop after this many trees without a better validation log loss (default: %(default)s)')
+    p.add_argument('--test-size', type=float, default=0.2)
+    p.add_argument('--seed', type=int, default=None, help='random state of the split and the resamples')
+    p.add_argument('--encoding', choices=['onehot', 'ordinal'], default='onehot',
+                   help='dummy columns per level, or one int8 code per categorical column')
+    p.add_argument('--n-boot', type=int, default=1000, help='bootstrap resamples, 0 for none (default: %(default)s)')
+    p.add_argument('--confidence', type=float, default=0.95, help='interval coverage (default: %(default)s)')
+    p.add_argument('--workers', type=int, default=None, help='bootstrap worker processes (default: all cores)')
+    p.add_argument('--threshold', type=float, default=0.5,
+                   help='score above which a passenger is predicted satisfied (default: %(default)s)')
+    p.add_argument('--curves', help='write every ROC and precision-recall point to this .csv file')
+    p.add_argument('--output', help='write the comparison table to this .csv file')
+    p.set_defaults(func=cmd_evaluate)
+
+    p = sub.add_parser('distill', help='train small student models on the saved model\'s probabilities')
+    _add_data_args(p, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    p.add_argument('--no-unlabeled', action='store_true',
+                   help='do not add the unlabelled test files of --data-dir to the soft labels')
+    p.add_argument('--students', nargs='+', metavar='ROUNDSxDEPTH',
+                   help='tree students to fit, e.g. 50x3 200x6 (default: a grid from 25x3 to 400x6)')
+    p.add_argument('--no-linear', action='store_true', help='skip the linear student')
+    p.add_argument('--holdout-travel', help='labelled Traveldata file the teacher was not trained on, to report on')
+    p.add_argument('--holdout-survey', help='labelled Surveydata file the teacher was not trained on, to report on')
+    p.add_argument('--test-size', type=float, default=0.2,
+                   help='share of the labelled rows held out for the report when the artifact does not record '
+                        'its held-out rows (default: %(default)s)')
+    p.add_argument('--seed', type=int, default=0, help='random state of that split (default: %(default)s)')
+    p.add_argument('--latency-rows', type=int, default=500,
+                   help='rows scored one at a time for the latency percentiles (default: %(default)s)')
+    p.add_argument('--max-p99-ms', type=float, default=None, help='single-row p99 latency budget')
+    p.add_argument('--max-bytes', type=int, default=None, help='model size budget')
+    p.add_argument('--output', help='save the most accurate student within the budgets here')
+    p.add_argument('--report', help='write the report to this .csv file')
+    p.set_defaults(func=cmd_distill)
+
+    p = sub.add_parser('load-bench', help='load the saved model in several processes, with and without mmap')
+    _add_data_args(p, config.TRAVEL_TEST_FILE, config.SURVEY_TEST_FILE)
+    p.add_argument('--processes', type=int, default=4, help='concurrent scoring processes (default: %(default)s)')
+    p.add_argument('--rows', type=int, default=1000, help='rows each process scores (default: %(default)s)')
+    p.add_argument('--output', help='write the measurements to this .csv file')
+    p.set_defaults(func=cmd_load_bench)
+
+    p = sub.add_parser('register', help='store the saved model as the next version in the model registry')
+    _add_data_args(p, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    p.add_argument('--name', default='satisfaction', help='registry name (default: %(default)s)')
+    p.add_argument('--check-rows', type=int, default=2000,
+                   help='training rows the flat copy of a booster is checked on (default: %(default)s)')
+    p.set_defaults(func=cmd_register)
+
+    p = sub.add_parser('registry', help='list the versions in the model registry')
+    p.set_defaults(func=cmd_registry)
+
+    p = sub.add_parser('ensemble', help='fit every model family and save a weighted soft-voting ensemble')
+    _add_data_args(p, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    p.add_argument('--models', nargs='+', choices=MODEL_NAMES, default=list(MODEL_NAMES))
+    p.add_argument('--cores', type=int, default=None, help='cores shared by the members (default: all)')
+    p.add_argument('--cascade', dest='cascade_mode', action='store_const', const='cascade', default='blend',
+                   help='save the ensemble in cascade mode: the --cheap model first, the rest only when unsure')
+    p.add_argument('--cheap', choices=MODEL_NAMES, default='lightgbm',
+                   help='model scoring every row in cascade mode (default: %(default)s)')
+    p.add_argument('--tolerance', type=float, default=0.002,
+                   help='validation log loss the cascade may give up against the full blend (default: %(default)s)')
+    p.add_argument('--n-estimators', type=int, default=None,
+                   help='most trees to build (default: 10000 boosting rounds, 1000 forest trees)')
+    p.add_argument('--early-stopping-rounds', type=int, default=150,
+                   help='stop after this many trees without a better validation log loss (default: %(default)s)')
+    p.add_argument('--test-size', type=float, default=0.2,
+                   help='held-out share, halved into validation and report rows (default: %(default)s)')
+    p.add_argument('--seed', type=int, default=None, help='random state of the splits')
+    p.add_argument('--encoding', choices=['onehot', 'ordinal'], default='onehot',
+                   help='dummy columns per level, or one int8 code per categorical column')
+    p.set_defaults(func=cmd_ensemble)
+
+    p = sub.add_parser('update', help='continue boosting the saved model on a new labelled batch')
+    _add_data_args(p, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    p.add_argument('--n-estimators', type=int, default=500, help='most rounds to add (default: %(default)s)')
+    p.add_argument('--early-stopping-rounds', type=int, default=50,
+                   help='stop after this many rounds without improvement (default: %(default)s)')
+    p.add_argument('--test-size', type=float, default=0.2,
+                   help='share of the new rows held out for early stopping and the guardrail '
+                        '(default: %(default)s)')
+    p.add_argument('--holdout-travel', help='extra held-out Traveldata file for the guardrail')
+    p.add_argument('--holdout-survey', help='extra held-out Surveydata file for the guardrail')
+    p.add_argument('--tolerance', type=float, default=0.0,
+                   help='accept the update if held-out log loss rises by at most this much (default: %(default)s)')
+    p.add_argument('--output', help='write the updated artifact here instead of over --model')
+    p.add_argument('--compare-full', metavar='DATA_DIR',
+                   help='also rebuild from scratch on the training files in DATA_DIR plus the new batch')
+    p.set_defaults(func=cmd_update)
+
+    p = sub.add_parser('store', help='upsert arriving travel and survey files into the ID-indexed store')
+    p.add_argument('--store', default=config.STORE_DIR, help='store directory (default: %(default)s)')
+    p.add_argument('--travel', nargs='+', default=[], metavar='FILE', help='Traveldata files to upsert')
+    p.add_argument('--survey', nargs='+', default=[], metavar='FILE',
+                   help='Surveydata files to upsert, after the travel ones')
+    p.add_argument('--output', help='take the newly completed passengers and write their merged rows to this .csv')
+    p.add_argument('--predictions', help='take the newly completed passengers and write their predictions to this .csv')
+    _add_registry_args(p)
+    p.set_defaults(func=cmd_store)
+
+    p = sub.add_parser('store-bench', help='replay the training files as arriving batches: store against re-merging')
+    _add_data_args(p, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    p.add_argument('--store', default=os.path.join(config.CACHE_DIR, 'store-bench'),
+                   help='scratch store directory, emptied first (default: %(default)s)')
+    p.add_argument('--batches', type=int, default=20, help='travel batches (default: %(default)s)')
+    p.add_argument('--lag', type=int, default=2,
+                   help='batches between a travel record and its survey (default: %(default)s)')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--output', help='also write the per-batch table to this .csv')
+    p.set_defaults(func=cmd_store_bench)
+
+    p = sub.add_parser('nullity', help='report missing values per column and their co-missing patterns')
+    _add_data_args(p, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    p.add_argument('--top', type=int, default=10, help='patterns to list (default: %(default)s)')
+    p.add_argument('--output', help='save the per-row bitmask index to this .npz file')
+    p.set_defaults(func=cmd_nullity)
+
+    p = sub.add_parser('ingest', help='build the columnar cache of the .csv files')
+    p.add_argument('--data-dir', default=config.DATA_DIR,
+                   help='directory holding the hackathon .csv files (default: %(default)s)')
+    p.add_argument('files', nargs='*', help='.csv files to cache (default: the four files in <data-dir>)')
+    p.add_argument('--benchmark', action='store_true',
+                   help='report load time and peak RSS of untyped, typed and cached loading')
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser('cache', help='list or clear the cached merged, cleaned and encoded data')
+    p.add_argument('--clear', action='store_true', help='remove every stage entry')
+    p.set_defaults(func=cmd_cache)
+
+    p = sub.add_parser('bench', help='benchmark pipeline variants on the training files')
+    p.add_argument('suite', choices=['encodings', 'matrix', 'pipeline'])
+    _add_data_args(p, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    p.add_argument('--models', nargs='+', choices=MODEL_NAMES, default=list(MODEL_NAMES))
+    p.add_argument('--n-estimators', type=int, default=None,
+                   help='trees per model (default: 500, or 200 for the pipeline suite)')
+    p.add_argument('--scales', type=float, nargs='+', default=[1, 10],
+                   help='pipeline suite: multiples of the 94,379-row training set (default: 1 10)')
+    p.add_argument('--work-dir', help='pipeline suite: where synthetic files are kept (default: <cache-dir>/synthetic)')
+    p.add_argument('--profile', help='pipeline suite: data profile JSON written by `synth --save-profile`')
+    p.add_argument('--output', help='also write the table to this .csv, or to .json with the commit and environment')
+    p.add_argument('--baseline', help='results .json of an earlier run; exit with status 1 on regressions')
+    p.add_argument('--tolerance', type=float, default=0.2,
+                   help='relative slowdown or memory growth counted as a regression (default: %(default)s)')
+    p.set_defaults(func=cmd_bench)
+
+    p = sub.add_parser('synth', help='write synthetic Traveldata/Surveydata files at any scale')
+    _add_data_args(p, config.TRAVEL_TRAIN_FILE, config.SURVEY_TRAIN_FILE)
+    p.add_argument('--scale', type=float, default=1.0, help='multiple of the training set size (default: 1)')
+    p.add_argument('--output-dir', default='synthetic', help='directory for the four files (default: %(default)s)')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--profile', help='data profile JSON to reproduce (default: the built-in one)')
+    p.add_argument('--save-profile', metavar='PATH',
+                   help='instead of generating, measure the files in --data-dir and write their profile here')
+    p.set_defaults(func=cmd_synth)
+    return parser
+
+
+def _load_hook(spec):
+    """Import a ``module:function`` stage hook."""
+    import importlib
+
+    module, _, name = spec.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def main(argv=None):
+    from shinkansen import instrument
+
+    args = build_parser().parse_args(argv)
+    if args.no_instrument:
+        instrument.RECORDER.enabled = False
+    if os.environ.get('SHINKANSEN_STAGE_HOOK'):
+        instrument.add_hook(_load_hook(os.environ['SHINKANSEN_STAGE_HOOK']))
+    if args.profile_stage:
+        instrument.RECORDER.profile(args.profile_stage,
+                                    args.profile_output or args.profile_stage.replace('/', '_') + '.prof')
+    try:
+        with instrument.stage(args.command):
+            return args.func(args)
+    finally:
+        if args.metrics and instrument.RECORDER.enabled:
+            instrument.RECORDER.write(args.metrics)
+            print(f"Stage metrics written to {args.metrics}", file=sys.stderr)
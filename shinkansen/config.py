@@ -0,0 +1,78 @@
+"""Column lists, file names and defaults shared by every pipeline stage."""
+
+import os
+
+# Directory holding the four hackathon .csv files; override with --data-dir
+DATA_DIR = os.environ.get('SHINKANSEN_DATA_DIR', 'data')
+# Directory for the columnar copies of the .csv files; override with --cache-dir
+CACHE_DIR = os.environ.get('SHINKANSEN_CACHE_DIR', '.cache')
+# Most disk space the stage cache (merged, cleaned and encoded data) may use, in MB
+STAGE_CACHE_MB = int(os.environ.get('SHINKANSEN_STAGE_CACHE_MB', 2048))
+# Directory of the ID-indexed record store; override with `store --store`
+STORE_DIR = os.environ.get('SHINKANSEN_STORE_DIR', 'store')
+# Directory where trained artifacts are written; override with --model-dir
+MODEL_DIR = os.environ.get('SHINKANSEN_MODEL_DIR', 'models')
+
+# File names as provided for the hackathon
+TRAVEL_TRAIN_FILE = 'Traveldata_train.csv'
+SURVEY_TRAIN_FILE = 'Surveydata_train.csv'
+TRAVEL_TEST_FILE = 'Traveldata_test.csv'
+SURVEY_TEST_FILE = 'Surveydata_test.csv'
+
+# Default artifact and submission names
+MODEL_FILE = 'model.joblib'
+RESULTS_FILE = 'results.csv'
+
+ID_COL = 'ID'
+TARGET_COL = 'Overall_Experience'
+
+# Categorical columns in Traveldata
+TRAVEL_CATEGORY_COL = ['Gender', 'Customer_Type', 'Type_Travel', 'Travel_Class']
+# Numeric columns in Traveldata
+TRAVEL_NUMERIC_COL = ['Age', 'Travel_Distance', 'Departure_Delay_in_Mins', 'Arrival_Delay_in_Mins']
+# Categorical columns in Surveydata
+SURVEY_CATEGORY_COL = ['Seat_Comfort', 'Seat_Class', 'Arrival_Time_Convenient',
+                       'Catering', 'Platform_Location', 'Onboard_Wifi_Service',
+                       'Onboard_Entertainment', 'Online_Support', 'Ease_of_Online_Booking',
+                       'Onboard_Service', 'Legroom', 'Baggage_Handling', 'CheckIn_Service',
+                       'Cleanliness', 'Online_Boarding']
+# Full list of categorical column names
+CATEGORY_COL = TRAVEL_CATEGORY_COL + SURVEY_CATEGORY_COL
+
+# Answer scale of the survey ratings, from worst to best
+RATING_LEVELS = ['Extremely Poor', 'Poor', 'Needs Improvement', 'Acceptable', 'Good', 'Excellent']
+# Platform_Location uses its own convenience scale
+PLATFORM_LEVELS = ['Very Inconvenient', 'Inconvenient', 'Needs Improvement', 'Manageable',
+                   'Convenient', 'Very Convenient']
+# Known values of every categorical column
+CATEGORY_LEVELS = {
+    'Gender': ['Female', 'Male'],
+    'Customer_Type': ['Disloyal Customer', 'Loyal Customer'],
+    'Type_Travel': ['Business Travel', 'Personal Travel'],
+    'Travel_Class': ['Business', 'Eco'],
+    'Seat_Class': ['Green Car', 'Ordinary'],
+    'Platform_Location': PLATFORM_LEVELS,
+}
+for _col in SURVEY_CATEGORY_COL:
+    CATEGORY_LEVELS.setdefault(_col, RATING_LEVELS)
+
+# Storage type of the numeric columns; columns with missing values must be float
+NUMERIC_DTYPES = {
+    ID_COL: 'int32',
+    TARGET_COL: 'int8',
+    'Age': 'float32',
+    'Travel_Distance': 'int32',
+    'Departure_Delay_in_Mins': 'float32',
+    'Arrival_Delay_in_Mins': 'float32',
+}
+
+# Seconds allowed from CLI start until `predict` has its model loaded
+PREDICT_COLD_START_BUDGET = 2.0
+
+# Modules that must never be imported by the train/predict stages
+PLOTTING_MODULES = ('matplotlib', 'seaborn', 'missingno', 'statsmodels')
+
+
+def data_path(data_dir, file_name):
+    """Join a data directory and one of the hackathon file names."""
+    return os.path.join(data_dir, file_name)
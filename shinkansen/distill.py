@@ -0,0 +1,255 @@
+"""Distil a large saved model into small students and report what each costs.
+
+The winning booster can keep thousands of trees and the forest 1000 fully
+grown ones, so scoring a row walks every one of them and the artifact runs
+to many megabytes. A student is a much smaller model trained to reproduce
+the teacher's ``predict_proba`` rather than the 0/1 labels:
+
+* tree students are LightGBM boosters with capped rounds and depth, fitted
+  with the ``cross_entropy`` objective, which takes the teacher's
+  probabilities as soft labels;
+* the linear student is a ridge regression on the teacher's log-odds over
+  the encoded features, scored with one dot product.
+
+The report is only fair on rows the teacher was not fitted on. Those are
+the rows whose IDs the training run recorded in the artifact
+(``holdout_ids``), or separate held-out files when given. The soft labels
+cover the other labelled rows and, when given, the unlabelled test files,
+which cost nothing to label this way. Every student and the teacher are
+then measured on the held-out rows: log loss, accuracy, agreement with the teacher, p99
+single-row latency, batch throughput and pickled size. The report marks the
+students on the log loss versus p99 latency Pareto front, and with a
+latency or size budget picks the most accurate student that fits it
+(without one, the most accurate student). Students keep the artifact
+layout, so ``predict`` and ``serve`` load them like any other model.
+"""
+
+import pickle
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from shinkansen import instrument
+
+# (boosting rounds, max depth) of the tree students
+TREE_STUDENTS = [(25, 3), (50, 3), (100, 3), (50, 4), (100, 4), (200, 4), (100, 6), (200, 6), (400, 6)]
+
+# Soft labels are clipped before taking log-odds, so certain rows do not dominate the linear fit
+LOGIT_CLIP = 1e-4
+
+
+class TreeStudent:
+    """LightGBM booster fitted on soft labels, with the classifier interface."""
+
+    classes_ = np.array([0, 1])
+
+    def __init__(self, n_estimators, max_depth, random_state=0, n_jobs=None):
+        self.n_estimators = n_estimators
+        self.max_depth = max_depth
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.booster_ = None
+
+    @property
+    def name(self):
+        return f'trees_{self.n_estimators}x{self.max_depth}'
+
+    def fit(self, X, soft):
+        import lightgbm as lgbm
+
+        model = lgbm.LGBMRegressor(objective='cross_entropy', n_estimators=self.n_estimators,
+                                   max_depth=self.max_depth, num_leaves=2 ** self.max_depth,
+                                   random_state=self.random_state, verbose=-1,
+                                   **({} if self.n_jobs is None else {'n_jobs': self.n_jobs}))
+        model.fit(X, soft)
+        self.booster_ = model.booster_
+        return self
+
+    def predict_proba(self, X):
+        proba = self.booster_.predict(X)
+        return np.column_stack([1 - proba, proba])
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] > 0.5).astype(np.int64)
+
+    def __getstate__(self):
+        # The booster pickles as its text dump; keep only that
+        state = dict(self.__dict__)
+        state['booster_'] = self.booster_.model_to_string()
+        return state
+
+    def __setstate__(self, state):
+        import lightgbm as lgbm
+
+        self.__dict__.update(state)
+        self.booster_ = lgbm.Booster(model_str=state['booster_'])
+
+
+class LinearStudent:
+    """Ridge regression on the teacher's log-odds, scored with one dot product."""
+
+    classes_ = np.array([0, 1])
+    name = 'linear'
+
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+        self.coef_ = None
+        self.intercept_ = 0.0
+
+    def fit(self, X, soft):
+        from sklearn.linear_model import Ridge
+
+        soft = np.clip(soft, LOGIT_CLIP, 1 - LOGIT_CLIP)
+        ridge = Ridge(alpha=self.alpha).fit(X, np.log(soft / (1 - soft)))
+        self.coef_ = ridge.coef_.astype(np.float32)
+        self.intercept_ = float(ridge.intercept_)
+        return self
+
+    def predict_proba(self, X):
+        proba = 1 / (1 + np.exp(-(np.asarray(X, dtype=np.float32) @ self.coef_ + self.intercept_)))
+        return np.column_stack([1 - proba, proba])
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] > 0.5).astype(np.int64)
+
+
+def _latency_percentiles(model, X, n_rows=500):
+    """p50 and p99 milliseconds of predict_proba on one row at a time."""
+    timings = np.empty(min(n_rows, len(X)))
+    # The first call pays for lazy setup, not per-row work
+    model.predict_proba(X[:1])
+    for i in range(len(timings)):
+        row = X[i:i + 1]
+        start = time.perf_counter()
+        model.predict_proba(row)
+        timings[i] = time.perf_counter() - start
+    return tuple(np.percentile(timings * 1e3, [50, 99]))
+
+
+def measure(model, X, y, teacher_proba=None, latency_rows=500):
+    """Accuracy and cost of one model on held-out rows, as a dict."""
+    from shinkansen.evaluation import metrics
+
+    start = time.perf_counter()
+    proba = model.predict_proba(X)[:, 1]
+    batch_seconds = time.perf_counter() - start
+    scores = metrics(y, proba)
+    p50, p99 = _latency_percentiles(model, X, latency_rows)
+    return {
+        'logloss': scores['logloss'],
+        'accuracy': scores['accuracy'],
+        'agreement': float(np.mean((proba > 0.5) == (teacher_proba > 0.5))) if teacher_proba is not None
+        else 1.0,
+        'p50_ms': p50,
+        'p99_ms': p99,
+        'rows_per_s': len(X) / batch_seconds,
+        'model_bytes': len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)),
+    }
+
+
+def pareto_front(table, objectives=('logloss', 'p99_ms')):
+    """Boolean mask of the rows no other row beats on every objective (all minimised)."""
+    values = table[list(objectives)].to_numpy()
+    no_worse = (values[:, None, :] <= values[None, :, :]).all(axis=2)
+    better = (values[:, None, :] < values[None, :, :]).any(axis=2)
+    # dominated[j]: some row i is no worse on every objective and better on one
+    dominated = (no_worse & better).any(axis=0)
+    return ~dominated
+
+
+def pick(table, max_p99_ms=None, max_bytes=None):
+    """Name of the student with the lowest log loss within the budgets, or None if none fits."""
+    fits = table[table['model'] != 'teacher']
+    if max_p99_ms is not None:
+        fits = fits[fits['p99_ms'] <= max_p99_ms]
+    if max_bytes is not None:
+        fits = fits[fits['model_bytes'] <= max_bytes]
+    return None if fits.empty else fits.loc[fits['logloss'].idxmin(), 'model']
+
+
+def _held_out(artifact, labelled, holdout_paths, test_size, random_state, cache_dir):
+    """Rows to soft-label and rows to report on, keeping the teacher's own training rows out of the latter."""
+    from shinkansen import pipeline
+    from shinkansen.matrix import FeatureMatrix
+
+    if holdout_paths:
+        held = FeatureMatrix.build(pipeline.merge(*pipeline.load_raw(*holdout_paths, cache_dir)),
+                                   artifact['preprocessor'])
+        return labelled.take(np.flatnonzero(~np.isin(labelled.ids, held.ids))), held, 'the held-out files'
+    if artifact.get('holdout_ids') is not None:
+        rows = np.isin(labelled.ids, artifact['holdout_ids'])
+        if not rows.any():
+            raise ValueError('none of the labelled rows are ones the teacher held out; '
+                             'pass held-out files instead')
+        return labelled.take(np.flatnonzero(~rows)), labelled.take(np.flatnonzero(rows)), \
+            "the teacher's held-out rows"
+    print("Warning: the artifact does not record its held-out rows, so the report's rows may include the "
+          "teacher's training rows; pass held-out files for a fair comparison", file=sys.stderr)
+    train, held = labelled.split(test_size=test_size, random_state=random_state, stratify=True)
+    return train, held, 'a random split'
+
+
+def run(model_path, travel_path, survey_path, unlabeled_paths=None, holdout_paths=None, test_size=0.2,
+        random_state=0, cache_dir=None, students=None, linear=True, latency_rows=500, max_p99_ms=None, max_bytes=None,
+        output_path=None, report_path=None):
+    """Fit every student on the teacher's soft labels and report accuracy against cost.
+
+    ``travel_path``/``survey_path`` are labelled files. The report is on
+    the ``holdout_paths`` (travel, survey) pair when given, else on the rows
+    whose IDs the artifact records as held out from the teacher's training,
+    else on a ``test_size`` split. The other labelled rows, with the
+    ``unlabeled_paths`` pair, get soft labels. ``students``
+    is a list of (rounds, depth) tree students (default
+    :data:`TREE_STUDENTS`). The chosen student is saved to ``output_path``
+    with the teacher's preprocessing. Returns the report table.
+    """
+    from shinkansen import pipeline
+    from shinkansen.matrix import FeatureMatrix
+
+    artifact = pipeline.load_model(model_path)
+    teacher, preprocessor = artifact['model'], artifact['preprocessor']
+    labelled = FeatureMatrix.build(pipeline.merge(*pipeline.load_raw(travel_path, survey_path, cache_dir)),
+                                   preprocessor)
+    train, held, source = _held_out(artifact, labelled, holdout_paths, test_size, random_state, cache_dir)
+    X = train.X
+    if unlabeled_paths:
+        unlabeled = FeatureMatrix.build(pipeline.merge(*pipeline.load_raw(*unlabeled_paths, cache_dir)),
+                                        preprocessor)
+        X = np.concatenate([X, unlabeled.X])
+    with instrument.stage('soft_labels', detail=artifact['report']['model'], rows=len(X)):
+        soft = teacher.predict_proba(X)[:, 1]
+
+    teacher_proba = teacher.predict_proba(held.X)[:, 1]
+    rows = [dict(model='teacher', family=artifact['report']['model'],
+                 **measure(teacher, held.X, held.y, teacher_proba, latency_rows))]
+    fitted = {}
+    candidates = [TreeStudent(rounds, depth, random_state) for rounds, depth in (students or TREE_STUDENTS)]
+    if linear:
+        candidates.append(LinearStudent())
+    for student in candidates:
+        start = time.perf_counter()
+        with instrument.stage('distill', detail=student.name, rows=len(X)):
+            student.fit(X, soft)
+        fit_seconds = time.perf_counter() - start
+        fitted[student.name] = student
+        rows.append(dict(model=student.name, family='student', fit_s=fit_seconds,
+                         **measure(student, held.X, held.y, teacher_proba, latency_rows)))
+
+    table = pd.DataFrame(rows)
+    table['pareto'] = pareto_front(table)
+    chosen = pick(table, max_p99_ms, max_bytes)
+    print(f"{len(X)} soft-labelled rows ({len(X) - len(train)} unlabelled), {len(held)} held-out rows from "
+          f"{source}")
+    print(table.to_string(index=False, float_format='%.4f'))
+    if max_p99_ms is not None or max_bytes is not None:
+        print(f"Most accurate student within budget: {chosen or 'none'}")
+    if report_path:
+        table.to_csv(report_path, index=False)
+        print(f"Report written to {report_path}")
+    if output_path and chosen:
+        report = table.set_index('model').loc[chosen].to_dict()
+        report.update({'model': chosen, 'teacher': artifact['report']['model']})
+        pipeline.save_model(output_path, fitted[chosen], preprocessor, report)
+    return table
@@ -0,0 +1,391 @@
+"""Exploratory data analysis figures from the notebook, rendered to files.
+
+This is the only module that imports the plotting stack; the CLI imports it
+lazily so ``train`` and ``predict`` never load matplotlib or seaborn.
+
+The notebook's cells hand the full training frame to seaborn, which counts
+the 19 categorical columns twice and draws every row in the pair plot, so
+the report gets slower as the data grows. :func:`run` works aggregate
+first by default: :func:`aggregate` makes one pass over the cleaned frame,
+with one grouped count per plotted column or column pair, and keeps a
+stratified sample for the scatter and pair plots. Missing data is plotted
+from the frequencies of the distinct missingness patterns in the
+:class:`~shinkansen.nullity.NullityIndex`. Every figure is
+then drawn from those small tables in its own worker process, so rendering
+time depends on the number of categories rather than rows. ``mode='full'``
+renders the notebook's figures from the full frames instead.
+"""
+
+import os
+import time
+
+import matplotlib
+
+# Render without a display
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+import missingno as mi
+import numpy as np
+import pandas as pd
+import seaborn as sns
+import statsmodels.api as sm
+
+from shinkansen import config, pipeline, stages
+
+# Travel categoricals drawn against each other in the heatmaps
+HEATMAP_FEATURES = ['Gender', 'Customer_Type', 'Type_Travel', 'Travel_Class', 'Seat_Class']
+
+
+def _save(fig, output_dir, name):
+    path = os.path.join(output_dir, name)
+    fig.savefig(path, bbox_inches='tight')
+    plt.close(fig)
+    return path
+
+
+def delay_regression(travel, output_dir):
+    """Scatter plot and OLS fit of arrival against departure delay."""
+    filtered_data = travel[['Departure_Delay_in_Mins', 'Arrival_Delay_in_Mins']].dropna()
+
+    # Fitting the linear regression model on the filtered data
+    X = sm.add_constant(filtered_data['Departure_Delay_in_Mins'])
+    Y = filtered_data['Arrival_Delay_in_Mins']
+    model = sm.OLS(Y, X).fit()
+
+    fig = plt.figure()
+    plt.scatter(filtered_data['Departure_Delay_in_Mins'], filtered_data['Arrival_Delay_in_Mins'],
+                label='Data points', color='#08F7FE', alpha=0.8)
+    plt.plot(filtered_data['Departure_Delay_in_Mins'], model.fittedvalues, label='OLS Regression line',
+             color='#FE53BB')
+    plt.title('Correlation between Departure and Arrival Delays')
+    plt.ylabel('Arrival Delay in Mins')
+    plt.xlabel('Departure Delay in Mins')
+    plt.legend()
+    # Display the fitted regression equation and R-squared value
+    plt.text(200, 1000, f"y = {model.params.iloc[1]:.2f}x + {model.params.iloc[0]:.2f}\n"
+                        f"R-squared: {model.rsquared:.2f}", fontsize=12)
+    return _save(fig, output_dir, 'delay_regression.png')
+
+
+def numeric_histograms(travel, output_dir):
+    """Histograms of the four numeric travel columns."""
+    fig, axes = plt.subplots(2, 2, figsize=(8, 6.4))
+    for ax, col in zip(axes.flatten(), config.TRAVEL_NUMERIC_COL):
+        ax.hist(travel[col].dropna(), color='skyblue', edgecolor='black')
+        ax.set_title(f'Distribution of {col}', fontsize=10, fontweight='bold')
+        ax.set_xlabel(col)
+        ax.set_ylabel('Frequency')
+    fig.tight_layout()
+    return _save(fig, output_dir, 'numeric_histograms.png')
+
+
+def missing_matrix(merged, output_dir):
+    """Missing data distribution in each column."""
+    ax = mi.matrix(merged, sparkline=False, color=(0.25, 0.45, 0.6), figsize=(12, 9), fontsize=9)
+    ax.set_title('Missing Data Distribution in Each Column', fontsize=14)
+    return _save(ax.get_figure(), output_dir, 'missing_matrix.png')
+
+
+def pairplot(train_no_dummy, output_dir):
+    """Pair plot of numerical variables, colored by Overall_Experience."""
+    grid = sns.pairplot(data=train_no_dummy, vars=config.TRAVEL_NUMERIC_COL,
+                        hue=config.TARGET_COL, corner=True)
+    return _save(grid.figure, output_dir, 'pairplot.png')
+
+
+def countplots(train_no_dummy, output_dir):
+    """Countplots of each categorical column, overall and by Overall_Experience."""
+    n = len(config.CATEGORY_COL)
+    ncols = 3
+    nrows = n // ncols + (n % ncols > 0)
+    paths = []
+
+    fig = plt.figure(figsize=(21, 3.5 * nrows))
+    for i, col in enumerate(config.CATEGORY_COL, 1):
+        plt.subplot(nrows, ncols, i)
+        ax = sns.countplot(data=train_no_dummy, x=col, hue=col, palette='Set2')
+        plt.title(f'Countplot of {col}')
+        plt.xticks(rotation=15)
+        for container in ax.containers:
+            ax.bar_label(container)
+    fig.tight_layout()
+    paths.append(_save(fig, output_dir, 'countplots.png'))
+
+    fig = plt.figure(figsize=(21, 3.5 * nrows))
+    for i, col in enumerate(config.CATEGORY_COL, 1):
+        plt.subplot(nrows, ncols, i)
+        ax = sns.countplot(data=train_no_dummy, y=col, hue=config.TARGET_COL, palette='Accent')
+        plt.title(f'Countplot of {col} by Overall_Experience')
+        for container in ax.containers:
+            ax.bar_label(container, fontsize=8)
+    fig.tight_layout()
+    paths.append(_save(fig, output_dir, 'countplots_by_experience.png'))
+    return paths
+
+
+def heatmaps(train_no_dummy, output_dir):
+    """Heatmaps of the travel categoricals against each other."""
+    paths = []
+    for k, by in enumerate(HEATMAP_FEATURES[:-1]):
+        others = HEATMAP_FEATURES[k + 1:]
+        fig = plt.figure(figsize=(6 * len(others), 4))
+        for i, col in enumerate(others, 1):
+            plt.subplot(1, len(others), i)
+            df_2dhist = group_counts(train_no_dummy, col, by)
+            sns.heatmap(df_2dhist, cmap='viridis')
+            plt.xlabel(by)
+            plt.ylabel(col)
+        fig.tight_layout()
+        paths.append(_save(fig, output_dir, f'heatmap_{by}.png'))
+    return paths
+
+
+def group_counts(frame, row, col):
+    """Counts of ``row`` values within each group of ``col``."""
+    return pd.DataFrame({x_label: grp[row].value_counts() for x_label, grp in frame.groupby(col)})
+
+
+def stratified_sample(y, size, random_state=0):
+    """Sorted row positions of about ``size`` rows, keeping each label's share."""
+    y = np.asarray(y)
+    if size >= len(y):
+        return np.arange(len(y))
+    rng = np.random.default_rng(random_state)
+    rows = []
+    for label, count in zip(*np.unique(y, return_counts=True)):
+        rows.append(rng.choice(np.flatnonzero(y == label), int(round(size * count / len(y))), replace=False))
+    return np.sort(np.concatenate(rows))
+
+
+def aggregate(travel_path, survey_path, cache_dir=None, sample_size=5000, random_state=0):
+    """Every table the aggregate figures are drawn from, in one pass over the data.
+
+    Returns counts of each categorical column by Overall_Experience,
+    crosstabs of the travel categoricals, numeric histograms, the sums of
+    the delay regression, the missingness patterns with their frequencies
+    and a stratified sample of the merged and cleaned rows.
+    """
+    merged = stages.merged(travel_path, survey_path, cache_dir)
+    cleaned = stages.cleaned(travel_path, survey_path, cache_dir)
+    target = config.TARGET_COL
+
+    # Categorical columns keep their levels, so empty levels still get a bar as in countplot
+    counts = {col: cleaned.groupby([col, target], observed=False).size().unstack(fill_value=0)
+              for col in config.CATEGORY_COL}
+    crosstabs = {(col, by): cleaned.groupby([col, by], observed=False).size().unstack(fill_value=0)
+                 for k, by in enumerate(HEATMAP_FEATURES[:-1]) for col in HEATMAP_FEATURES[k + 1:]}
+    histograms = {col: np.histogram(merged[col].dropna()) for col in config.TRAVEL_NUMERIC_COL}
+
+    delays = merged[['Departure_Delay_in_Mins', 'Arrival_Delay_in_Mins']].dropna().to_numpy(np.float64)
+    x, y = delays[:, 0], delays[:, 1]
+    regression = {'n': len(x), 'sx': x.sum(), 'sy': y.sum(), 'sxx': x @ x, 'syy': y @ y, 'sxy': x @ y,
+                  'min': x.min(), 'max': x.max()}
+
+    rows = stratified_sample(cleaned[target].to_numpy(), sample_size, random_state)
+    return {
+        'rows': len(cleaned),
+        'counts': counts,
+        'crosstabs': crosstabs,
+        'histograms': histograms,
+        'regression': regression,
+        'patterns': stages.nullity(travel_path, survey_path, cache_dir, merged).pattern_matrix(),
+        'merged_sample': merged.iloc[rows].reset_index(drop=True),
+        'cleaned_sample': cleaned.iloc[rows].reset_index(drop=True),
+    }
+
+
+def _ols(sums):
+    """Slope, intercept and R-squared of a simple regression from its sums."""
+    n = sums['n']
+    sxx = sums['sxx'] - sums['sx'] ** 2 / n
+    syy = sums['syy'] - sums['sy'] ** 2 / n
+    sxy = sums['sxy'] - sums['sx'] * sums['sy'] / n
+    slope = sxy / sxx
+    return slope, (sums['sy'] - slope * sums['sx']) / n, sxy ** 2 / (sxx * syy)
+
+
+def delay_regression_agg(aggregates, output_dir):
+    """Sampled scatter of arrival against departure delay, with the OLS line fitted on every row."""
+    slope, intercept, r2 = _ols(aggregates['regression'])
+    sample = aggregates['merged_sample'][['Departure_Delay_in_Mins', 'Arrival_Delay_in_Mins']].dropna()
+    fig = plt.figure()
+    plt.scatter(sample['Departure_Delay_in_Mins'], sample['Arrival_Delay_in_Mins'],
+                label=f'Data points (sample of {len(sample)})', color='#08F7FE', alpha=0.8)
+    line_x = np.array([aggregates['regression']['min'], aggregates['regression']['max']])
+    plt.plot(line_x, slope * line_x + intercept, label='OLS Regression line', color='#FE53BB')
+    plt.title('Correlation between Departure and Arrival Delays')
+    plt.ylabel('Arrival Delay in Mins')
+    plt.xlabel('Departure Delay in Mins')
+    plt.legend()
+    # Placed in axes coordinates so it stays inside the plot whatever the delay range
+    plt.text(0.95, 0.05, f"y = {slope:.2f}x + {intercept:.2f}\nR-squared: {r2:.2f}", fontsize=12,
+             ha='right', transform=plt.gca().transAxes)
+    return _save(fig, output_dir, 'delay_regression.png')
+
+
+def numeric_histograms_agg(aggregates, output_dir):
+    fig, axes = plt.subplots(2, 2, figsize=(8, 6.4))
+    for ax, col in zip(axes.flatten(), config.TRAVEL_NUMERIC_COL):
+        counts, edges = aggregates['histograms'][col]
+        ax.stairs(counts, edges, fill=True, facecolor='skyblue', edgecolor='black')
+        ax.set_title(f'Distribution of {col}', fontsize=10, fontweight='bold')
+        ax.set_xlabel(col)
+        ax.set_ylabel('Frequency')
+    fig.tight_layout()
+    return _save(fig, output_dir, 'numeric_histograms.png')
+
+
+def missing_patterns_agg(aggregates, output_dir, top=30):
+    """The most frequent missingness patterns as a nullity grid, with each pattern's row count."""
+    bits, rows = aggregates['patterns']
+    bits, rows = bits.iloc[:top], rows[:top]
+    fig, (grid, bars) = plt.subplots(1, 2, figsize=(14, 0.3 * len(bits) + 3), sharey=True,
+                                     gridspec_kw={'width_ratios': [4, 1]})
+    grid.imshow(bits.to_numpy(), aspect='auto', cmap=matplotlib.colors.ListedColormap(['white', (0.25, 0.45, 0.6)]),
+                interpolation='nearest')
+    grid.set_xticks(range(len(bits.columns)), bits.columns, rotation=90, fontsize=9)
+    grid.set_yticks(range(len(bits)), [f'{n_missing} missing' for n_missing in bits.sum(axis=1)], fontsize=8)
+    bars.barh(range(len(bits)), rows, color=(0.25, 0.45, 0.6))
+    bars.set_xscale('log')
+    bars.set_xlabel('rows')
+    fig.suptitle(f'Missing Data Patterns ({len(bits)} most frequent of {len(aggregates["patterns"][1])})',
+                 fontsize=14)
+    fig.tight_layout()
+    return _save(fig, output_dir, 'missing_patterns.png')
+
+
+def pairplot_agg(aggregates, output_dir):
+    grid = sns.pairplot(data=aggregates['cleaned_sample'], vars=config.TRAVEL_NUMERIC_COL,
+                        hue=config.TARGET_COL, corner=True)
+    return _save(grid.figure, output_dir, 'pairplot.png')
+
+
+def _grid(n, ncols=3):
+    return n // ncols + (n % ncols > 0), ncols
+
+
+def countplots_agg(aggregates, output_dir):
+    """Bar charts of each categorical column from its counts."""
+    nrows, ncols = _grid(len(config.CATEGORY_COL))
+    fig = plt.figure(figsize=(21, 3.5 * nrows))
+    for i, col in enumerate(config.CATEGORY_COL, 1):
+        ax = plt.subplot(nrows, ncols, i)
+        totals = aggregates['counts'][col].sum(axis=1)
+        labels = [str(level) for level in totals.index]
+        bars = ax.bar(labels, totals.to_numpy(), color=sns.color_palette('Set2', len(labels)))
+        ax.bar_label(bars)
+        ax.set_xlabel(col)
+        ax.set_ylabel('count')
+        plt.title(f'Countplot of {col}')
+        plt.xticks(rotation=15)
+    fig.tight_layout()
+    return _save(fig, output_dir, 'countplots.png')
+
+
+def countplots_by_experience_agg(aggregates, output_dir):
+    """Horizontal bars of each categorical column split by Overall_Experience."""
+    nrows, ncols = _grid(len(config.CATEGORY_COL))
+    fig = plt.figure(figsize=(21, 3.5 * nrows))
+    for i, col in enumerate(config.CATEGORY_COL, 1):
+        ax = plt.subplot(nrows, ncols, i)
+        table = aggregates['counts'][col]
+        positions = np.arange(len(table))
+        height = 0.8 / len(table.columns)
+        colors = sns.color_palette('Accent', len(table.columns))
+        for j, label in enumerate(table.columns):
+            bars = ax.barh(positions - 0.4 + height * (j + 0.5), table[label].to_numpy(), height,
+                           label=str(label), color=colors[j])
+            ax.bar_label(bars, fontsize=8)
+        ax.set_yticks(positions, [str(level) for level in table.index])
+        ax.invert_yaxis()
+        ax.set_ylabel(col)
+        ax.set_xlabel('count')
+        ax.legend(title=config.TARGET_COL)
+        plt.title(f'Countplot of {col} by Overall_Experience')
+    fig.tight_layout()
+    return _save(fig, output_dir, 'countplots_by_experience.png')
+
+
+def heatmap_agg(aggregates, output_dir, by):
+    """Crosstab heatmaps of ``by`` against the travel categoricals after it."""
+    others = HEATMAP_FEATURES[HEATMAP_FEATURES.index(by) + 1:]
+    fig = plt.figure(figsize=(6 * len(others), 4))
+    for i, col in enumerate(others, 1):
+        plt.subplot(1, len(others), i)
+        sns.heatmap(aggregates['crosstabs'][col, by], cmap='viridis')
+        plt.xlabel(by)
+        plt.ylabel(col)
+    fig.tight_layout()
+    return _save(fig, output_dir, f'heatmap_{by}.png')
+
+
+def _figure_jobs(aggregates):
+    """(function name, the part of the aggregates it needs, extra arguments) of every figure."""
+    jobs = [
+        ('delay_regression_agg', ['regression', 'merged_sample'], ()),
+        ('numeric_histograms_agg', ['histograms'], ()),
+        ('missing_patterns_agg', ['patterns'], ()),
+        ('pairplot_agg', ['cleaned_sample'], ()),
+        ('countplots_agg', ['counts'], ()),
+        ('countplots_by_experience_agg', ['counts'], ()),
+    ]
+    jobs += [('heatmap_agg', ['crosstabs'], (by,)) for by in HEATMAP_FEATURES[:-1]]
+    # Ship each worker only the tables its figure uses
+    return [(name, {key: aggregates[key] for key in keys}, args) for name, keys, args in jobs]
+
+
+def _render(name, aggregates, output_dir, args):
+    plt.rcParams['figure.figsize'] = (6.4, 4.8)
+    return globals()[name](aggregates, output_dir, *args)
+
+
+def render(aggregates, output_dir, workers=None):
+    """Draw every aggregate figure into ``output_dir``, ``workers`` figures at a time."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    jobs = _figure_jobs(aggregates)
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers == 1:
+        return [_render(name, part, output_dir, args) for name, part, args in jobs]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(_render, name, part, output_dir, args) for name, part, args in jobs]
+        return [future.result() for future in futures]
+
+
+def run(travel_path, survey_path, output_dir, cache_dir=None, mode='aggregate', workers=None, sample_size=5000,
+        random_state=0):
+    """Render every EDA figure for one training file pair into ``output_dir``.
+
+    ``mode='aggregate'`` draws from :func:`aggregate` in ``workers`` processes;
+    ``mode='full'`` draws the notebook's figures from the full frames.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if mode == 'aggregate':
+        start = time.perf_counter()
+        aggregates = aggregate(travel_path, survey_path, cache_dir, sample_size, random_state)
+        aggregated = time.perf_counter() - start
+        paths = render(aggregates, output_dir, workers)
+        for path in paths:
+            print(f"Figure written to {path}")
+        print(f"Aggregated {aggregates['rows']} rows in {aggregated:.2f}s, rendered {len(paths)} figures in "
+              f"{time.perf_counter() - start - aggregated:.2f}s")
+        return paths
+    plt.rcParams['figure.figsize'] = (6.4, 4.8)
+
+    travel, _ = pipeline.load_raw(travel_path, survey_path, cache_dir)
+    merged = stages.merged(travel_path, survey_path, cache_dir)
+    train_no_dummy = stages.cleaned(travel_path, survey_path, cache_dir).set_index(config.ID_COL)
+
+    paths = [
+        delay_regression(travel, output_dir),
+        numeric_histograms(travel, output_dir),
+        missing_matrix(merged, output_dir),
+        pairplot(train_no_dummy, output_dir),
+    ]
+    paths += countplots(train_no_dummy, output_dir)
+    paths += heatmaps(train_no_dummy, output_dir)
+    for path in paths:
+        print(f"Figure written to {path}")
+    return paths
@@ -0,0 +1,211 @@
+"""Soft-voting ensemble of the three model families, with a cascade mode.
+
+``zoo`` trains LightGBM, XGBoost and RandomForest and keeps only the
+winner. :class:`Ensemble` keeps all three and blends their ``predict_proba``
+with weights fitted on the validation split, by minimising the blend's log
+loss over the simplex. Every member scores the same encoded float32 matrix,
+in its own thread, with its share of the cores (:func:`zoo.split_cores`);
+the boosters and the forest's tree walk release the GIL, so the members
+run side by side instead of one after another.
+
+In cascade mode the cheapest member scores every row first. Rows it is
+confident about, with a probability at least ``margin`` away from 0.5, keep
+its answer; only the others go to the remaining members and get the full
+blend. The margin is the smallest one whose log loss on the validation
+split stays within ``tolerance`` of the full blend.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from shinkansen import instrument
+from shinkansen.evaluation import logloss
+
+MODES = ('blend', 'cascade')
+
+
+def fit_weights(probas, y):
+    """Simplex weights of the members that minimise the blend's log loss, in ``probas`` order."""
+    from scipy.optimize import minimize
+
+    matrix = np.column_stack(list(probas.values()))
+
+    def loss(logits):
+        weights = np.exp(logits - logits.max())
+        return logloss(y, matrix @ (weights / weights.sum()))
+
+    result = minimize(loss, np.zeros(matrix.shape[1]), method='L-BFGS-B')
+    weights = np.exp(result.x - result.x.max())
+    return dict(zip(probas, weights / weights.sum()))
+
+
+def _cascade(cheap_proba, others, weights, cheap, margin):
+    """Cascade probabilities from the cheap member's and, for escalated rows, the others' predictions.
+
+    ``others`` maps the other members to their predictions on the escalated rows only.
+    """
+    escalated = np.abs(cheap_proba - 0.5) < margin
+    proba = cheap_proba.copy()
+    if escalated.any():
+        proba[escalated] = weights[cheap] * cheap_proba[escalated] + sum(
+            weights[name] * values for name, values in others.items())
+    return proba, escalated
+
+
+def fit_margin(probas, y, weights, cheap, tolerance=0.002):
+    """Smallest margin whose cascade log loss is within ``tolerance`` of the full blend, and that loss."""
+    blend = sum(weights[name] * proba for name, proba in probas.items())
+    target = logloss(y, blend) + tolerance
+    for margin in np.arange(0.0, 0.51, 0.01):
+        escalated = np.abs(probas[cheap] - 0.5) < margin
+        proba, _ = _cascade(probas[cheap], {name: proba[escalated] for name, proba in probas.items()
+                                            if name != cheap}, weights, cheap, margin)
+        loss = logloss(y, proba)
+        if loss <= target:
+            return float(margin), loss
+    return 0.5, logloss(y, blend)
+
+
+class Ensemble:
+    """Weighted soft vote of fitted members, scored concurrently on a shared matrix."""
+
+    classes_ = np.array([0, 1])
+
+    def __init__(self, members, weights, threads=None, mode='blend', cheap=None, margin=0.0):
+        if mode not in MODES:
+            raise ValueError(f'unknown mode {mode!r}, expected one of {MODES}')
+        self.members = dict(members)
+        self.weights = {name: float(weights[name]) for name in self.members}
+        self.threads = dict(threads or {})
+        self.mode = mode
+        self.cheap = cheap
+        self.margin = margin
+        self._pool = None
+        self._budgeted = False
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_pool'] = None
+        state['_budgeted'] = False
+        return state
+
+    def _apply_threads(self):
+        """Give each member its thread budget, once per process."""
+        if self._budgeted:
+            return
+        for name, model in self.members.items():
+            if name in self.threads and hasattr(model, 'set_params'):
+                model.set_params(n_jobs=self.threads[name])
+        self._budgeted = True
+
+    def _map(self, func, names):
+        self._apply_threads()
+        if len(names) == 1:
+            return {names[0]: func(names[0])}
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=len(self.members))
+        return dict(zip(names, self._pool.map(func, names)))
+
+    def member_probas(self, X, names=None):
+        """Each member's probabilities on ``X``, computed concurrently."""
+        names = list(names or self.members)
+        return self._map(lambda name: self.members[name].predict_proba(X)[:, 1], names)
+
+    def _blend(self, probas):
+        return sum(self.weights[name] * proba for name, proba in probas.items())
+
+    def predict_proba(self, X, mode=None):
+        mode = mode or self.mode
+        if mode == 'blend':
+            proba = self._blend(self.member_probas(X))
+        else:
+            cheap_proba = self.members[self.cheap].predict_proba(X)[:, 1]
+            escalated = np.abs(cheap_proba - 0.5) < self.margin
+            others = [name for name in self.members if name != self.cheap]
+            rows = X[escalated]
+            scored = self.member_probas(rows, others) if len(rows) else {name: np.empty(0) for name in others}
+            proba, _ = _cascade(cheap_proba, scored, self.weights, self.cheap, self.margin)
+        return np.column_stack([1 - proba, proba])
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] > 0.5).astype(np.int64)
+
+
+def _timed(func, X, repeats):
+    """Best of ``repeats`` wall times of ``func(X)`` and its last result."""
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(X)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def _scores(metrics, y, proba):
+    scores = metrics(y, proba)
+    return {'logloss': scores['logloss'], 'accuracy': scores['accuracy'], 'roc_auc': scores['roc_auc']}
+
+
+def run(travel_path, survey_path, model_path, names=None, cores=None, test_size=0.2, random_state=None,
+        cache_dir=None, encoding='onehot', mode='blend', cheap='lightgbm', tolerance=0.002, repeats=3, **options):
+    """Fit the zoo, fit blend weights and a cascade margin, compare against the best single model and save.
+
+    The held-out split is halved: one half drives early stopping, the blend
+    weights and the margin, the other is only scored for the report.
+    Returns the report table.
+    """
+    from shinkansen import pipeline, zoo
+    from shinkansen.evaluation import metrics
+    from shinkansen.models import MODEL_NAMES
+
+    names = list(names or MODEL_NAMES)
+    if mode == 'cascade' and cheap not in names:
+        raise ValueError(f'the cheap model {cheap!r} is not among {names}')
+    preprocessor, train_set, held = pipeline.prepare(travel_path, survey_path, test_size, random_state, cache_dir,
+                                                     encoding)
+    valid, test = held.split(test_size=0.5, random_state=random_state, stratify=True)
+    cores = cores or os.cpu_count() or 1
+    results, _ = zoo.fit_parallel(train_set, valid, names, cores, random_state=random_state, **options)
+    models = {name: model for name, (model, _) in results.items()}
+
+    with instrument.stage('ensemble_weights', rows=len(valid)):
+        valid_probas = {name: model.predict_proba(valid.X)[:, 1] for name, model in models.items()}
+        weights = fit_weights(valid_probas, valid.y)
+        margin, _ = fit_margin(valid_probas, valid.y, weights, cheap, tolerance) if cheap in models else (0.0, None)
+    ensemble = Ensemble(models, weights, zoo.split_cores(cores, names), mode=mode, cheap=cheap, margin=margin)
+
+    rows = []
+    for name, model in models.items():
+        if hasattr(model, 'set_params'):
+            model.set_params(n_jobs=cores)
+        proba, seconds = _timed(lambda X: model.predict_proba(X)[:, 1], test.X, repeats)
+        rows.append(dict(model=name, weight=weights[name], seconds=seconds, **_scores(metrics, test.y, proba)))
+    best = min(rows, key=lambda row: row['logloss'])['model']
+
+    # Members scored one after another with every core, then side by side with their budgets
+    _, sequential = _timed(lambda X: sum(weights[name] * model.predict_proba(X)[:, 1]
+                                         for name, model in models.items()), test.X, repeats)
+    proba, seconds = _timed(lambda X: ensemble.predict_proba(X, 'blend')[:, 1], test.X, repeats)
+    rows.append(dict(model='blend', weight=1.0, seconds=seconds, sequential_seconds=sequential,
+                     **_scores(metrics, test.y, proba)))
+    if cheap in models:
+        proba, seconds = _timed(lambda X: ensemble.predict_proba(X, 'cascade')[:, 1], test.X, repeats)
+        rows.append(dict(model='cascade', weight=1.0, seconds=seconds, margin=margin,
+                         escalated=float(np.mean(np.abs(models[cheap].predict_proba(test.X)[:, 1] - 0.5) < margin)),
+                         **_scores(metrics, test.y, proba)))
+
+    table = pd.DataFrame(rows)
+    table['rows_per_s'] = len(test) / table['seconds']
+    print(f"{len(test)} report rows; weights fitted on {len(valid)} validation rows; best single model: {best}")
+    print(table.to_string(index=False, float_format='%.4f'))
+    report = {'model': 'ensemble', 'members': names, 'weights': weights, 'threads': ensemble.threads,
+              'mode': mode, 'cheap': cheap, 'margin': margin, 'best_single': best,
+              'logloss': float(table.loc[table['model'] == mode, 'logloss'].iloc[0]),
+              'accuracy': float(table.loc[table['model'] == mode, 'accuracy'].iloc[0])}
+    pipeline.save_model(model_path, ensemble, preprocessor, report, ensemble=table.to_dict('records'),
+                        holdout_ids=held.ids)
+    return table
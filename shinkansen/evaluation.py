@@ -0,0 +1,281 @@
+"""Every classification metric from one sort of the predictions, with bootstrap intervals.
+
+The notebook compares models with separate ``log_loss`` and
+``accuracy_score`` calls (and commented-out ``precision_score`` and
+``recall_score``), each scanning the predictions again, at the single 0.5
+threshold and without any idea of how much the numbers would move on
+another sample. Here the predictions are sorted once by score; cumulative
+sums of the labels along that order give the true and false positives at
+every distinct threshold at once. The confusion matrix at any threshold is
+then a ``searchsorted`` into that order, and the ROC and precision-recall
+curves, their areas and the most accurate threshold come from the same
+counts.
+
+Bootstrap intervals reuse the sort too. A resample is a vector of draw
+counts per row, so a block of resamples is a (replicates, rows) count matrix,
+and every metric of every replicate in the block is a matrix product or a
+cumulative sum along the sorted order. The same resamples score every
+model, so their intervals are paired. Blocks are spread over spawned worker
+processes, each with its own child seed, so the result does not depend on
+the number of workers.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from shinkansen import instrument
+
+METRICS = ('logloss', 'accuracy', 'precision', 'recall', 'f1', 'roc_auc', 'average_precision')
+
+# Draw counts held per block of resamples, as replicates times rows
+BLOCK_CELLS = 2_000_000
+
+
+def _losses(y, proba):
+    proba = np.clip(proba, 1e-15, 1 - 1e-15)
+    return -(y * np.log(proba) + (1 - y) * np.log(1 - proba))
+
+
+def logloss(y, proba):
+    """Mean log loss of probabilities ``proba`` for 0/1 labels ``y``."""
+    return float(np.mean(_losses(np.asarray(y, dtype=np.float64), np.asarray(proba, dtype=np.float64))))
+
+
+def _ratio(num, den):
+    """``num / den``, 0 where ``den`` is 0."""
+    return np.divide(num, den, out=np.zeros(np.broadcast(num, den).shape), where=den != 0)
+
+
+class Sorted:
+    """Predictions sorted by descending score, with the cumulative counts at each distinct threshold."""
+
+    def __init__(self, y, proba):
+        y = np.asarray(y, dtype=np.float64)
+        proba = np.asarray(proba, dtype=np.float64)
+        self.y, self.proba = y, proba
+        self.order = np.argsort(-proba, kind='stable')
+        self.scores = proba[self.order]
+        self.labels = y[self.order]
+        # Last position of every run of tied scores
+        self.ends = np.append(np.flatnonzero(np.diff(self.scores)), len(self.scores) - 1)
+        self.thresholds = self.scores[self.ends]
+        self.cum_pos = np.concatenate([[0.0], np.cumsum(self.labels)])
+        self.tps = self.cum_pos[self.ends + 1]
+        self.fps = self.ends + 1 - self.tps
+
+    def confusion(self, threshold=0.5):
+        """(tn, fp, fn, tp) when a score above ``threshold`` predicts satisfied."""
+        predicted = int(np.searchsorted(-self.scores, -threshold, side='left'))
+        tp = self.cum_pos[predicted]
+        positives, n = self.cum_pos[-1], len(self.scores)
+        fp = predicted - tp
+        return int(n - positives - fp), int(fp), int(positives - tp), int(tp)
+
+    def roc_curve(self):
+        """(fpr, tpr, thresholds), starting from the origin."""
+        positives = self.tps[-1] if len(self.tps) else 0
+        negatives = len(self.scores) - positives
+        fpr = np.concatenate([[0.0], _ratio(self.fps, negatives)])
+        tpr = np.concatenate([[0.0], _ratio(self.tps, positives)])
+        return fpr, tpr, np.concatenate([[np.inf], self.thresholds])
+
+    def pr_curve(self):
+        """(precision, recall, thresholds) from the highest threshold down."""
+        positives = self.tps[-1] if len(self.tps) else 0
+        return _ratio(self.tps, self.tps + self.fps), _ratio(self.tps, positives), self.thresholds
+
+    def best_threshold(self):
+        """Threshold with the highest accuracy, predicting satisfied at or above it, and that accuracy."""
+        positives, n = self.tps[-1], len(self.scores)
+        accuracy = (self.tps + (n - positives - self.fps)) / n
+        best = int(np.argmax(accuracy))
+        return float(self.thresholds[best]), float(accuracy[best])
+
+
+def _area_metrics(tps, fps):
+    """ROC AUC and average precision from cumulative counts, one row per replicate."""
+    positives, negatives = tps[..., -1:], fps[..., -1:]
+    zero = np.zeros(tps.shape[:-1] + (1,))
+    tpr = np.concatenate([zero, _ratio(tps, positives)], axis=-1)
+    fpr = np.concatenate([zero, _ratio(fps, negatives)], axis=-1)
+    roc_auc = np.sum(np.diff(fpr, axis=-1) * (tpr[..., 1:] + tpr[..., :-1]) / 2, axis=-1)
+    precision = _ratio(tps, tps + fps)
+    average_precision = np.sum(np.diff(tpr, axis=-1) * precision, axis=-1)
+    return roc_auc, average_precision
+
+
+def _threshold_metrics(tn, fp, fn, tp):
+    precision = _ratio(tp, tp + fp)
+    recall = _ratio(tp, tp + fn)
+    return {
+        'accuracy': _ratio(tp + tn, tp + tn + fp + fn),
+        'precision': precision,
+        'recall': recall,
+        'f1': _ratio(2 * precision * recall, precision + recall),
+    }
+
+
+def metrics(y, proba, threshold=0.5):
+    """Every metric, the confusion matrix at ``threshold`` and the most accurate threshold, as a dict."""
+    ranked = Sorted(y, proba)
+    tn, fp, fn, tp = ranked.confusion(threshold)
+    result = {'logloss': logloss(ranked.y, ranked.proba)}
+    result.update({key: float(value) for key, value in _threshold_metrics(tn, fp, fn, tp).items()})
+    roc_auc, average_precision = _area_metrics(ranked.tps, ranked.fps)
+    result.update({'roc_auc': float(roc_auc), 'average_precision': float(average_precision),
+                   'tn': tn, 'fp': fp, 'fn': fn, 'tp': tp})
+    result['best_threshold'], result['best_accuracy'] = ranked.best_threshold()
+    return result
+
+
+def _resample_counts(rng, n_replicates, n):
+    """(replicates, n) matrix of how often each row was drawn in each resample."""
+    draws = rng.integers(0, n, size=(n_replicates, n)) + (np.arange(n_replicates) * n)[:, None]
+    return np.bincount(draws.ravel(), minlength=n_replicates * n).reshape(n_replicates, n).astype(np.float64)
+
+
+def _bootstrap_block(y, probas, n_replicates, seed, threshold):
+    """Worker entry point: every metric of ``n_replicates`` paired resamples for each model."""
+    y = np.asarray(y, dtype=np.float64)
+    counts = _resample_counts(np.random.default_rng(seed), n_replicates, len(y))
+    n = len(y)
+    results = {}
+    for name, proba in probas.items():
+        ranked = Sorted(y, proba)
+        weights = counts[:, ranked.order]
+        tps = np.cumsum(weights * ranked.labels, axis=1)[:, ranked.ends]
+        fps = np.cumsum(weights * (1 - ranked.labels), axis=1)[:, ranked.ends]
+        # Counts at the threshold: rows scoring above it come first in the sorted order
+        predicted = int(np.searchsorted(-ranked.scores, -threshold, side='left'))
+        tp = weights[:, :predicted] @ ranked.labels[:predicted]
+        fp = weights[:, :predicted].sum(axis=1) - tp
+        positives = weights @ ranked.labels
+        fn = positives - tp
+        tn = n - positives - fp
+        block = {'logloss': counts @ _losses(y, ranked.proba) / n}
+        block.update(_threshold_metrics(tn, fp, fn, tp))
+        block['roc_auc'], block['average_precision'] = _area_metrics(tps, fps)
+        results[name] = block
+    return results
+
+
+def bootstrap(y, probas, n_boot=1000, workers=None, random_state=0, threshold=0.5):
+    """``n_boot`` paired bootstrap replicates of every metric for each model.
+
+    ``probas`` maps model names to predicted probabilities of the same rows.
+    Returns {name: {metric: array of n_boot values}}.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    y = np.asarray(y)
+    block = max(1, min(n_boot, BLOCK_CELLS // max(len(y), 1)))
+    sizes = [min(block, n_boot - start) for start in range(0, n_boot, block)]
+    seeds = np.random.SeedSequence(random_state).spawn(len(sizes))
+    workers = max(1, min(workers or os.cpu_count() or 1, len(sizes)))
+    with instrument.stage('bootstrap', detail=f'{n_boot} x {len(probas)} models', rows=len(y)):
+        if workers == 1:
+            blocks = [_bootstrap_block(y, probas, size, seed, threshold) for size, seed in zip(sizes, seeds)]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = [pool.submit(_bootstrap_block, y, probas, size, seed, threshold)
+                           for size, seed in zip(sizes, seeds)]
+                blocks = [future.result() for future in futures]
+    return {name: {metric: np.concatenate([part[name][metric] for part in blocks]) for metric in METRICS}
+            for name in probas}
+
+
+def compare(y, probas, n_boot=1000, confidence=0.95, workers=None, random_state=0, threshold=0.5):
+    """One row per model and metric: the value and its bootstrap percentile interval."""
+    with instrument.stage('metrics', rows=len(y)):
+        point = {name: metrics(y, proba, threshold) for name, proba in probas.items()}
+    replicates = bootstrap(y, probas, n_boot, workers, random_state, threshold) if n_boot else {}
+    tail = 100 * (1 - confidence) / 2
+    rows = []
+    for name in probas:
+        for metric in METRICS:
+            lower, upper = (np.percentile(replicates[name][metric], [tail, 100 - tail]) if n_boot
+                            else (np.nan, np.nan))
+            rows.append({'model': name, 'metric': metric, 'value': point[name][metric], 'lower': lower,
+                         'upper': upper})
+    table = pd.DataFrame(rows)
+    confusion = pd.DataFrame(point).T[['tn', 'fp', 'fn', 'tp', 'best_threshold', 'best_accuracy']]
+    confusion = confusion.astype({key: np.int64 for key in ('tn', 'fp', 'fn', 'tp')})
+    confusion.index.name = 'model'
+    return table, confusion
+
+
+def curves(y, probas):
+    """Long frame of every model's ROC and precision-recall points, for plotting."""
+    frames = []
+    for name, proba in probas.items():
+        ranked = Sorted(y, proba)
+        fpr, tpr, roc_thresholds = ranked.roc_curve()
+        precision, recall, pr_thresholds = ranked.pr_curve()
+        frames.append(pd.DataFrame({'model': name, 'curve': 'roc', 'threshold': roc_thresholds, 'x': fpr,
+                                    'y': tpr}))
+        frames.append(pd.DataFrame({'model': name, 'curve': 'pr', 'threshold': pr_thresholds, 'x': recall,
+                                    'y': precision}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def format_table(table):
+    """Models as rows and ``value [lower, upper]`` cells per metric."""
+    cells = table.apply(lambda row: f"{row['value']:.5f}" + (
+        '' if np.isnan(row['lower']) else f" [{row['lower']:.5f}, {row['upper']:.5f}]"), axis=1)
+    wide = table.assign(cell=cells).pivot(index='model', columns='metric', values='cell')
+    return wide.reindex(index=list(dict.fromkeys(table['model'])), columns=list(METRICS))
+
+
+def run(travel_path, survey_path, names=None, artifacts=None, cores=None, test_size=0.2, random_state=None,
+        cache_dir=None, encoding='onehot', n_boot=1000, confidence=0.95, workers=None, threshold=0.5,
+        curves_path=None, output_path=None, **options):
+    """Compare models on held-out rows, with bootstrap intervals.
+
+    With ``artifacts`` (saved model paths) the models are scored on the
+    given labelled file pair, which should be held out from their training.
+    Otherwise the families in ``names`` are fitted in parallel as by
+    ``zoo`` and scored on the held-out split. Returns (table, confusion).
+    """
+    from shinkansen import pipeline
+    from shinkansen.matrix import FeatureMatrix
+
+    if artifacts:
+        data = pipeline.merge(*pipeline.load_raw(travel_path, survey_path, cache_dir))
+        y, probas = None, {}
+        for path in artifacts:
+            artifact = pipeline.load_model(path)
+            matrix = FeatureMatrix.build(data, artifact['preprocessor'])
+            label = artifact['report']['model']
+            label = label if label not in probas else f'{label} ({os.path.basename(path)})'
+            with instrument.stage('predict_proba', detail=label, rows=len(matrix)):
+                probas[label] = artifact['model'].predict_proba(matrix.X)[:, 1]
+            y = matrix.y
+    else:
+        from shinkansen import zoo
+        from shinkansen.models import MODEL_NAMES
+
+        _, train_set, test_set = pipeline.prepare(travel_path, survey_path, test_size, random_state, cache_dir,
+                                                  encoding)
+        results, _ = zoo.fit_parallel(train_set, test_set, names or MODEL_NAMES, cores, random_state=random_state,
+                                      **options)
+        y = test_set.y
+        probas = {}
+        for name, (model, _) in results.items():
+            with instrument.stage('predict_proba', detail=name, rows=len(test_set)):
+                probas[name] = model.predict_proba(test_set.X)[:, 1]
+
+    table, confusion = compare(y, probas, n_boot, confidence, workers, random_state or 0, threshold)
+    print(f"{len(y)} held-out rows, {n_boot} bootstrap resamples, {confidence:.0%} intervals, "
+          f"threshold {threshold}")
+    print(format_table(table).to_string())
+    print(confusion.to_string(float_format='%.4f'))
+    if output_path:
+        table.to_csv(output_path, index=False)
+        print(f"Comparison written to {output_path}")
+    if curves_path:
+        curves(y, probas).to_csv(curves_path, index=False)
+        print(f"Curves written to {curves_path}")
+    return table, confusion
@@ -0,0 +1,326 @@
+"""RandomForest under a model-size budget, stored as flat arrays that load memory-mapped.
+
+The notebook's ``RandomForestClassifier(n_estimators=1000)`` grows every tree
+until its leaves are pure, which on ~75k rows means thousands of nodes per
+tree and a pickle of several hundred MB. Every scoring process unpickles its
+own copy: scikit-learn's ``Tree`` copies its node arrays into memory it owns
+when unpickled, so even ``joblib.load(mmap_mode='r')`` cannot share them.
+
+:func:`plan` turns a size budget into tree limits. Stored nodes cost
+:data:`BYTES_PER_NODE`, and a binary tree with ``L`` leaves has ``2L - 1``
+nodes, so the budget divided by the number of trees caps
+``max_leaf_nodes``; the limit on depth, the minimum leaf size and
+``max_samples`` follow from that leaf count. The fitted forest is then
+converted to :class:`CompactForest`: the trees' child, feature, threshold and
+leaf-probability arrays concatenated into five flat arrays. Its prediction
+walks all trees for a block of rows at once, one array gather per level
+for the (row, tree) pairs not yet at a leaf, and reads the arrays in
+place. Saved with joblib, which stores arrays raw, and loaded with
+``mmap_mode='r'``, every scoring process maps the same read-only pages of
+the file instead of holding a private copy.
+
+LightGBM and XGBoost boosters with numerical splits flatten the same way
+(:meth:`CompactForest.from_lightgbm`, :meth:`CompactForest.from_xgboost`),
+with leaves holding log-odds that are summed instead of averaged; the model
+registry scores them this way without importing either library.
+
+:func:`load_benchmark` loads an artifact in several processes at once, with
+and without memory mapping, and reports load time and per-process memory.
+"""
+
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# int32 left and right child, int32 feature, float64 threshold, float32 leaf probability
+BYTES_PER_NODE = 4 + 4 + 4 + 8 + 4
+
+# Rows times trees walked per block in CompactForest.predict_proba
+BLOCK_CELLS = 4_000_000
+
+
+def plan(max_model_mb, n_rows, n_estimators):
+    """Forest parameters that keep ``n_estimators`` trees within ``max_model_mb``.
+
+    ``max_leaf_nodes`` is the hard cap that guarantees the budget. Depth is
+    limited to twice a balanced tree's depth, leaves must hold a few rows
+    each, and a tree whose leaves cannot all be well populated is grown on
+    a bootstrap sample of only as many rows as it can use.
+    """
+    per_tree = max_model_mb * 2**20 / n_estimators
+    leaves = int((per_tree / BYTES_PER_NODE + 1) // 2)
+    if leaves < 2:
+        raise ValueError(f'{max_model_mb} MB cannot hold {n_estimators} trees of even one split; '
+                         f'use fewer trees or a larger budget')
+    max_samples = min(1.0, 50 * leaves / n_rows)
+    sampled = max(1, int(max_samples * n_rows))
+    return {
+        'max_leaf_nodes': leaves,
+        'max_depth': 2 * math.ceil(math.log2(leaves)),
+        'min_samples_leaf': max(1, sampled // (8 * leaves)),
+        'max_samples': None if max_samples >= 1.0 else max_samples,
+    }
+
+
+def _flat_tree(root, children, split, leaf_value):
+    """Node arrays of one nested tree in pre-order, with node 0 the root.
+
+    ``children(node)`` gives (left, right) of an inner node or None for a
+    leaf, ``split(node)`` its (feature, threshold) for ``x <= threshold``
+    going left, and ``leaf_value(node)`` a leaf's value.
+    """
+    left, right, feature, threshold, value, depths = [], [], [], [], [], []
+    stack = [(root, None, 0)]
+    while stack:
+        node, parent_slot, depth = stack.pop()
+        index = len(left)
+        if parent_slot is not None:
+            parent_slot[0][parent_slot[1]] = index
+        pair = children(node)
+        left.append(-1)
+        right.append(-1)
+        depths.append(depth)
+        if pair is None:
+            feature.append(0)
+            threshold.append(0.0)
+            value.append(leaf_value(node))
+        else:
+            column, cut = split(node)
+            feature.append(column)
+            threshold.append(cut)
+            value.append(0.0)
+            # Right pushed first so the left subtree is laid out right after its parent
+            stack.append((pair[1], (right, index), depth + 1))
+            stack.append((pair[0], (left, index), depth + 1))
+    return left, right, feature, threshold, value, max(depths)
+
+
+class CompactForest:
+    """A fitted tree ensemble as flat node arrays, scored in place.
+
+    Forest leaves hold probabilities, averaged over the trees (``link='mean'``);
+    booster leaves hold log-odds, summed with ``base_score`` and passed through
+    a sigmoid scaled by ``scale`` (``link='logistic'``).
+    """
+
+    classes_ = np.array([0, 1])
+    # Defaults for forests pickled before boosters could be flattened
+    link = 'mean'
+    base_score = 0.0
+    scale = 1.0
+
+    def __init__(self, left, right, feature, threshold, value, roots, max_depth, feature_importances=None,
+                 link='mean', base_score=0.0, scale=1.0):
+        self.left = left
+        self.right = right
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.feature_importances_ = feature_importances
+        self.link = link
+        self.base_score = base_score
+        self.scale = scale
+
+    @classmethod
+    def _from_trees(cls, trees, **kwargs):
+        arrays = [[], [], [], [], []]
+        roots, offset = [], 0
+        for left, right, feature, threshold, value, _ in trees:
+            roots.append(offset)
+            left, right = np.asarray(left), np.asarray(right)
+            arrays[0].append(np.where(left < 0, -1, left + offset))
+            arrays[1].append(np.where(right < 0, -1, right + offset))
+            arrays[2].append(feature)
+            arrays[3].append(threshold)
+            arrays[4].append(value)
+            offset += len(left)
+        left, right, feature, threshold, value = (np.concatenate(parts) for parts in arrays)
+        return cls(left.astype(np.int32), right.astype(np.int32), feature.astype(np.int32),
+                   threshold.astype(np.float64), value.astype(np.float64), np.asarray(roots, dtype=np.int64),
+                   max(tree[5] for tree in trees), **kwargs)
+
+    @classmethod
+    def from_lightgbm(cls, booster):
+        """Flatten a binary or cross-entropy LightGBM ``Booster`` with numerical splits."""
+        dump = booster.dump_model()
+        objective = dump['objective'].split()
+        if objective[0] not in ('binary', 'cross_entropy') or dump['num_tree_per_iteration'] != 1:
+            raise ValueError(f"cannot flatten a LightGBM model with objective {dump['objective']!r}")
+        scale = float(next((part.split(':')[1] for part in objective if part.startswith('sigmoid:')), 1.0))
+
+        def children(node):
+            if 'leaf_value' in node:
+                return None
+            if node['decision_type'] != '<=':
+                raise ValueError('cannot flatten LightGBM categorical splits')
+            return node['left_child'], node['right_child']
+
+        trees = [_flat_tree(tree['tree_structure'], children,
+                            lambda node: (node['split_feature'], node['threshold']),
+                            lambda node: node['leaf_value'])
+                 for tree in dump['tree_info']]
+        return cls._from_trees(trees, link='logistic', scale=scale,
+                               feature_importances=booster.feature_importance(importance_type='split'))
+
+    @classmethod
+    def from_xgboost(cls, booster):
+        """Flatten a ``binary:logistic`` XGBoost ``Booster``."""
+        import json
+
+        config = json.loads(booster.save_config())['learner']
+        if config['objective']['name'] != 'binary:logistic':
+            raise ValueError(f"cannot flatten an XGBoost model with objective {config['objective']['name']!r}")
+        base = float(config['learner_model_param']['base_score'].strip('[]'))
+        names = booster.feature_names
+
+        def split(node):
+            column = names.index(node['split']) if names else int(node['split'][1:])
+            # XGBoost sends x < t left; for float32 inputs that is x <= the float32 just below t
+            return column, float(np.nextafter(np.float32(node['split_condition']), np.float32(-np.inf)))
+
+        trees = [_flat_tree(json.loads(dump), lambda node: None if 'leaf' in node else tuple(
+                     sorted(node['children'], key=lambda child: child['nodeid'] != node['yes'])),
+                            split, lambda node: node['leaf'])
+                 for dump in booster.get_dump(dump_format='json')]
+        return cls._from_trees(trees, link='logistic', base_score=float(np.log(base / (1 - base))))
+
+    @classmethod
+    def from_forest(cls, model):
+        """Flatten a fitted binary ``RandomForestClassifier``."""
+        left, right, feature, threshold, value, roots = [], [], [], [], [], []
+        offset = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            leaf = tree.children_left < 0
+            roots.append(offset)
+            left.append(np.where(leaf, -1, tree.children_left + offset))
+            right.append(np.where(leaf, -1, tree.children_right + offset))
+            # Leaves point at feature 0 so the walk can gather it without a mask
+            feature.append(np.where(leaf, 0, tree.feature))
+            threshold.append(tree.threshold)
+            counts = tree.value[:, 0, :]
+            value.append(counts[:, 1] / counts.sum(axis=1))
+            offset += tree.node_count
+        return cls(np.concatenate(left).astype(np.int32), np.concatenate(right).astype(np.int32),
+                   np.concatenate(feature).astype(np.int32), np.concatenate(threshold).astype(np.float64),
+                   np.concatenate(value).astype(np.float32), np.asarray(roots, dtype=np.int64),
+                   max(estimator.tree_.max_depth for estimator in model.estimators_),
+                   getattr(model, 'feature_importances_', None))
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    @property
+    def node_count(self):
+        return len(self.left)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.left, self.right, self.feature, self.threshold, self.value,
+                                               self.roots))
+
+    def _leaf_values(self, X):
+        n_rows, n_columns = X.shape
+        n_trees = len(self.roots)
+        # One flat (row, tree) walk; rows that reached a leaf drop out of the active set
+        nodes = np.tile(self.roots, n_rows)
+        offsets = np.repeat(np.arange(n_rows, dtype=np.int64) * n_columns, n_trees)
+        flat = X.ravel()
+        active = np.arange(len(nodes))
+        for _ in range(self.max_depth):
+            current = nodes[active]
+            left = self.left.take(current)
+            inner = left >= 0
+            active, current, left = active[inner], current[inner], left[inner]
+            if not len(active):
+                break
+            go_left = flat.take(offsets[active] + self.feature.take(current)) <= self.threshold.take(current)
+            nodes[active] = np.where(go_left, left, self.right.take(current))
+        return self.value.take(nodes).reshape(n_rows, n_trees)
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        block = max(1, BLOCK_CELLS // max(len(self.roots), 1))
+        combine = np.mean if self.link == 'mean' else np.sum
+        scores = np.concatenate([combine(self._leaf_values(X[start:start + block]), axis=1, dtype=np.float64)
+                                 for start in range(0, len(X), block)]) if len(X) else np.empty(0)
+        if self.link == 'logistic':
+            scores = 1 / (1 + np.exp(-self.scale * (scores + self.base_score)))
+        return np.column_stack([1 - scores, scores])
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] > 0.5).astype(np.int64)
+
+
+def _memory_kb():
+    """(rss, anonymous, pss) KiB of this process from /proc/self/smaps_rollup, zeros elsewhere."""
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1])
+    except OSError:
+        pass
+    return fields.get('Rss', 0), fields.get('Anonymous', 0), fields.get('Pss', 0)
+
+
+def _load_worker(model_path, mmap_mode, X, barrier, results):
+    """Process entry point: load the artifact, score ``X`` and report memory once every process has."""
+    from shinkansen import pipeline
+
+    base_rss, base_anon, _ = _memory_kb()
+    start = time.perf_counter()
+    artifact = pipeline.load_model(model_path, mmap_mode=mmap_mode)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    artifact['model'].predict_proba(X)
+    score_seconds = time.perf_counter() - start
+    # Measure while every process still holds its model, so PSS splits the shared pages between them
+    barrier.wait()
+    rss, anonymous, pss = _memory_kb()
+    results.put({
+        'load_s': load_seconds,
+        'score_s': score_seconds,
+        'rss_mb': (rss - base_rss) / 1024,
+        'private_mb': (anonymous - base_anon) / 1024,
+        'pss_mb': pss / 1024,
+    })
+    barrier.wait()
+
+
+def load_benchmark(model_path, X, processes=4):
+    """Load time and memory of ``processes`` concurrent scoring processes, with and without mmap.
+
+    RSS and private (anonymous) memory are what loading and scoring ``X``
+    added to each process; PSS is each process's fair share of all its
+    pages, shared ones divided among the processes mapping them.
+    """
+    import multiprocessing
+
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    for mmap_mode in ('r', None):
+        barrier = context.Barrier(processes)
+        results = context.Queue()
+        workers = [context.Process(target=_load_worker, args=(model_path, mmap_mode, X, barrier, results))
+                   for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        measured = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        frame = pd.DataFrame(measured)
+        rows.append(dict(mode='mmap' if mmap_mode else 'full', processes=processes,
+                         **frame.mean().to_dict(), total_pss_mb=frame['pss_mb'].sum()))
+    table = pd.DataFrame(rows)
+    print(f"{model_path}: {os.path.getsize(model_path) / 2**20:.1f} MB on disk, {processes} processes")
+    print(table.to_string(index=False, float_format='%.3f'))
+    return table
@@ -0,0 +1,170 @@
+"""Warm-start retraining on a newly arrived batch of labelled rows.
+
+Retraining from scratch re-reads every .csv file, refits the preprocessing
+and grows all boosting rounds again. :func:`update` instead loads the saved
+artifact, encodes only the new Traveldata/Surveydata batch with the
+artifact's fitted preprocessing and keeps boosting from the saved model's
+best iteration (LightGBM ``init_model``, XGBoost ``xgb_model``), with early
+stopping on part of the new rows.
+
+A guardrail decides whether the result replaces the artifact: the old and
+the updated model are scored on held-out rows, which are taken from the new
+batch and, if given, a further held-out file pair, and the update is only
+accepted when its log loss is not worse by more than ``tolerance``.
+``compare_full`` also rebuilds the model from scratch on the old and new
+files together and reports both times and log losses.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from shinkansen import config, instrument, pipeline, training
+from shinkansen.evaluation import logloss
+from shinkansen.matrix import FeatureMatrix
+from shinkansen.models import eval_kwargs, make_model
+
+INCREMENTAL_MODELS = ('lightgbm', 'xgboost')
+
+
+def _continue_lightgbm(model, train, valid, n_estimators, early_stopping_rounds, random_state):
+    import lightgbm as lgbm
+
+    best = model.best_iteration_ or model.booster_.current_iteration()
+    # Start from the best iteration, not from the trees grown past it before early stopping
+    init = lgbm.Booster(model_str=model.booster_.model_to_string(num_iteration=best))
+    updated = make_model('lightgbm', n_estimators=n_estimators, random_state=random_state,
+                         **_carried_params(model))
+    updated.fit(train.X, train.y, eval_metric='binary_logloss', init_model=init,
+                callbacks=[lgbm.early_stopping(early_stopping_rounds, verbose=False)],
+                **eval_kwargs(updated, valid.X, valid.y))
+    # best_iteration_ counts the initial trees too
+    return updated, best, (updated.best_iteration_ or updated.booster_.current_iteration()) - best
+
+
+def _continue_xgboost(model, train, valid, n_estimators, early_stopping_rounds, random_state):
+    booster = model.get_booster()
+    try:
+        best = model.best_iteration + 1
+    except AttributeError:
+        best = booster.num_boosted_rounds()
+    updated = make_model('xgboost', n_estimators=n_estimators, random_state=random_state,
+                         early_stopping_rounds=early_stopping_rounds, **_carried_params(model))
+    updated.fit(train.X, train.y, eval_set=[(valid.X, valid.y)], verbose=False, xgb_model=booster[:best])
+    # As with LightGBM, best_iteration counts the rounds of xgb_model too
+    return updated, best, updated.best_iteration + 1 - best
+
+
+def _carried_params(model):
+    """Tree parameters of the saved model that the continued rounds must share."""
+    params = model.get_params()
+    carried = ['learning_rate', 'num_leaves', 'max_depth', 'min_child_samples', 'min_child_weight', 'subsample',
+               'subsample_freq', 'colsample_bytree', 'reg_alpha', 'reg_lambda', 'grow_policy', 'max_bin']
+    return {key: params[key] for key in carried if params.get(key) is not None}
+
+
+def _encoded(travel_path, survey_path, preprocessor, cache_dir=None):
+    data = pipeline.merge(*pipeline.load_raw(travel_path, survey_path, cache_dir))
+    return FeatureMatrix.build(data, preprocessor)
+
+
+def _model_logloss(model, matrix):
+    return logloss(matrix.y, model.predict_proba(matrix.X)[:, 1])
+
+
+def full_rebuild(base_paths, new_paths, holdout_ids, name, n_estimators=None, early_stopping_rounds=150,
+                 test_size=0.2, random_state=0, encoding='onehot', cache_dir=None):
+    """Refit preprocessing and model on the old and new files together, excluding the held-out IDs.
+
+    Returns (model, preprocessor, seconds including reading the files).
+    """
+    from shinkansen.preprocess import Preprocessor
+
+    start = time.perf_counter()
+    with instrument.stage('full_rebuild', detail=name) as record:
+        data = pd.concat([pipeline.merge(*pipeline.load_raw(*paths, cache_dir)) for paths in (base_paths, new_paths)],
+                         ignore_index=True)
+        data = data[~data[config.ID_COL].isin(holdout_ids)]
+        preprocessor = Preprocessor(encoding=encoding).fit(data)
+        train, valid = FeatureMatrix.build(data, preprocessor).split(test_size=test_size, random_state=random_state)
+        model, _ = training.fit(name, train, valid, n_estimators=n_estimators,
+                                early_stopping_rounds=early_stopping_rounds, random_state=random_state)
+        record['rows'] = len(data)
+    return model, preprocessor, time.perf_counter() - start
+
+
+def update(model_path, travel_path, survey_path, output_path=None, holdout_paths=None, n_estimators=500,
+           early_stopping_rounds=50, test_size=0.2, tolerance=0.0, random_state=0, cache_dir=None,
+           compare_full=None):
+    """Continue boosting a saved model on a new labelled file pair, guarded by held-out log loss.
+
+    ``test_size`` of the new rows are held out; ``holdout_paths`` adds a
+    (travel, survey) pair of held-out files. Half of the new held-out rows
+    drive early stopping and the other half, with the held-out files, judge
+    the guardrail. The updated artifact is written to ``output_path``
+    (default: over ``model_path``) only when accepted. ``compare_full`` is a
+    (travel, survey) pair of the original training files to also rebuild
+    from scratch. Returns the update report.
+    """
+    start = time.perf_counter()
+    artifact = pipeline.load_model(model_path)
+    name = artifact['report']['model']
+    if name not in INCREMENTAL_MODELS:
+        raise ValueError(f'cannot continue training {name!r}, expected one of {INCREMENTAL_MODELS}')
+    preprocessor = artifact['preprocessor']
+
+    with instrument.stage('update', detail=name) as record:
+        new = _encoded(travel_path, survey_path, preprocessor, cache_dir)
+        train, held = new.split(test_size=test_size, random_state=random_state, stratify=True)
+        stopping, guard = held.split(test_size=0.5, random_state=random_state, stratify=True)
+        if holdout_paths:
+            extra = _encoded(*holdout_paths, preprocessor, cache_dir)
+            guard = FeatureMatrix(np.concatenate([guard.X, extra.X]), np.concatenate([guard.y, extra.y]),
+                                  np.concatenate([guard.ids, extra.ids]), guard.feature_names)
+
+        fitter = _continue_lightgbm if name == 'lightgbm' else _continue_xgboost
+        model, kept, added = fitter(artifact['model'], train, stopping, n_estimators, early_stopping_rounds,
+                                    random_state)
+        record['rows'] = len(train)
+    seconds = time.perf_counter() - start
+
+    before, after = _model_logloss(artifact['model'], guard), _model_logloss(model, guard)
+    accepted = after <= before + tolerance
+    report = {
+        'model': name,
+        'new_rows': len(new),
+        'train_rows': len(train),
+        'guard_rows': len(guard),
+        'trees_kept': int(kept),
+        'trees_added': int(added),
+        'logloss_before': before,
+        'logloss_after': after,
+        'accepted': bool(accepted),
+        'seconds': seconds,
+    }
+    print(f"{name}: {added} trees added to {kept} on {len(train)} new rows in {seconds:.2f}s; held-out logloss "
+          f"{before:.5f} -> {after:.5f} on {len(guard)} rows, {'accepted' if accepted else 'rejected'}")
+
+    if compare_full:
+        held_ids = np.concatenate([held.ids, guard.ids])
+        full, full_preprocessor, full_seconds = full_rebuild(
+            compare_full, (travel_path, survey_path), held_ids, name, random_state=random_state,
+            encoding=preprocessor.encoding, cache_dir=cache_dir)
+        full_guard = _encoded(travel_path, survey_path, full_preprocessor, cache_dir).take(
+            np.flatnonzero(np.isin(new.ids, guard.ids)))
+        if holdout_paths:
+            extra = _encoded(*holdout_paths, full_preprocessor, cache_dir)
+            full_guard = FeatureMatrix(np.concatenate([full_guard.X, extra.X]),
+                                       np.concatenate([full_guard.y, extra.y]),
+                                       np.concatenate([full_guard.ids, extra.ids]), full_guard.feature_names)
+        report.update({'full_seconds': full_seconds, 'full_logloss': _model_logloss(full, full_guard)})
+        print(f"Full rebuild: {full_seconds:.2f}s ({full_seconds / seconds:.1f}x the update), held-out logloss "
+              f"{report['full_logloss']:.5f}")
+
+    if accepted:
+        # Keep whatever else the artifact carries, such as the zoo summary
+        extra = {key: value for key, value in artifact.items() if key not in ('model', 'preprocessor', 'report')}
+        extra['updates'] = list(extra.get('updates', [])) + [report]
+        pipeline.save_model(output_path or model_path, model, preprocessor, artifact['report'], **extra)
+    return report
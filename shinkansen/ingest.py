@@ -0,0 +1,129 @@
+"""Schema-driven loading of the Traveldata/Surveydata files.
+
+Columns are read straight into their final storage types: ``category`` with
+the known answer levels for the 19 categorical columns, int8/int32/float32
+for the numeric ones. The parsed frame is written to an uncompressed Arrow
+IPC (Feather v2) file so later runs memory-map it instead of parsing the
+.csv again. The cache needs ``pyarrow``; without it every load parses the
+.csv.
+"""
+
+import hashlib
+import os
+import time
+
+import pandas as pd
+
+from shinkansen import config, instrument
+
+
+def column_dtypes():
+    """Storage type of every known column."""
+    dtypes = {col: pd.CategoricalDtype(levels) for col, levels in config.CATEGORY_LEVELS.items()}
+    dtypes.update(config.NUMERIC_DTYPES)
+    return dtypes
+
+
+def read_csv(path, **kwargs):
+    """Parse one .csv file with the typed schema.
+
+    Values outside the known category levels are read as missing and are
+    imputed like any other missing answer.
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    dtypes = column_dtypes()
+    return pd.read_csv(path, dtype={col: dtypes[col] for col in header if col in dtypes}, **kwargs)
+
+
+def _have_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def cache_path(path, cache_dir):
+    """Cache file for ``path``, keyed on its location, size and mtime."""
+    stat = os.stat(path)
+    key = f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f'{stem}-{digest}.arrow')
+
+
+def load(path, cache_dir=None):
+    """Load one .csv file, going through the columnar cache when possible."""
+    with instrument.stage('load', detail=os.path.basename(path)) as record:
+        frame = _load(path, cache_dir)
+        record['rows'] = len(frame)
+    return frame
+
+
+def _load(path, cache_dir):
+    if cache_dir is None or not _have_pyarrow():
+        return read_csv(path)
+
+    from pyarrow import feather
+
+    cached = cache_path(path, cache_dir)
+    if os.path.exists(cached):
+        return feather.read_table(cached, memory_map=True).to_pandas()
+
+    frame = read_csv(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary name first so a crashed run never leaves a torn cache
+    tmp = f'{cached}.{os.getpid()}.tmp'
+    feather.write_feather(frame, tmp, compression='uncompressed')
+    os.replace(tmp, cached)
+    return frame
+
+
+def _measure(mode, path, cache_dir):
+    """Load ``path`` in the given mode; runs in a fresh process."""
+    import resource
+
+    if _have_pyarrow():
+        from pyarrow import feather  # noqa: F401
+    baseline = instrument.current_rss_kb()
+    start = time.perf_counter()
+    if mode == 'csv':
+        frame = pd.read_csv(path)
+    elif mode == 'typed':
+        frame = read_csv(path)
+    else:
+        frame = load(path, cache_dir)
+    seconds = time.perf_counter() - start
+    return {
+        'mode': mode,
+        'seconds': seconds,
+        'frame_mb': frame.memory_usage(deep=True).sum() / 2**20,
+        # ru_maxrss is reported in KiB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10,
+        'load_rss_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 2**10,
+    }
+
+
+def benchmark(paths, cache_dir):
+    """Compare untyped, typed and cached loading of each file.
+
+    Every measurement runs in its own process so peak RSS is not inflated by
+    an earlier load; ``load_rss_mb`` is the peak RSS above the resident size
+    once the libraries are imported. The cache is filled first so the
+    ``cached`` row times a warm read.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    for path in paths:
+        load(path, cache_dir)
+
+    rows = []
+    ctx = multiprocessing.get_context('spawn')
+    for path in paths:
+        for mode in ('csv', 'typed', 'cached'):
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                result = pool.submit(_measure, mode, path, cache_dir).result()
+            result['file'] = os.path.basename(path)
+            rows.append(result)
+    return pd.DataFrame(rows, columns=['file', 'mode', 'seconds', 'frame_mb', 'peak_rss_mb', 'load_rss_mb'])
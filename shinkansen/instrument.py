@@ -0,0 +1,255 @@
+"""Per-stage wall time, CPU time, peak RSS and row counts.
+
+Pipeline stages and model calls run inside :func:`stage`, which records one
+entry per call into :data:`RECORDER`::
+
+    with instrument.stage('merge') as record:
+        data = pd.merge(travel, survey, on='ID')
+        record['rows'] = len(data)
+
+Stages nest, and an entry's ``stage`` is its path from the outermost one,
+e.g. ``train/prepare/encode``. Recording is on by default: entering and
+leaving a stage reads two clocks and ``/proc/self/statm``, and a single
+background thread samples the resident set size every 10 ms while any stage
+is open, so the peak includes memory allocated inside native libraries.
+``SHINKANSEN_INSTRUMENT=0`` turns it off.
+
+Finished entries go to every function registered with :func:`add_hook`,
+which is how a scheduler collects them; the CLI also writes them to
+``--metrics`` as JSON or CSV. :meth:`Recorder.profile` attaches cProfile,
+or a sampler writing collapsed stacks in the format py-spy, flamegraph.pl
+and speedscope read, to one chosen stage.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+FIELDS = ['stage', 'detail', 'rows', 'seconds', 'cpu_seconds', 'peak_rss_mb', 'rss_delta_mb', 'started']
+
+
+def current_rss_kb():
+    """Resident set size right now, in KiB (Linux only, else 0)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        return 0
+
+
+class _RSSSampler:
+    """One thread raising the ``_peak`` of every open entry."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self._open = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, record):
+        with self._lock:
+            self._open[id(record)] = record
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='shinkansen-rss', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, record):
+        with self._lock:
+            self._open.pop(id(record), None)
+            if not self._open:
+                self._wake.clear()
+
+    def _run(self):
+        while True:
+            # Sleep until a stage opens
+            self._wake.wait()
+            time.sleep(self.interval)
+            rss = current_rss_kb()
+            with self._lock:
+                for record in self._open.values():
+                    record['_peak'] = max(record['_peak'], rss)
+
+
+class _StackSampler:
+    """Sample one thread's Python stack and count the collapsed stacks."""
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({code.co_filename}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, path):
+        self._stop.set()
+        self._thread.join()
+        with open(path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class Recorder:
+    """Collects one entry per stage call and hands it to the hooks."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.records = []
+        self.hooks = []
+        self._local = threading.local()
+        self._sampler = _RSSSampler()
+        self._profile = None
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def stage(self, name, detail=None, rows=None):
+        """Record one stage; the yielded dict accepts ``rows`` and ``detail`` set inside the block."""
+        if not self.enabled:
+            yield {}
+            return
+        stack = self._stack()
+        path = '/'.join(stack + [name])
+        rss = current_rss_kb()
+        record = {'stage': path, 'detail': detail, 'rows': rows, '_peak': rss}
+        stack.append(name)
+        self._sampler.add(record)
+        profiler = self._start_profile(name, path)
+        cpu = time.process_time()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+            if profiler is not None:
+                self._stop_profile(profiler)
+            self._sampler.remove(record)
+            stack.pop()
+            peak = max(record.pop('_peak'), current_rss_kb())
+            record.update({
+                'seconds': seconds,
+                'cpu_seconds': cpu,
+                'peak_rss_mb': peak / 2**10,
+                'rss_delta_mb': (peak - rss) / 2**10,
+                'started': time.time() - seconds,
+            })
+            self.records.append(record)
+            for hook in list(self.hooks):
+                hook(record)
+
+    def profile(self, name, path):
+        """Profile the first call of stage ``name`` (leaf name or full path) into ``path``.
+
+        A ``.prof`` path gets a cProfile dump for pstats or snakeviz; any
+        other gets sampled collapsed stacks.
+        """
+        self._profile = (name, path)
+
+    def _start_profile(self, name, path):
+        if self._profile is None or self._profile[0] not in (name, path):
+            return None
+        target = self._profile[1]
+        self._profile = None
+        if target.endswith('.prof'):
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = _StackSampler(threading.get_ident())
+            profiler.start()
+        return profiler, target
+
+    def _stop_profile(self, profiler):
+        profiler, target = profiler
+        if isinstance(profiler, _StackSampler):
+            profiler.stop(target)
+        else:
+            profiler.disable()
+            profiler.dump_stats(target)
+        print(f"Profile written to {target}", file=sys.stderr)
+
+    def clear(self):
+        self.records = []
+
+    def table(self):
+        import pandas as pd
+
+        return pd.DataFrame(self.records, columns=FIELDS).astype({'rows': 'Int64'})
+
+    def write(self, path):
+        """Write the entries to ``path``: .csv, or JSON with the run's environment."""
+        if path.endswith('.csv'):
+            self.table().to_csv(path, index=False)
+            return
+        with open(path, 'w') as f:
+            json.dump({'meta': metadata(), 'stages': self.records}, f, indent=1)
+
+
+def metadata():
+    """Commit, time, interpreter, platform and library versions of this run."""
+    import platform
+    import subprocess
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    from importlib import metadata as dist
+
+    versions = {}
+    # Read from the installed distributions, which is much cheaper than importing them
+    for name in ('numpy', 'pandas', 'scikit-learn', 'lightgbm', 'xgboost'):
+        try:
+            versions[name] = dist.version(name)
+        except dist.PackageNotFoundError:
+            pass
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'versions': versions,
+    }
+
+
+RECORDER = Recorder(enabled=os.environ.get('SHINKANSEN_INSTRUMENT', '1') != '0')
+
+
+def stage(name, detail=None, rows=None):
+    """Record a stage into :data:`RECORDER`; see :meth:`Recorder.stage`."""
+    return RECORDER.stage(name, detail, rows)
+
+
+def add_hook(hook):
+    """Call ``hook(entry)`` with every finished stage entry."""
+    RECORDER.hooks.append(hook)
+
+
+def remove_hook(hook):
+    RECORDER.hooks.remove(hook)
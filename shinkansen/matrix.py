@@ -0,0 +1,170 @@
+"""One float32 feature matrix shared by every model.
+
+LightGBM, XGBoost and scikit-learn each convert a mixed-dtype DataFrame
+(uint8 dummies next to float numerics) into their own float array on every
+``fit``, ``predict`` and ``predict_proba`` call. :class:`FeatureMatrix`
+holds the features as a single C-contiguous float32 array instead, which all
+three libraries accept as-is: scikit-learn trees work in float32 natively
+and the boosters read float32 rows without an intermediate copy.
+"""
+
+import os
+import secrets
+import time
+import tracemalloc
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from shinkansen import config, instrument
+
+
+class FeatureMatrix:
+    """Feature array, labels and passenger IDs in a fixed column layout."""
+
+    def __init__(self, X, y, ids, feature_names):
+        self.X = np.ascontiguousarray(X, dtype=np.float32)
+        self.y = None if y is None else np.ascontiguousarray(y, dtype=np.int8)
+        self.ids = np.asarray(ids)
+        self.feature_names = list(feature_names)
+
+    @classmethod
+    def build(cls, data, preprocessor, nullity=None):
+        """Encode a merged frame; labels are taken when Overall_Experience is present."""
+        y = data[config.TARGET_COL].to_numpy() if config.TARGET_COL in data else None
+        with instrument.stage('encode', rows=len(data)):
+            X = preprocessor.transform_matrix(data, nullity=nullity)
+        return cls(X, y, data[config.ID_COL].to_numpy(), preprocessor.feature_names)
+
+    def __len__(self):
+        return len(self.X)
+
+    @property
+    def nbytes(self):
+        return self.X.nbytes + (0 if self.y is None else self.y.nbytes)
+
+    def positions(self, names):
+        """Column positions of ``names``, e.g. for LightGBM ``categorical_feature``."""
+        return [self.feature_names.index(name) for name in names]
+
+    def take(self, rows):
+        """Row subset as a new contiguous matrix."""
+        return FeatureMatrix(self.X[rows], None if self.y is None else self.y[rows], self.ids[rows],
+                             self.feature_names)
+
+    def split_rows(self, test_size=0.2, random_state=None, stratify=False):
+        """Sorted train and test row positions, like ``train_test_split``."""
+        from sklearn.model_selection import train_test_split
+
+        train_rows, test_rows = train_test_split(np.arange(len(self)), test_size=test_size,
+                                                 random_state=random_state,
+                                                 stratify=self.y if stratify else None)
+        return np.sort(train_rows), np.sort(test_rows)
+
+    def split(self, test_size=0.2, random_state=None, stratify=False):
+        """Train and test matrices; see :meth:`split_rows`."""
+        train_rows, test_rows = self.split_rows(test_size, random_state, stratify)
+        return self.take(train_rows), self.take(test_rows)
+
+    def to_frame(self):
+        """DataFrame view of the features, indexed by ID."""
+        import pandas as pd
+
+        return pd.DataFrame(self.X, index=pd.Index(self.ids, name=config.ID_COL), columns=self.feature_names,
+                            copy=False)
+
+
+def traced_call(func, *args, **kwargs):
+    """Run ``func`` and return (result, seconds, peak bytes allocated).
+
+    numpy registers its buffers with tracemalloc, so the peak includes any
+    array a library allocates to convert its input.
+    """
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+class SharedFeatureMatrix:
+    """A :class:`FeatureMatrix` copied once into shared memory.
+
+    ``spec`` is a small picklable description that worker processes pass to
+    :func:`attach` to map the same arrays without copying or pickling them.
+    The creating process owns the memory and releases it with :meth:`close`.
+    Blocks are named after the owner's PID, so ones left behind by a killed
+    process can be found and removed by the next run.
+    """
+
+    PREFIX = 'shinkansen_'
+
+    def __init__(self, matrix):
+        remove_orphaned_blocks()
+        self._blocks = []
+        self.spec = {'feature_names': matrix.feature_names, 'arrays': {}}
+        for key in ('X', 'y', 'ids'):
+            array = getattr(matrix, key)
+            if array is None:
+                self.spec['arrays'][key] = None
+                continue
+            name = f'{self.PREFIX}{os.getpid()}_{key}_{secrets.token_hex(4)}'
+            block = shared_memory.SharedMemory(name=name, create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self._blocks.append(block)
+            self.spec['arrays'][key] = (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def remove_orphaned_blocks(shm_dir='/dev/shm'):
+    """Unlink shared matrices whose owning process no longer exists (Linux only)."""
+    if not os.path.isdir(shm_dir):
+        return
+    for entry in os.listdir(shm_dir):
+        if not entry.startswith(SharedFeatureMatrix.PREFIX):
+            continue
+        try:
+            pid = int(entry[len(SharedFeatureMatrix.PREFIX):].split('_', 1)[0])
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            try:
+                os.remove(os.path.join(shm_dir, entry))
+            except OSError:
+                pass
+        except (ValueError, PermissionError):
+            # Not ours to judge: a foreign name, or a live process of another user
+            pass
+
+
+def attach(spec):
+    """Map a shared matrix described by ``spec``.
+
+    Returns the matrix and the shared-memory handles, which must stay open
+    while the matrix is in use and be closed (not unlinked) afterwards.
+    """
+    arrays = {}
+    blocks = []
+    for key, entry in spec['arrays'].items():
+        if entry is None:
+            arrays[key] = None
+            continue
+        name, shape, dtype = entry
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return FeatureMatrix(arrays['X'], arrays['y'], arrays['ids'], spec['feature_names']), blocks
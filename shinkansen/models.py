@@ -0,0 +1,45 @@
+"""The three candidate model families, configured as in the notebook."""
+
+MODEL_NAMES = ('lightgbm', 'xgboost', 'random_forest')
+
+# Boosting rounds and forest trees used in the notebook
+DEFAULT_N_ESTIMATORS = {'lightgbm': 10000, 'xgboost': 10000, 'random_forest': 1000}
+
+
+def make_model(name, n_estimators=None, random_state=None, **params):
+    """Build an unfitted classifier of the given family.
+
+    ``n_estimators`` defaults to the notebook's 10000 boosting rounds and 1000
+    forest trees; extra keyword arguments are passed to the estimator.
+    """
+    if name not in MODEL_NAMES:
+        raise ValueError(f'unknown model {name!r}, expected one of {MODEL_NAMES}')
+    n_estimators = n_estimators or DEFAULT_N_ESTIMATORS[name]
+    if name == 'lightgbm':
+        import lightgbm as lgbm
+
+        return lgbm.LGBMClassifier(objective='binary', n_estimators=n_estimators,
+                                   random_state=random_state, verbose=-1, **params)
+    if name == 'xgboost':
+        import xgboost as xgb
+
+        return xgb.XGBClassifier(objective='binary:logistic', n_estimators=n_estimators,
+                                 random_state=1121218 if random_state is None else random_state,
+                                 tree_method='hist', eval_metric='logloss', **params)
+    from sklearn.ensemble import RandomForestClassifier
+
+    return RandomForestClassifier(n_estimators=n_estimators, random_state=42 if random_state is None else random_state,
+                                  **params)
+
+
+def eval_kwargs(model, X, y):
+    """``fit`` keyword arguments that validate ``model`` on ``(X, y)``.
+
+    LightGBM 4.7 deprecates ``eval_set`` in favour of ``eval_X``/``eval_y`` and
+    warns on every fit that still passes it; older versions only know ``eval_set``.
+    """
+    import inspect
+
+    if 'eval_X' in inspect.signature(model.fit).parameters:
+        return {'eval_X': X, 'eval_y': y}
+    return {'eval_set': [(X, y)]}
@@ -0,0 +1,101 @@
+"""Bit-packed index of which values are missing in each row.
+
+The notebook answers every question about missing data with a fresh
+``isnull()`` over the merged frame, and imputation scans each column again.
+:class:`NullityIndex` reads the frame once and keeps one uint32 per row,
+with bit ``j`` set when column ``j`` is missing; the merged training frame
+has 25 columns, so a row's whole pattern fits in one word. Null counts, the
+distinct missingness patterns with their frequencies, the co-missingness
+matrix and the per-column masks imputation needs are all answered from
+those words, and the pattern frequencies are small enough to plot instead
+of every row.
+
+Rows arriving later are added with :meth:`NullityIndex.extend`, which only
+reads the new rows; the index is saved as a small .npz file.
+"""
+
+import numpy as np
+import pandas as pd
+
+MAX_COLUMNS = 32
+
+
+def _masks(frame, columns):
+    masks = np.zeros(len(frame), dtype=np.uint32)
+    for bit, col in enumerate(columns):
+        masks |= frame[col].isna().to_numpy().astype(np.uint32) << np.uint32(bit)
+    return masks
+
+
+class NullityIndex:
+    """One missingness bitmask per row over a fixed list of columns."""
+
+    def __init__(self, columns, masks):
+        if len(columns) > MAX_COLUMNS:
+            raise ValueError(f'{len(columns)} columns do not fit in a {MAX_COLUMNS}-bit mask')
+        self.columns = list(columns)
+        self.masks = np.asarray(masks, dtype=np.uint32)
+
+    @classmethod
+    def build(cls, frame, columns=None):
+        """Index every row of ``frame``; ``columns`` defaults to all of them."""
+        columns = list(frame.columns if columns is None else columns)
+        return cls(columns, _masks(frame, columns))
+
+    def extend(self, frame):
+        """Append the rows of ``frame``, reading only those rows."""
+        self.masks = np.concatenate([self.masks, _masks(frame, self.columns)])
+        return self
+
+    def __len__(self):
+        return len(self.masks)
+
+    def _bits(self, masks):
+        """(len(masks), columns) boolean matrix of the given bitmasks."""
+        return (masks[:, None] >> np.arange(len(self.columns), dtype=np.uint32)) & 1 == 1
+
+    def missing(self, columns):
+        """(rows, len(columns)) boolean matrix of missing values, for imputation."""
+        bits = np.array([self.columns.index(col) for col in columns], dtype=np.uint32)
+        return (self.masks[:, None] >> bits) & 1 == 1
+
+    def patterns(self):
+        """Distinct patterns, most frequent first, with their row counts and missing columns."""
+        masks, counts = np.unique(self.masks, return_counts=True)
+        order = np.argsort(-counts, kind='stable')
+        masks, counts = masks[order], counts[order]
+        return pd.DataFrame({
+            'mask': masks,
+            'rows': counts,
+            'missing': [[col for col, bit in zip(self.columns, row) if bit] for row in self._bits(masks)],
+        })
+
+    def pattern_matrix(self):
+        """Boolean (pattern, column) frame of the distinct patterns and their row counts."""
+        patterns = self.patterns()
+        bits = pd.DataFrame(self._bits(patterns['mask'].to_numpy()), columns=self.columns)
+        return bits, patterns['rows'].to_numpy()
+
+    def null_counts(self):
+        """Missing values per column, in the order of :attr:`columns`."""
+        bits, rows = self.pattern_matrix()
+        return pd.Series(rows @ bits.to_numpy(), index=self.columns)
+
+    def co_missing(self):
+        """Rows in which both columns of each pair are missing; the diagonal is the null count."""
+        bits, rows = self.pattern_matrix()
+        bits = bits.to_numpy().astype(np.int64)
+        return pd.DataFrame(bits.T @ (bits * rows[:, None]), index=self.columns, columns=self.columns)
+
+    def summary(self):
+        """Missing count and percentage of every column, as in the notebook's missing-value table."""
+        counts = self.null_counts()
+        return pd.DataFrame({'missing': counts, 'percent': 100 * counts / max(len(self), 1)})
+
+    def save(self, path):
+        np.savez(path, masks=self.masks, columns=np.array(self.columns))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['columns'].tolist(), data['masks'])
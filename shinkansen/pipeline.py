@@ -0,0 +1,156 @@
+"""Data preparation, training and scoring steps from the notebook.
+
+Only pandas, numpy and the modeling libraries are used here so that the
+``train`` and ``predict`` stages never pay for the plotting stack.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from shinkansen import config, ingest, instrument
+from shinkansen.matrix import FeatureMatrix
+from shinkansen.preprocess import Preprocessor
+
+
+def load_raw(travel_path, survey_path, cache_dir=None):
+    """Read one Traveldata/Surveydata pair with the typed schema."""
+    travel = ingest.load(travel_path, cache_dir)
+    survey = ingest.load(survey_path, cache_dir)
+    return travel, survey
+
+
+def merge(travel, survey):
+    """Merge Survey and Travel data on the passenger ID."""
+    with instrument.stage('merge') as record:
+        data = pd.merge(travel, survey, on=config.ID_COL)
+        record['rows'] = len(data)
+    return data
+
+
+def fit_streaming(travel_path, survey_path, chunk_size=50000, encoding='onehot', k=1000):
+    """Fit the preprocessing in one pass over chunks of the files, without loading them whole."""
+    from shinkansen import scoring
+
+    return Preprocessor(encoding=encoding).fit_stream(scoring.iter_joined(travel_path, survey_path, chunk_size), k)
+
+
+def compare_fits(streamed, exact, data):
+    """One row per imputation value: streamed against exact, with the median's rank error in ``data``."""
+    from shinkansen.sketch import rank_error
+
+    rows = []
+    for col, value in exact.fill_values.items():
+        approx = streamed.fill_values[col]
+        row = {'column': col, 'exact': value, 'streamed': approx}
+        if isinstance(value, float):
+            row['abs_error'] = abs(approx - value)
+            row['rank_error'] = rank_error(data[col].to_numpy(dtype=np.float64, na_value=np.nan), approx)
+        else:
+            row['abs_error'] = row['rank_error'] = float(approx != value)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def prepare(travel_path, survey_path, test_size=0.2, random_state=None, cache_dir=None, encoding='onehot'):
+    """Fit the preprocessing and return it with the train and held-out matrices.
+
+    With a ``cache_dir`` the fitted preprocessing and the encoded matrix come
+    from the stage cache when the files and settings are unchanged.
+    """
+    from shinkansen import stages
+
+    with instrument.stage('prepare') as record:
+        # One float32 matrix feeds the fit, the evaluation and the predictions
+        preprocessor, matrix = stages.feature_matrix(travel_path, survey_path, encoding, cache_dir)
+        # Hold out 20% of the data for early stopping and to report log loss and accuracy
+        train_set, test_set = matrix.split(test_size=test_size, random_state=random_state)
+        record['rows'] = len(matrix)
+    return preprocessor, train_set, test_set
+
+
+def save_model(model_path, model, preprocessor, report, **extra):
+    """Write a model with its fitted preprocessing as one artifact.
+
+    ``extra`` entries are stored alongside, e.g. ``holdout_ids``: the IDs of
+    the rows the model was not fitted on, so later reports can reuse them.
+    """
+    import joblib
+
+    os.makedirs(os.path.dirname(model_path) or '.', exist_ok=True)
+    with instrument.stage('save_model'):
+        joblib.dump(dict({'model': model, 'preprocessor': preprocessor.to_dict(), 'report': report}, **extra),
+                    model_path)
+    print(f"Model written to {model_path}")
+
+
+def train(travel_path, survey_path, model_path, model_name='lightgbm', n_estimators=None, test_size=0.2,
+          random_state=None, cache_dir=None, encoding='onehot', native_categorical=False,
+          early_stopping_rounds=150, checkpoint_dir=None, checkpoint_every=500, resume=False, max_model_mb=None):
+    """Fit one model family on the training files and persist it.
+
+    The model is trained by :func:`training.fit` with early stopping on the
+    held-out split. With ``encoding='ordinal'`` and ``native_categorical``
+    the encoded categorical columns are passed to LightGBM as categorical
+    features. ``max_model_mb`` grows a RandomForest within that size
+    budget and saves it as a :class:`~shinkansen.forest.CompactForest`.
+    """
+    from shinkansen import training
+
+    # A resumable run needs the same split every time
+    if random_state is None and checkpoint_dir:
+        random_state = 0
+    preprocessor, train_set, test_set = prepare(travel_path, survey_path, test_size, random_state, cache_dir,
+                                                encoding)
+
+    fit_kwargs = {}
+    if native_categorical and model_name == 'lightgbm':
+        fit_kwargs['categorical_feature'] = train_set.positions(preprocessor.categorical_features)
+    params = None
+    if max_model_mb is not None:
+        if model_name != 'random_forest':
+            raise ValueError('a model size budget only applies to random_forest')
+        from shinkansen import forest
+        from shinkansen.models import DEFAULT_N_ESTIMATORS
+
+        params = forest.plan(max_model_mb, len(train_set), n_estimators or DEFAULT_N_ESTIMATORS[model_name])
+    clf, report = training.fit(model_name, train_set, test_set, n_estimators=n_estimators,
+                               early_stopping_rounds=early_stopping_rounds, checkpoint_dir=checkpoint_dir,
+                               checkpoint_every=checkpoint_every, resume=resume, random_state=random_state,
+                               params=params, fit_kwargs=fit_kwargs)
+    print(training.format_report(report))
+    if params is not None:
+        clf = forest.CompactForest.from_forest(clf)
+        report.update(params, node_count=clf.node_count, model_mb=clf.nbytes / 2**20)
+        print(f"Compact forest: {clf.n_estimators} trees, {clf.node_count} nodes, {report['model_mb']:.1f} MB "
+              f"(budget {max_model_mb} MB, at most {params['max_leaf_nodes']} leaves per tree)")
+    save_model(model_path, clf, preprocessor, report, holdout_ids=test_set.ids)
+    return report
+
+
+def load_model(model_path, mmap_mode=None):
+    """Load an artifact written by :func:`train`.
+
+    With ``mmap_mode='r'`` the arrays stored in the artifact are mapped
+    read-only from the file instead of read into memory, so processes
+    loading the same file share them.
+    """
+    import joblib
+
+    artifact = joblib.load(model_path, mmap_mode=mmap_mode)
+    artifact['preprocessor'] = Preprocessor.from_dict(artifact['preprocessor'])
+    return artifact
+
+
+def predict(artifact, travel_path, survey_path, output_path, cache_dir=None):
+    """Score a Traveldata/Surveydata pair and write the submission .csv."""
+    test_data = merge(*load_raw(travel_path, survey_path, cache_dir))
+    test = FeatureMatrix.build(test_data, artifact['preprocessor'])
+
+    # Predict the class label on the test dataset
+    with instrument.stage('predict', rows=len(test)):
+        pred = artifact['model'].predict(test.X)
+    pd.DataFrame({config.ID_COL: test.ids, config.TARGET_COL: np.asarray(pred)}).to_csv(output_path, index=False)
+    print(f"{len(test)} predictions written to {output_path}")
+    return len(test)
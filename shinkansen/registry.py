@@ -0,0 +1,351 @@
+"""Local, file-based registry of versioned models.
+
+A joblib artifact pickles the whole estimator, so every scoring process
+imports scikit-learn and the booster's Python wrapper and unpickles it
+before the first row. The registry stores each version in a directory of
+its own, under ``<model-dir>/registry/<name>/v<version>``:
+
+* ``model.txt`` (LightGBM) or ``model.ubj`` (XGBoost) in the library's
+  native format, trimmed to the best iteration; any other model, such as
+  the compact forest or the linear student, as ``model.joblib``, which is
+  memory-mapped when loaded;
+* ``trees.joblib``: the booster's trees flattened into a
+  :class:`~shinkansen.forest.CompactForest`, when it has only numerical
+  splits. Importing LightGBM or XGBoost takes longer than the rest of a
+  scoring worker's start-up, because both import scikit-learn; the flat
+  trees are scored with numpy alone and memory-mapped, so workers load
+  them instead unless asked for the native model;
+* ``preprocessor.json``: the fitted preprocessing;
+* ``meta.json``: family, format, the encoded feature columns, the training
+  report's metrics, a digest of the training files and the creation time;
+* ``<key>.npy`` for every array the artifact carries besides the model,
+  such as ``holdout_ids``, which is loaded back memory-mapped.
+
+Versions are numbered from 1 and written to a temporary directory that is
+renamed into place, so readers never see half a version. A loaded version
+is a :class:`LazyModel`, which reads its model file on the first
+prediction, so reading the metadata and preprocessing is all a worker does
+at start-up. :data:`CACHE` keeps loaded versions per process, keyed by name
+and version, so a worker can switch between versions without reloading
+either one.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# Loaded versions kept per process
+CACHE_SIZE = 4
+
+FORMATS = {'lightgbm': 'model.txt', 'xgboost': 'model.ubj', 'joblib': 'model.joblib'}
+FLAT_FILE = 'trees.joblib'
+
+# Largest difference in probability allowed between the flat trees and the native model
+FLAT_TOLERANCE = 1e-5
+
+
+class LazyModel:
+    """Classifier interface over a stored model file, read on first use."""
+
+    classes_ = np.array([0, 1])
+
+    def __init__(self, format, path):
+        self.format = format
+        self.path = path
+        self._model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._read()
+        return self._model
+
+    def _read(self):
+        if self.format == 'lightgbm':
+            import lightgbm as lgbm
+
+            return lgbm.Booster(model_file=self.path)
+        if self.format == 'xgboost':
+            import xgboost as xgb
+
+            booster = xgb.Booster()
+            booster.load_model(self.path)
+            return booster
+        import joblib
+
+        return joblib.load(self.path, mmap_mode='r')
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def predict_proba(self, X):
+        model = self.load()
+        if self.format == 'lightgbm':
+            proba = model.predict(X)
+        elif self.format == 'xgboost':
+            proba = model.inplace_predict(X)
+        else:
+            return model.predict_proba(X)
+        return np.column_stack([1 - proba, proba])
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] > 0.5).astype(np.int64)
+
+
+class Entry:
+    """One loaded version: model, preprocessing and metadata."""
+
+    def __init__(self, name, version, model, preprocessor, meta, arrays=None):
+        self.name = name
+        self.version = version
+        self.model = model
+        self.preprocessor = preprocessor
+        self.meta = meta
+        self.arrays = arrays or {}
+
+    def artifact(self):
+        """The version in the artifact layout ``predict`` and ``serve`` take."""
+        return dict(self.arrays, model=self.model, preprocessor=self.preprocessor, report=self.meta['report'],
+                    version=self.version)
+
+
+class ModelCache:
+    """Loaded versions keyed by (name, version), least recently used dropped past ``size``."""
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        entry = load()
+        with self._lock:
+            self.misses += 1
+            entry = self._entries.setdefault(key, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+CACHE = ModelCache()
+
+
+def _native_format(model):
+    """Format a model is stored in: the booster's own, or joblib for anything else."""
+    booster = getattr(model, 'booster_', None)
+    if booster is not None and type(booster).__module__.startswith('lightgbm'):
+        return 'lightgbm'
+    if type(model).__module__.startswith('xgboost'):
+        return 'xgboost'
+    return 'joblib'
+
+
+def _write_model(model, format, path):
+    if format == 'lightgbm':
+        best = getattr(model, 'best_iteration_', None)
+        model.booster_.save_model(path, num_iteration=best or None)
+    elif format == 'xgboost':
+        booster = model.get_booster()
+        try:
+            booster = booster[:model.best_iteration + 1]
+        except AttributeError:
+            pass
+        booster.save_model(path)
+    else:
+        import joblib
+
+        joblib.dump(model, path)
+
+
+def _flatten(format, path):
+    """CompactForest of a stored native booster."""
+    from shinkansen.forest import CompactForest
+
+    booster = LazyModel(format, path).load()
+    return CompactForest.from_lightgbm(booster) if format == 'lightgbm' else CompactForest.from_xgboost(booster)
+
+
+def _json_default(value):
+    """numpy scalars and nested arrays as plain Python values for ``json.dump``."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def data_digest(paths, cache_dir=None):
+    """sha1 over the contents of the training files, reusing the stage cache's digests."""
+    from shinkansen import stages
+
+    digest = hashlib.sha1()
+    for path in paths:
+        if cache_dir:
+            digest.update(stages.StageCache(cache_dir).file_digest(path).encode())
+        else:
+            with open(path, 'rb') as f:
+                digest.update(hashlib.sha1(f.read()).hexdigest().encode())
+    return digest.hexdigest()
+
+
+class Registry:
+    """Versioned models under ``root``, one directory per name and version."""
+
+    def __init__(self, root, cache=None):
+        self.root = root
+        self.cache = CACHE if cache is None else cache
+
+    def names(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def versions(self, name):
+        directory = os.path.join(self.root, name)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(int(entry[1:]) for entry in os.listdir(directory)
+                      if entry.startswith('v') and entry[1:].isdigit())
+
+    def path(self, name, version):
+        return os.path.join(self.root, name, f'v{version}')
+
+    def resolve(self, name, version=None):
+        """``version``, or the latest one when None; raises if there is none."""
+        versions = self.versions(name)
+        if not versions:
+            raise ValueError(f'no versions of {name!r} in {self.root}')
+        if version is None:
+            return versions[-1]
+        if int(version) not in versions:
+            raise ValueError(f'{name!r} has no version {version}; known: {versions}')
+        return int(version)
+
+    def register(self, name, model, preprocessor, report, data_paths=(), cache_dir=None, check=None, **extra):
+        """Store a fitted model as the next version of ``name`` and return the version number.
+
+        ``check`` is an encoded feature array on which the flat copy of a
+        booster must reproduce the native model; without it, or if they
+        differ, only the native model is stored.
+        """
+        import joblib
+
+        os.makedirs(os.path.join(self.root, name), exist_ok=True)
+        format = _native_format(model)
+        tmp = os.path.join(self.root, name, f'.tmp-{os.getpid()}-{time.time_ns()}')
+        os.makedirs(tmp)
+        try:
+            _write_model(model, format, os.path.join(tmp, FORMATS[format]))
+            flat = False
+            if format != 'joblib' and check is not None:
+                try:
+                    trees = _flatten(format, os.path.join(tmp, FORMATS[format]))
+                except ValueError:
+                    trees = None
+                native = LazyModel(format, os.path.join(tmp, FORMATS[format]))
+                if trees is not None and np.allclose(trees.predict_proba(check), native.predict_proba(check),
+                                                     rtol=0, atol=FLAT_TOLERANCE):
+                    joblib.dump(trees, os.path.join(tmp, FLAT_FILE))
+                    flat = True
+            preprocessor.save(os.path.join(tmp, 'preprocessor.json'))
+            arrays = sorted(key for key, value in extra.items() if isinstance(value, np.ndarray))
+            for key in arrays:
+                np.save(os.path.join(tmp, f'{key}.npy'), extra.pop(key))
+            meta = {
+                'name': name,
+                'family': report.get('model'),
+                'format': format,
+                'flat': flat,
+                'feature_names': list(preprocessor.feature_names),
+                'report': report,
+                'data_digest': data_digest(data_paths, cache_dir) if data_paths else None,
+                'data_files': [os.path.basename(path) for path in data_paths],
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'arrays': arrays,
+            }
+            meta.update(extra)
+            while True:
+                version = (self.versions(name) or [0])[-1] + 1
+                meta['version'] = version
+                with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                    json.dump(meta, f, indent=1, default=_json_default)
+                try:
+                    # Fails if another process took this number first; then try the next one
+                    os.rename(tmp, self.path(name, version))
+                    return version
+                except OSError:
+                    if not os.path.isdir(self.path(name, version)):
+                        raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def meta(self, name, version=None):
+        with open(os.path.join(self.path(name, self.resolve(name, version)), 'meta.json')) as f:
+            return json.load(f)
+
+    def _load(self, name, version, native=False):
+        from shinkansen.preprocess import Preprocessor
+
+        directory = self.path(name, version)
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        preprocessor = Preprocessor.load(os.path.join(directory, 'preprocessor.json'))
+        if list(preprocessor.feature_names) != meta['feature_names']:
+            raise ValueError(f'{directory}: the preprocessing does not produce the registered feature columns')
+        if meta.get('flat') and not native:
+            model = LazyModel('joblib', os.path.join(directory, FLAT_FILE))
+        else:
+            model = LazyModel(meta['format'], os.path.join(directory, FORMATS[meta['format']]))
+        arrays = {key: np.load(os.path.join(directory, f'{key}.npy'), mmap_mode='r') for key in meta.get('arrays', [])}
+        return Entry(name, version, model, preprocessor, meta, arrays)
+
+    def load(self, name, version=None, native=False):
+        """Entry of a version (latest by default), from the process cache when already loaded.
+
+        A booster is scored from its flat trees when it has them, or with
+        its own library when ``native``.
+        """
+        version = self.resolve(name, version)
+        return self.cache.get((os.path.abspath(self.root), name, version, native),
+                              lambda: self._load(name, version, native))
+
+    def table(self):
+        """One row per stored version with its family, format, metrics and data digest."""
+        rows = []
+        for name in self.names():
+            for version in self.versions(name):
+                meta = self.meta(name, version)
+                report = meta.get('report', {})
+                rows.append({
+                    'name': name,
+                    'version': version,
+                    'family': meta.get('family'),
+                    'format': meta['format'],
+                    'flat': meta.get('flat', False),
+                    'logloss': report.get('logloss'),
+                    'accuracy': report.get('accuracy'),
+                    'features': len(meta['feature_names']),
+                    'data_digest': (meta.get('data_digest') or '')[:12],
+                    'created': meta.get('created'),
+                })
+        return pd.DataFrame(rows)
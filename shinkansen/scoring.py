@@ -0,0 +1,151 @@
+"""Chunked batch scoring for test files of any size.
+
+:func:`score_stream` reads Traveldata and Surveydata side by side in chunks,
+joins the rows whose IDs have arrived in both files, runs the fitted
+preprocessing and the model on each joined batch and appends the predictions
+to the output file. Only the current chunks and the rows still waiting for
+their partner are held in memory, so usage stays bounded as long as both
+files are ordered by ID, as the hackathon files are. Unordered files are
+still scored correctly, but the waiting rows grow with the disorder.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from shinkansen import config, ingest, instrument
+from shinkansen.matrix import FeatureMatrix
+
+
+def iter_joined(travel_path, survey_path, chunk_size, stats=None):
+    """Yield merged Traveldata/Surveydata batches as both halves of each ID arrive.
+
+    Rows without a partner in the other file are dropped at the end, like
+    the inner ``pd.merge`` of the whole-file path. ``stats['max_pending']``
+    records the largest number of rows kept waiting for their partner.
+    """
+    streams = [ingest.read_csv(travel_path, chunksize=chunk_size),
+               ingest.read_csv(survey_path, chunksize=chunk_size)]
+    pending = [None, None]
+    done = [False, False]
+    if stats is None:
+        stats = {}
+    stats.setdefault('max_pending', 0)
+
+    while not all(done):
+        for side, stream in enumerate(streams):
+            if done[side]:
+                continue
+            chunk = next(stream, None)
+            if chunk is None:
+                done[side] = True
+            elif pending[side] is None or not len(pending[side]):
+                pending[side] = chunk
+            else:
+                pending[side] = pd.concat([pending[side], chunk], ignore_index=True)
+        if pending[0] is None or pending[1] is None:
+            continue
+
+        joined = pd.merge(pending[0], pending[1], on=config.ID_COL)
+        if len(joined):
+            matched = joined[config.ID_COL].to_numpy()
+            pending = [frame[~np.isin(frame[config.ID_COL].to_numpy(), matched)] for frame in pending]
+            yield joined
+        stats['max_pending'] = max(stats['max_pending'], len(pending[0]) + len(pending[1]))
+
+
+class ResultWriter:
+    """Append prediction batches to a .csv or .parquet file.
+
+    Rows go to a temporary file that replaces ``path`` on :meth:`close`, so
+    an interrupted run never leaves a truncated result behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp = f'{path}.{os.getpid()}.tmp'
+        self.parquet = path.endswith('.parquet')
+        self._writer = None
+        self._file = None
+        self.rows = 0
+
+    def write(self, ids, labels):
+        batch = pd.DataFrame({config.ID_COL: ids, config.TARGET_COL: labels})
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(batch, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.tmp, table.schema)
+            self._writer.write_table(table)
+        else:
+            if self._file is None:
+                self._file = open(self.tmp, 'w', newline='')
+            batch.to_csv(self._file, header=self.rows == 0, index=False)
+        self.rows += len(batch)
+
+    def close(self):
+        if self._writer is None and self._file is None:
+            # Still produce a valid, empty result
+            self.write(np.array([], dtype=np.int32), np.array([], dtype=np.int8))
+        if self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+        os.replace(self.tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for handle in (self._writer, self._file):
+                if handle is not None:
+                    handle.close()
+            if os.path.exists(self.tmp):
+                os.remove(self.tmp)
+
+
+def score_stream(artifact, travel_path, survey_path, output_path, chunk_size=50000, report_every=10):
+    """Score a Traveldata/Surveydata pair chunk by chunk.
+
+    Returns a dict with the row count, elapsed seconds, rows per second and
+    the largest number of rows held waiting for their partner.
+    """
+    with instrument.stage('score_stream') as record:
+        stats = _score_stream(artifact, travel_path, survey_path, output_path, chunk_size, report_every)
+        record['rows'] = stats['rows']
+    return stats
+
+
+def _score_stream(artifact, travel_path, survey_path, output_path, chunk_size, report_every):
+    preprocessor = artifact['preprocessor']
+    model = artifact['model']
+    stats = {}
+    start = time.perf_counter()
+    # One feature buffer, grown to the largest batch and reused for every chunk
+    buffer = np.empty((0, len(preprocessor.feature_names)), dtype=np.float32)
+
+    with ResultWriter(output_path) as writer:
+        for i, batch in enumerate(iter_joined(travel_path, survey_path, chunk_size, stats), 1):
+            if len(batch) > len(buffer):
+                buffer = np.empty((len(batch), buffer.shape[1]), dtype=np.float32)
+            matrix = FeatureMatrix(preprocessor.transform_matrix(batch, out=buffer[:len(batch)]), None,
+                                   batch[config.ID_COL].to_numpy(), preprocessor.feature_names)
+            writer.write(matrix.ids, np.asarray(model.predict(matrix.X)))
+            if report_every and i % report_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{writer.rows} rows scored, {writer.rows / elapsed:,.0f} rows/s", file=sys.stderr)
+        rows = writer.rows
+
+    elapsed = time.perf_counter() - start
+    stats.update({'rows': rows, 'seconds': elapsed, 'rows_per_second': rows / elapsed if elapsed else 0.0})
+    print(f"{rows} predictions written to {output_path} in {elapsed:.2f}s "
+          f"({stats['rows_per_second']:,.0f} rows/s, at most {stats['max_pending']} rows pending)")
+    return stats
@@ -0,0 +1,319 @@
+"""Local HTTP scoring service with micro-batching.
+
+The model and the fitted preprocessing are loaded once. ``POST /predict``
+accepts one JSON record, a list of records or ``{"records": [...]}``, where
+each record holds the Traveldata/Surveydata fields of one passenger.
+Concurrent requests are queued and coalesced into micro-batches: the batcher
+waits at most ``max_wait`` seconds after the first queued request (or until
+``max_batch`` records are collected) and then scores the whole batch with a
+single ``predict_proba`` call. Each request's records are encoded with
+:meth:`Preprocessor.transform_records` before it is queued, so no DataFrame
+is built per request and a malformed record is rejected with a 400 on its
+own instead of failing the batch it would have joined. Should the batched
+call still fail, every request in the batch is scored again by itself, so
+only the one that causes the error gets it.
+
+``GET /metrics`` reports request counts, batch sizes, p50/p99 latency and
+throughput; ``GET /health`` answers ``{"status": "ok"}``.
+
+Served from the model registry, ``POST /predict?version=3`` scores with
+another stored version and ``POST /version`` with ``{"version": 3}`` makes
+it the default. Each version gets its own batcher; versions come from the
+registry's in-process cache, so switching back and forth does not reload.
+
+Only the standard library is used for the server itself.
+"""
+
+import asyncio
+import collections
+import json
+import sys
+import time
+import urllib.parse
+
+import numpy as np
+
+from shinkansen import config
+
+# Largest request body accepted, in bytes
+MAX_BODY = 16 * 2**20
+
+
+class Metrics:
+    """Request, record and batch counters plus a window of recent latencies."""
+
+    def __init__(self, window=10000):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.records = 0
+        self.batches = 0
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=window)
+        self.batch_sizes = collections.deque(maxlen=window)
+
+    def snapshot(self):
+        uptime = time.monotonic() - self.started
+        latencies = np.array(self.latencies) * 1e3 if self.latencies else np.zeros(1)
+        return {
+            'uptime_s': round(uptime, 3),
+            'requests': self.requests,
+            'records': self.records,
+            'batches': self.batches,
+            'errors': self.errors,
+            'mean_batch_size': round(float(np.mean(self.batch_sizes)), 2) if self.batch_sizes else 0.0,
+            'latency_p50_ms': round(float(np.percentile(latencies, 50)), 3),
+            'latency_p99_ms': round(float(np.percentile(latencies, 99)), 3),
+            'requests_per_s': round(self.requests / uptime, 2) if uptime else 0.0,
+            'records_per_s': round(self.records / uptime, 2) if uptime else 0.0,
+        }
+
+
+class MicroBatcher:
+    """Coalesce concurrent scoring requests into batched ``predict_proba`` calls."""
+
+    def __init__(self, model, preprocessor, max_batch=256, max_wait=0.005, metrics=None):
+        self.model = model
+        self.preprocessor = preprocessor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.metrics = metrics or Metrics()
+        self.queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def encode(self, records):
+        """Feature rows of ``records``; raises ValueError on a value that cannot be encoded."""
+        try:
+            return self.preprocessor.transform_records(records)
+        except (ValueError, TypeError) as exc:
+            raise ValueError(f'invalid record: {exc}') from exc
+
+    async def submit(self, X):
+        """Queue encoded rows and wait for their probabilities."""
+        if not len(X):
+            # Models refuse empty input; there is nothing to batch anyway
+            return np.empty(0, dtype=np.float64)
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((X, future))
+        return await future
+
+    async def score(self, records):
+        """Probabilities of a satisfied experience for ``records``, in order."""
+        return await self.submit(self.encode(records))
+
+    async def _collect(self):
+        """Wait for one request, then gather more until the batch is full or the deadline passes."""
+        items = [await self.queue.get()]
+        size = len(items[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            items.append(item)
+            size += len(item[0])
+        return items
+
+    def _predict(self, X):
+        return self.model.predict_proba(X)[:, 1]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            X = np.concatenate([rows for rows, _ in items]) if len(items) > 1 else items[0][0]
+            try:
+                # Score off the event loop so new requests keep queueing meanwhile
+                proba = await loop.run_in_executor(None, self._predict, X)
+            except Exception:
+                await self._score_each(items)
+                continue
+            self.metrics.batches += 1
+            self.metrics.batch_sizes.append(len(X))
+            offset = 0
+            for rows, future in items:
+                if not future.done():
+                    future.set_result(proba[offset:offset + len(rows)])
+                offset += len(rows)
+
+    async def _score_each(self, items):
+        """Score the requests of a failed batch one by one, so the error reaches only its own request."""
+        loop = asyncio.get_running_loop()
+        for rows, future in items:
+            try:
+                proba = await loop.run_in_executor(None, self._predict, rows)
+            except Exception as exc:
+                if not future.done():
+                    future.set_exception(exc)
+                continue
+            self.metrics.batches += 1
+            self.metrics.batch_sizes.append(len(rows))
+            if not future.done():
+                future.set_result(proba)
+
+
+def parse_records(payload):
+    """Normalise a request body into a list of record dicts."""
+    if isinstance(payload, dict) and 'records' in payload:
+        payload = payload['records']
+    if isinstance(payload, dict):
+        payload = [payload]
+    if not isinstance(payload, list) or not all(isinstance(record, dict) for record in payload):
+        raise ValueError('expected a JSON object, a list of objects or {"records": [...]}')
+    return payload
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class ScoringServer:
+    """Minimal HTTP/1.1 front end for a :class:`MicroBatcher`."""
+
+    def __init__(self, batcher, threshold=0.5, registry=None, name=None, version=None):
+        self.batcher = batcher
+        self.metrics = batcher.metrics
+        self.threshold = threshold
+        self.registry = registry
+        self.name = name
+        self.version = version
+        self.batchers = {version: batcher}
+
+    async def _batcher(self, version):
+        """Batcher of a registry version, started on its first request."""
+        if version is None or version == self.version:
+            return self.batcher, self.version
+        loop = asyncio.get_running_loop()
+        entry = await loop.run_in_executor(None, self.registry.load, self.name, version)
+        if entry.version not in self.batchers:
+            batcher = MicroBatcher(entry.model, entry.preprocessor, self.batcher.max_batch, self.batcher.max_wait,
+                                   self.metrics)
+            batcher.start()
+            self.batchers[entry.version] = batcher
+        return self.batchers[entry.version], entry.version
+
+    async def stop(self):
+        for batcher in self.batchers.values():
+            await batcher.stop()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {'error': 'request body too large'}, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await self.dispatch(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, status, payload, close=not keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, body):
+        path, _, query = path.partition('?')
+        version = urllib.parse.parse_qs(query).get('version', [None])[0]
+        if path == '/version':
+            return await self._switch(method, body)
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/metrics':
+            return 200, self.metrics.snapshot()
+        if path != '/predict':
+            return 404, {'error': f'unknown path {path}'}
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+
+        start = time.perf_counter()
+        try:
+            records = parse_records(json.loads(body or b'null'))
+            if version is not None and self.registry is None:
+                raise ValueError('versions are only available when serving from the registry')
+            batcher, version = await self._batcher(None if version is None else int(version))
+            X = batcher.encode(records)
+        except ValueError as exc:
+            self.metrics.errors += 1
+            return 400, {'error': str(exc)}
+        try:
+            proba = await batcher.submit(X)
+        except Exception as exc:
+            self.metrics.errors += 1
+            return 500, {'error': f'{type(exc).__name__}: {exc}'}
+        self.metrics.requests += 1
+        self.metrics.records += len(records)
+        self.metrics.latencies.append(time.perf_counter() - start)
+        response = {'predictions': [
+            {config.ID_COL: record.get(config.ID_COL), 'probability': float(p),
+             config.TARGET_COL: int(p > self.threshold)}
+            for record, p in zip(records, proba)
+        ]}
+        if version is not None:
+            response['version'] = version
+        return 200, response
+
+    async def _switch(self, method, body):
+        """``GET`` the default version, or ``POST {"version": n}`` to change it."""
+        if self.registry is None:
+            return 404, {'error': 'not serving from the registry'}
+        if method == 'POST':
+            try:
+                self.batcher, self.version = await self._batcher(int(json.loads(body or b'null')['version']))
+            except (ValueError, TypeError, KeyError) as exc:
+                return 400, {'error': f'expected {{"version": n}}: {exc}'}
+        return 200, {'name': self.name, 'version': self.version}
+
+    async def _respond(self, writer, status, payload, close=False):
+        body = json.dumps(payload).encode()
+        head = (f'HTTP/1.1 {status} {_REASONS.get(status, "")}\r\n'
+                f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+                f'Connection: {"close" if close else "keep-alive"}\r\n\r\n')
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+async def serve(artifact, host='127.0.0.1', port=8000, max_batch=256, max_wait=0.005, registry=None, name=None):
+    """Run the scoring server until cancelled.
+
+    With a ``registry``, ``artifact`` is a version of ``name`` from it and
+    requests may pick other versions.
+    """
+    batcher = MicroBatcher(artifact['model'], artifact['preprocessor'], max_batch=max_batch, max_wait=max_wait)
+    batcher.start()
+    server = ScoringServer(batcher, registry=registry, name=name, version=artifact.get('version'))
+    listener = await asyncio.start_server(server.handle, host, port)
+    print(f"Scoring on http://{host}:{port}/predict (max batch {max_batch}, max wait {max_wait * 1e3:.1f} ms)",
+          file=sys.stderr)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await server.stop()
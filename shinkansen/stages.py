@@ -0,0 +1,235 @@
+"""Content-keyed cache of the data-preparation stages.
+
+Training, cross-validation, tuning and the EDA all start with the same
+chain: merge Traveldata and Surveydata on ID, fit the preprocessing, impute
+and encode. Its output depends only on the bytes of the two .csv files, the
+preprocessing settings and the preprocessing code, so each stage is stored
+under a hash of those:
+
+* ``merged``: the merged frame, as an Arrow IPC file;
+* ``cleaned``: the imputed frame the EDA plots, as an Arrow IPC file;
+* ``nullity``: the merged frame's :class:`NullityIndex`, as a .npz file;
+* ``matrix``: float32 features, int8 labels and IDs as .npy files, next to
+  the fitted preprocessing as JSON.
+
+Arrow files and .npy arrays are memory-mapped when read back, so a hit
+takes milliseconds whatever the data size. File contents are hashed once per
+(path, size, mtime) and the digest remembered, so unchanged files are not
+read again either. Once the stages take more than ``config.STAGE_CACHE_MB``
+the least recently used entries are removed.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from shinkansen import config, ingest, instrument
+from shinkansen.matrix import FeatureMatrix
+from shinkansen.nullity import NullityIndex
+from shinkansen.preprocess import Preprocessor
+
+# Source files whose contents are part of every key, so editing the preprocessing invalidates the cache
+_CODE_FILES = ('config.py', 'ingest.py', 'preprocess.py', 'matrix.py', 'nullity.py', 'stages.py')
+
+
+def _code_digest():
+    digest = hashlib.sha1()
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in _CODE_FILES:
+        with open(os.path.join(package_dir, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+class StageCache:
+    """Directory of stage entries under ``<cache_dir>/stages``, evicted least recently used first."""
+
+    def __init__(self, cache_dir, max_bytes=None):
+        self.root = os.path.join(cache_dir, 'stages')
+        self.max_bytes = config.STAGE_CACHE_MB * 2**20 if max_bytes is None else max_bytes
+        self._digests_path = os.path.join(self.root, 'digests.json')
+        self._code = None
+
+    def file_digest(self, path):
+        """sha1 of a file's contents, remembered per path, size and mtime."""
+        try:
+            with open(self._digests_path) as f:
+                known = json.load(f)
+        except (OSError, ValueError):
+            known = {}
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        if known.get(path, [None])[:2] == signature:
+            return known[path][2]
+
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                digest.update(block)
+        known[path] = signature + [digest.hexdigest()]
+        os.makedirs(self.root, exist_ok=True)
+        tmp = f'{self._digests_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(known, f)
+        os.replace(tmp, self._digests_path)
+        return known[path][2]
+
+    def key(self, stage, paths, settings=None):
+        if self._code is None:
+            self._code = _code_digest()
+        parts = [stage, [self.file_digest(path) for path in paths], settings or {}, self._code]
+        return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:20]
+
+    def get(self, stage, key):
+        """Directory of a cached entry, or None; a hit marks the entry as recently used."""
+        path = os.path.join(self.root, f'{stage}-{key}')
+        if not os.path.isdir(path):
+            return None
+        os.utime(path)
+        return path
+
+    def put(self, stage, key, write):
+        """Create an entry by calling ``write(directory)`` and return its directory."""
+        path = os.path.join(self.root, f'{stage}-{key}')
+        # Fill a temporary directory first so a crashed run never leaves a torn entry
+        tmp = f'{path}.{os.getpid()}.tmp'
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            write(tmp)
+            os.replace(tmp, path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+            # Another process stored the same entry first
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict(keep=path)
+        return path
+
+    def entries(self):
+        """(directory, bytes, last used) of every entry, least recently used first."""
+        if not os.path.isdir(self.root):
+            return []
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path) and not name.endswith('.tmp'):
+                entries.append((path, _dir_size(path), os.stat(path).st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def _cached_frame(cache, stage, paths, build):
+    """A frame stage stored as a memory-mapped Arrow file; needs pyarrow."""
+    with instrument.stage(stage, detail='uncached') as record:
+        if cache is None or not ingest._have_pyarrow():
+            frame = build()
+        else:
+            from pyarrow import feather
+
+            key = cache.key(stage, paths)
+            path = cache.get(stage, key)
+            record['detail'] = 'miss' if path is None else 'hit'
+            if path is None:
+                frame = build()
+                cache.put(stage, key, lambda directory: feather.write_feather(
+                    frame, os.path.join(directory, 'frame.arrow'), compression='uncompressed'))
+            else:
+                frame = feather.read_table(os.path.join(path, 'frame.arrow'), memory_map=True).to_pandas()
+        record['rows'] = len(frame)
+    return frame
+
+
+def merged(travel_path, survey_path, cache_dir=None):
+    """Traveldata and Surveydata merged on ID."""
+    from shinkansen import pipeline
+
+    cache = StageCache(cache_dir) if cache_dir else None
+    return _cached_frame(cache, 'merged', [travel_path, survey_path],
+                         lambda: pipeline.merge(*pipeline.load_raw(travel_path, survey_path, cache_dir)))
+
+
+def nullity(travel_path, survey_path, cache_dir=None, data=None):
+    """:class:`NullityIndex` of the merged frame; ``data`` saves reading it when it is already loaded."""
+    cache = StageCache(cache_dir) if cache_dir else None
+    with instrument.stage('nullity', detail='uncached') as record:
+        key = path = None
+        if cache is not None:
+            key = cache.key('nullity', [travel_path, survey_path])
+            path = cache.get('nullity', key)
+            record['detail'] = 'miss' if path is None else 'hit'
+        if path is not None:
+            index = NullityIndex.load(os.path.join(path, 'nullity.npz'))
+        else:
+            if data is None:
+                data = merged(travel_path, survey_path, cache_dir)
+            index = NullityIndex.build(data)
+            if cache is not None:
+                cache.put('nullity', key, lambda directory: index.save(os.path.join(directory, 'nullity.npz')))
+        record['rows'] = len(index)
+    return index
+
+
+def cleaned(travel_path, survey_path, cache_dir=None):
+    """The merged frame with missing values imputed, not encoded."""
+    cache = StageCache(cache_dir) if cache_dir else None
+
+    def build():
+        data = merged(travel_path, survey_path, cache_dir)
+        return Preprocessor().fit(data).impute(data, nullity(travel_path, survey_path, cache_dir, data))
+
+    return _cached_frame(cache, 'cleaned', [travel_path, survey_path], build)
+
+
+def feature_matrix(travel_path, survey_path, encoding='onehot', cache_dir=None):
+    """Fitted preprocessing and the encoded :class:`FeatureMatrix` of a training file pair."""
+    with instrument.stage('matrix', detail='uncached' if cache_dir is None else 'miss') as record:
+        preprocessor, matrix = _feature_matrix(travel_path, survey_path, encoding, cache_dir, record)
+        record['rows'] = len(matrix)
+    return preprocessor, matrix
+
+
+def _feature_matrix(travel_path, survey_path, encoding, cache_dir, record):
+    cache = StageCache(cache_dir) if cache_dir else None
+    if cache is not None:
+        key = cache.key('matrix', [travel_path, survey_path], {'encoding': encoding})
+        path = cache.get('matrix', key)
+        if path is not None:
+            record['detail'] = 'hit'
+            with open(os.path.join(path, 'preprocessor.json')) as f:
+                preprocessor = Preprocessor.from_dict(json.load(f))
+            arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in ('X', 'y', 'ids')}
+            return preprocessor, FeatureMatrix(arrays['X'], arrays['y'], arrays['ids'], preprocessor.feature_names)
+
+    data = merged(travel_path, survey_path, cache_dir)
+    preprocessor = Preprocessor(encoding=encoding).fit(data)
+    matrix = FeatureMatrix.build(data, preprocessor, nullity(travel_path, survey_path, cache_dir, data))
+    if cache is not None:
+        def write(directory):
+            for name in ('X', 'y', 'ids'):
+                np.save(os.path.join(directory, f'{name}.npy'), getattr(matrix, name))
+            with open(os.path.join(directory, 'preprocessor.json'), 'w') as f:
+                json.dump(preprocessor.to_dict(), f)
+
+        cache.put('matrix', key, write)
+    return preprocessor, matrix
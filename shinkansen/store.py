@@ -0,0 +1,308 @@
+"""ID-indexed store that joins Traveldata and Surveydata as records arrive.
+
+The pipeline reads complete travel and survey files and joins them with
+``pd.merge`` on the passenger ID. In production the travel record lands
+first and the survey answers trickle in later, and merging the whole
+history again for every batch costs time in proportion to the history.
+
+Passenger IDs are dense and contiguous (988xxxxx for training, 999xxxxx for
+test), so :class:`RecordStore` uses ``ID - base`` as a row offset into one
+array per column instead of a hash join. Every column is a ``.npy`` file
+under the store directory, memory-mapped in place: the 19 categorical
+columns as int8 codes (-1 when missing), the numeric ones in their schema
+types, and Overall_Experience as int8 (-1 when the survey has no label).
+One state byte per offset records which sides have arrived and whether the
+passenger is waiting to be emitted.
+
+Upserting a batch writes its values at their offsets and checks the state
+of those offsets only, so passengers whose second half just arrived are
+queued in O(batch rows). :meth:`RecordStore.take` gathers the queued rows
+into a merged frame with the same columns and types as :func:`pipeline.merge`
+and clears the queue, or in two steps, :meth:`~RecordStore.pending` and
+:meth:`~RecordStore.commit` once the frame has been used; a passenger upserted again after being taken is
+queued again with its new values. The queue is appended to before the
+state bytes are set and cleared after they are, so a crash in between
+emits a passenger twice rather than never. The store has a single writer.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from shinkansen import config, instrument
+
+# The base ID is the first batch's smallest ID rounded down to a multiple of this
+ID_ALIGN = 100000
+# Offsets allocated when a store is created; the arrays double as IDs beyond them arrive
+MIN_CAPACITY = 2 ** 16
+# Largest ID range one store will allocate, so one stray ID cannot claim gigabytes
+MAX_SPAN = 2 ** 26
+
+TRAVEL_COLUMNS = config.TRAVEL_CATEGORY_COL + config.TRAVEL_NUMERIC_COL
+SURVEY_COLUMNS = [config.TARGET_COL] + config.SURVEY_CATEGORY_COL
+
+# State bits per offset
+TRAVEL = 1
+SURVEY = 2
+COMPLETE = TRAVEL | SURVEY
+QUEUED = 4
+TAKEN = 8
+
+QUEUE_FILE = 'queue.i32'
+META_FILE = 'meta.json'
+
+
+def _dtype(col):
+    """Storage type of a column in the store."""
+    if col in config.CATEGORY_LEVELS or col == config.TARGET_COL:
+        return np.int8
+    return np.dtype(config.NUMERIC_DTYPES[col])
+
+
+class RecordStore:
+    """Travel and survey columns of every passenger, at offset ``ID - base``."""
+
+    def __init__(self, root):
+        self.root = root
+        self.base = None
+        self.capacity = 0
+        self._arrays = {}
+        # Column order of each side as first upserted, so frames come out in the files' layout
+        self.order = {}
+        if os.path.exists(os.path.join(root, META_FILE)):
+            with open(os.path.join(root, META_FILE)) as f:
+                meta = json.load(f)
+            self.base, self.capacity = meta['base'], meta['capacity']
+            self.order = meta.get('order', {})
+            self._open()
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _open(self):
+        for col in TRAVEL_COLUMNS + SURVEY_COLUMNS + ['state']:
+            self._arrays[col] = np.lib.format.open_memmap(self._path(f'{col}.npy'), mode='r+')
+
+    def _write_meta(self):
+        tmp = self._path(f'{META_FILE}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'base': self.base, 'capacity': self.capacity, 'order': self.order}, f)
+        os.replace(tmp, self._path(META_FILE))
+
+    def _allocate(self, capacity):
+        """Grow every column to ``capacity`` offsets, keeping the stored values."""
+        os.makedirs(self.root, exist_ok=True)
+        for col in TRAVEL_COLUMNS + SURVEY_COLUMNS + ['state']:
+            dtype = np.uint8 if col == 'state' else _dtype(col)
+            tmp = self._path(f'{col}.npy.tmp')
+            # A new .npy file is sparse and reads as zeros, so only the old offsets are copied
+            array = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=(capacity,))
+            if col in self._arrays:
+                array[:self.capacity] = self._arrays[col]
+            array.flush()
+            del array
+            os.replace(tmp, self._path(f'{col}.npy'))
+        self._arrays.clear()
+        self.capacity = capacity
+        self._write_meta()
+        self._open()
+
+    def _offsets(self, ids):
+        """Offsets of ``ids``, growing the arrays to cover them."""
+        if self.base is None:
+            self.base = int(ids.min()) // ID_ALIGN * ID_ALIGN
+        offsets = ids - self.base
+        if offsets.min() < 0:
+            raise ValueError(f'ID {int(ids.min())} is below the store base {self.base}')
+        needed = int(offsets.max()) + 1
+        if needed > MAX_SPAN:
+            raise ValueError(f'ID {int(ids.max())} is more than {MAX_SPAN} past the store base {self.base}')
+        if needed > self.capacity:
+            capacity = max(MIN_CAPACITY, self.capacity)
+            while capacity < needed:
+                capacity *= 2
+            self._allocate(min(capacity, MAX_SPAN))
+        return offsets
+
+    def __len__(self):
+        """Passengers with both records."""
+        if not self.capacity:
+            return 0
+        return int(np.count_nonzero((self._arrays['state'] & COMPLETE) == COMPLETE))
+
+    def upsert(self, frame, side):
+        """Write a batch of travel (``side='travel'``) or survey rows and queue the newly complete passengers.
+
+        A later row for the same ID replaces the earlier values. Returns the
+        number of passengers queued by this batch.
+        """
+        columns, bit = (TRAVEL_COLUMNS, TRAVEL) if side == 'travel' else (SURVEY_COLUMNS, SURVEY)
+        missing = [col for col in columns if col not in frame and col != config.TARGET_COL]
+        if missing:
+            raise ValueError(f'{side} batch lacks columns: {", ".join(missing)}')
+        if not len(frame):
+            return 0
+        with instrument.stage('store_upsert', detail=side, rows=len(frame)):
+            offsets = self._offsets(frame[config.ID_COL].to_numpy(dtype=np.int64))
+            if side not in self.order:
+                self.order[side] = [col for col in frame.columns if col in columns]
+                self.order[side] += [col for col in columns if col not in self.order[side]]
+                self._write_meta()
+            rows = slice(None)
+            if len(np.unique(offsets)) < len(offsets):
+                # Keep the last row of every repeated ID
+                _, last = np.unique(offsets[::-1], return_index=True)
+                rows = np.sort(len(offsets) - 1 - last)
+                offsets = offsets[rows]
+            for col in columns:
+                if col == config.TARGET_COL and col not in frame:
+                    values = -1
+                elif col in config.CATEGORY_LEVELS:
+                    values = frame[col].astype(pd.CategoricalDtype(config.CATEGORY_LEVELS[col])).cat.codes
+                    values = values.to_numpy()
+                elif col == config.TARGET_COL:
+                    values = frame[col].to_numpy(dtype=np.int8, na_value=-1)
+                else:
+                    values = frame[col].to_numpy(dtype=_dtype(col), na_value=np.nan)
+                self._arrays[col][offsets] = values if np.isscalar(values) else values[rows]
+
+            state = self._arrays['state']
+            updated = state[offsets] | bit
+            queue = (updated & (COMPLETE | QUEUED)) == COMPLETE
+            ready = offsets[queue]
+            with open(self._path(QUEUE_FILE), 'ab') as f:
+                f.write(ready.astype(np.int32).tobytes())
+            updated[queue] |= QUEUED
+            state[offsets] = updated
+            state.flush()
+        return len(ready)
+
+    def queued(self):
+        """Offsets waiting to be taken, in the order they became complete."""
+        path = self._path(QUEUE_FILE)
+        return np.fromfile(path, dtype=np.int32) if os.path.exists(path) else np.empty(0, dtype=np.int32)
+
+    def join(self, ids):
+        """Merged frame of passengers that have both records, in the layout of :func:`pipeline.merge`.
+
+        Overall_Experience is included when every one of them has a label.
+        """
+        offsets = np.asarray(ids, dtype=np.int64) - self.base
+        if len(offsets) and ((self._arrays['state'][offsets] & COMPLETE) != COMPLETE).any():
+            raise ValueError('some of the IDs do not have both a travel and a survey record')
+        return self._frame(offsets)
+
+    def _frame(self, offsets):
+        data = {config.ID_COL: (offsets + self.base).astype(config.NUMERIC_DTYPES[config.ID_COL])}
+        for col in self.order.get('travel', TRAVEL_COLUMNS) + self.order.get('survey', SURVEY_COLUMNS):
+            values = self._arrays[col][offsets]
+            if col == config.TARGET_COL:
+                if (values < 0).any():
+                    continue
+                data[col] = values
+            elif col in config.CATEGORY_LEVELS:
+                data[col] = pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(config.CATEGORY_LEVELS[col]))
+            else:
+                data[col] = values
+        return pd.DataFrame(data)
+
+    def pending(self):
+        """Merged frame of the queued passengers, who stay queued until :meth:`commit`."""
+        offsets = self.queued().astype(np.int64)
+        with instrument.stage('store_take', rows=len(offsets)):
+            return self._frame(offsets)
+
+    def commit(self, frame):
+        """Mark the passengers of a :meth:`pending` frame taken and drop them from the queue.
+
+        Call it once the frame has been handed on, so a failure in between
+        leaves them queued for the next run.
+        """
+        queued = self.queued()
+        offsets = frame[config.ID_COL].to_numpy(dtype=np.int64) - self.base if len(frame) else queued[:0]
+        if not np.array_equal(queued[:len(offsets)], offsets):
+            raise ValueError('the frame is not the head of the queue')
+        state = self._arrays['state']
+        state[offsets] = (state[offsets] & ~np.uint8(QUEUED)) | TAKEN
+        state.flush()
+        if len(offsets) == len(queued):
+            if len(queued):
+                os.remove(self._path(QUEUE_FILE))
+        else:
+            tmp = self._path(f'{QUEUE_FILE}.tmp')
+            queued[len(offsets):].tofile(tmp)
+            os.replace(tmp, self._path(QUEUE_FILE))
+
+    def take(self):
+        """Merged frame of the queued passengers, clearing the queue."""
+        frame = self.pending()
+        self.commit(frame)
+        return frame
+
+    def summary(self):
+        """Counts of passengers by which records have arrived."""
+        state = self._arrays['state'] if self.capacity else np.empty(0, dtype=np.uint8)
+        sides = state & COMPLETE
+        return {
+            'base': self.base,
+            'capacity': self.capacity,
+            'travel_only': int(np.count_nonzero(sides == TRAVEL)),
+            'survey_only': int(np.count_nonzero(sides == SURVEY)),
+            'complete': int(np.count_nonzero(sides == COMPLETE)),
+            'queued': int(np.count_nonzero(state & QUEUED)),
+            'taken': int(np.count_nonzero(state & TAKEN)),
+        }
+
+
+def _arrivals(travel, survey, batches, lag, seed):
+    """Shuffled travel rows in ``batches`` parts, each passenger's survey ``lag`` batches after its travel."""
+    rng = np.random.default_rng(seed)
+    travel = travel.iloc[rng.permutation(len(travel))].reset_index(drop=True)
+    parts = np.array_split(np.arange(len(travel)), batches)
+    batch_of = pd.Series(np.repeat(np.arange(batches), [len(part) for part in parts]), index=travel[config.ID_COL])
+    survey_batch = survey[config.ID_COL].map(batch_of).fillna(batches - 1 - lag).to_numpy() + lag
+    for step in range(batches + lag):
+        yield (travel.iloc[parts[step]] if step < batches else travel.iloc[:0],
+               survey[survey_batch == step])
+
+
+def benchmark(travel_path, survey_path, root, batches=20, lag=2, seed=0, cache_dir=None):
+    """Replay the files as arriving batches into a fresh store at ``root`` and time each step.
+
+    Every step is also done the way the pipeline would: concatenate the
+    history, ``pd.merge`` it and keep the IDs not emitted yet. Both must
+    emit the same rows. Returns one row per step.
+    """
+    import shutil
+    import time
+
+    from shinkansen import pipeline
+
+    shutil.rmtree(root, ignore_errors=True)
+    store = RecordStore(root)
+    travel_all, survey_all = pipeline.load_raw(travel_path, survey_path, cache_dir)
+    travel_seen, survey_seen, emitted = [], [], set()
+    rows = []
+    for step, (travel, survey) in enumerate(_arrivals(travel_all, survey_all, batches, lag, seed)):
+        start = time.perf_counter()
+        store.upsert(travel, 'travel')
+        store.upsert(survey, 'survey')
+        frame = store.take()
+        store_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        travel_seen.append(travel)
+        survey_seen.append(survey)
+        merged = pd.merge(pd.concat(travel_seen), pd.concat(survey_seen), on=config.ID_COL)
+        merged = merged[~merged[config.ID_COL].isin(emitted)]
+        merge_seconds = time.perf_counter() - start
+        emitted.update(merged[config.ID_COL].tolist())
+
+        same = frame.sort_values(config.ID_COL).reset_index(drop=True).equals(
+            merged.sort_values(config.ID_COL).reset_index(drop=True))
+        rows.append({'step': step, 'travel_rows': len(travel), 'survey_rows': len(survey), 'emitted': len(frame),
+                     'history': sum(map(len, survey_seen)), 'store_seconds': store_seconds,
+                     'merge_seconds': merge_seconds, 'same': same})
+    return pd.DataFrame(rows)
@@ -0,0 +1,186 @@
+"""Synthetic Traveldata/Surveydata files at any multiple of the real size.
+
+The generator reproduces the two schemas, the category frequencies, the
+share of missing answers per column and the rough shape of the numeric
+columns, so the pipeline does the same work per row as on the hackathon
+files. The label follows a noisy logistic score of the ratings and the
+travel type, which gives the models something to learn and keeps early
+stopping realistic.
+
+:data:`DEFAULT_PROFILE` holds approximate statistics of the 94,379-row
+training set. :func:`profile` measures the same statistics on real files,
+in the same form as the notebook's ``value_counts`` and missing-percentage
+cells, and its output can be saved as JSON and passed back in.
+
+Files are written chunk by chunk, ordered by ID like the originals, so
+generating the 100x set needs no more memory than the 1x one.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from shinkansen import config
+
+# Approximate frequencies of the survey ratings, worst to best
+_RATINGS = [0.02, 0.08, 0.13, 0.19, 0.32, 0.26]
+
+DEFAULT_PROFILE = {
+    'train_rows': 94379,
+    'test_rows': 35602,
+    'positive_rate': 0.547,
+    'categories': dict({
+        'Gender': {'Female': 0.507, 'Male': 0.493},
+        'Customer_Type': {'Disloyal Customer': 0.182, 'Loyal Customer': 0.818},
+        'Type_Travel': {'Business Travel': 0.689, 'Personal Travel': 0.311},
+        'Travel_Class': {'Business': 0.478, 'Eco': 0.522},
+        'Seat_Class': {'Green Car': 0.502, 'Ordinary': 0.498},
+        'Platform_Location': dict(zip(config.PLATFORM_LEVELS, [0.0001, 0.08, 0.19, 0.26, 0.24, 0.23])),
+    }, **{col: dict(zip(config.RATING_LEVELS, _RATINGS))
+          for col in config.SURVEY_CATEGORY_COL if col not in ('Seat_Class', 'Platform_Location')}),
+    # Share of missing values per column
+    'missing': {
+        'Gender': 0.0008, 'Customer_Type': 0.095, 'Age': 0.0004, 'Type_Travel': 0.098,
+        'Departure_Delay_in_Mins': 0.0006, 'Arrival_Delay_in_Mins': 0.0038,
+        'Seat_Comfort': 0.0006, 'Arrival_Time_Convenient': 0.095, 'Catering': 0.093,
+        'Platform_Location': 0.0003, 'Onboard_Wifi_Service': 0.0003, 'Onboard_Entertainment': 0.0002,
+        'Online_Support': 0.0010, 'Ease_of_Online_Booking': 0.0008, 'Onboard_Service': 0.080,
+        'Legroom': 0.0010, 'Baggage_Handling': 0.0015, 'CheckIn_Service': 0.0008,
+        'Cleanliness': 0.0001, 'Online_Boarding': 0.0001,
+    },
+    'numeric': {
+        'Age': {'mean': 39.4, 'std': 15.1, 'min': 7, 'max': 85},
+        'Travel_Distance': {'mean': 1979, 'std': 1027, 'min': 50, 'max': 6951},
+        # Share of trains leaving on time, and the mean delay of the others
+        'Departure_Delay_in_Mins': {'zero': 0.56, 'mean': 33.7},
+    },
+}
+
+TRAIN_FIRST_ID = 98800001
+TEST_FIRST_ID = 99900001
+
+
+def profile(travel_path, survey_path):
+    """Category frequencies, missing shares and numeric summaries of a real file pair."""
+    from shinkansen import pipeline
+
+    travel, survey = pipeline.load_raw(travel_path, survey_path)
+    data = pipeline.merge(travel, survey)
+    departure = data['Departure_Delay_in_Mins'].dropna()
+    result = {
+        'train_rows': len(data),
+        'test_rows': DEFAULT_PROFILE['test_rows'],
+        'positive_rate': float(data[config.TARGET_COL].mean()),
+        'categories': {col: {str(level): float(share) for level, share in
+                             data[col].value_counts(normalize=True).items()}
+                       for col in config.CATEGORY_COL},
+        'missing': {col: float(share) for col, share in data.isnull().mean().items() if share},
+        'numeric': {col: {'mean': float(data[col].mean()), 'std': float(data[col].std()),
+                          'min': float(data[col].min()), 'max': float(data[col].max())}
+                    for col in ('Age', 'Travel_Distance')},
+    }
+    result['numeric']['Departure_Delay_in_Mins'] = {'zero': float((departure == 0).mean()),
+                                                    'mean': float(departure[departure > 0].mean())}
+    return result
+
+
+def _choice(rng, frequencies, n):
+    levels = list(frequencies)
+    p = np.array([frequencies[level] for level in levels], dtype=float)
+    return np.array(levels, dtype=object)[rng.choice(len(levels), n, p=p / p.sum())]
+
+
+def _score(travel, survey):
+    """Mean rating position plus a bump for business travel; drives the label."""
+    ratings = [pd.Categorical(survey[col], categories=config.CATEGORY_LEVELS[col]).codes
+               for col in config.SURVEY_CATEGORY_COL if col != 'Seat_Class']
+    return np.mean(ratings, axis=0) + 0.5 * (travel['Type_Travel'].to_numpy() == 'Business Travel')
+
+
+def _chunk(rng, prof, first_id, n, labelled, offset):
+    """One block of matching Traveldata and Surveydata rows."""
+    ids = np.arange(first_id, first_id + n, dtype=np.int64)
+    numeric = prof['numeric']
+    travel = pd.DataFrame({config.ID_COL: ids})
+    for col in config.TRAVEL_CATEGORY_COL:
+        travel[col] = _choice(rng, prof['categories'][col], n)
+    for col in ('Age', 'Travel_Distance'):
+        stats = numeric[col]
+        travel[col] = np.clip(np.rint(rng.normal(stats['mean'], stats['std'], n)), stats['min'], stats['max'])
+    delays = numeric['Departure_Delay_in_Mins']
+    departure = np.where(rng.random(n) < delays['zero'], 0.0, np.rint(rng.exponential(delays['mean'], n)))
+    travel['Departure_Delay_in_Mins'] = departure
+    travel['Arrival_Delay_in_Mins'] = np.clip(np.rint(departure + rng.normal(0, 5, n)), 0, None)
+    travel = travel[['ID', 'Gender', 'Customer_Type', 'Age', 'Type_Travel', 'Travel_Class', 'Travel_Distance',
+                     'Departure_Delay_in_Mins', 'Arrival_Delay_in_Mins']]
+
+    survey = pd.DataFrame({config.ID_COL: ids})
+    for col in config.SURVEY_CATEGORY_COL:
+        survey[col] = _choice(rng, prof['categories'][col], n)
+    if labelled:
+        logit = 3.0 * (_score(travel, survey) - offset) + rng.logistic(0, 1, n)
+        survey.insert(1, config.TARGET_COL, (logit > 0).astype(np.int8))
+
+    for frame in (travel, survey):
+        for col in frame.columns:
+            rate = prof['missing'].get(col, 0.0)
+            if rate:
+                frame[col] = frame[col].mask(rng.random(n) < rate)
+    return travel, survey
+
+
+def _label_offset(prof, seed):
+    """Score threshold that gives the profile's share of positive labels."""
+    rng = np.random.default_rng(seed)
+    travel, survey = _chunk(rng, dict(prof, missing={}), 0, 50000, labelled=False, offset=0.0)
+    noisy = 3.0 * _score(travel, survey) + rng.logistic(0, 1, len(travel))
+    return float(np.quantile(noisy, 1 - prof['positive_rate'])) / 3.0
+
+
+def write_pair(travel_path, survey_path, rows, first_id, labelled, prof=None, seed=0, chunk_size=200000):
+    """Write ``rows`` synthetic passengers to a Traveldata/Surveydata pair of .csv files."""
+    prof = prof or DEFAULT_PROFILE
+    rng = np.random.default_rng(seed)
+    offset = _label_offset(prof, seed) if labelled else 0.0
+    for path in (travel_path, survey_path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = [f'{travel_path}.tmp', f'{survey_path}.tmp']
+    with open(tmp[0], 'w', newline='') as travel_file, open(tmp[1], 'w', newline='') as survey_file:
+        for start in range(0, rows, chunk_size):
+            travel, survey = _chunk(rng, prof, first_id + start, min(chunk_size, rows - start), labelled, offset)
+            travel.to_csv(travel_file, header=start == 0, index=False)
+            survey.to_csv(survey_file, header=start == 0, index=False)
+    os.replace(tmp[0], travel_path)
+    os.replace(tmp[1], survey_path)
+
+
+def generate(output_dir, scale=1, prof=None, seed=0):
+    """Write train and test file pairs at ``scale`` times the profile's row counts.
+
+    Returns the paths keyed like ``config``: travel_train, survey_train,
+    travel_test and survey_test.
+    """
+    prof = prof or DEFAULT_PROFILE
+    paths = {
+        'travel_train': os.path.join(output_dir, config.TRAVEL_TRAIN_FILE),
+        'survey_train': os.path.join(output_dir, config.SURVEY_TRAIN_FILE),
+        'travel_test': os.path.join(output_dir, config.TRAVEL_TEST_FILE),
+        'survey_test': os.path.join(output_dir, config.SURVEY_TEST_FILE),
+    }
+    write_pair(paths['travel_train'], paths['survey_train'], int(prof['train_rows'] * scale), TRAIN_FIRST_ID,
+               True, prof, seed)
+    write_pair(paths['travel_test'], paths['survey_test'], int(prof['test_rows'] * scale), TEST_FIRST_ID,
+               False, prof, seed + 1)
+    return paths
+
+
+def load_profile(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_profile(prof, path):
+    with open(path, 'w') as f:
+        json.dump(prof, f, indent=2)
@@ -0,0 +1,245 @@
+"""One training harness for LightGBM, XGBoost and RandomForest.
+
+Every family is fitted against the same held-out set with the same early
+stopping rule: training stops once validation log loss has not improved for
+``early_stopping_rounds`` trees, and predictions use the best iteration.
+The boosters stop adding rounds, and the forest grows in ``forest_step``
+tree increments and is trimmed back to its best size.
+
+With a ``checkpoint_dir`` the partially trained model is saved every
+``checkpoint_every`` trees (atomically, next to a small JSON file with
+progress). ``resume=True`` continues an interrupted run from that
+checkpoint instead of starting over.
+"""
+
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from shinkansen import instrument
+from shinkansen.evaluation import logloss
+from shinkansen.models import DEFAULT_N_ESTIMATORS, eval_kwargs, make_model
+
+
+def _fingerprint(train, valid):
+    """Cheap identity of the training data, so a resume cannot silently switch data."""
+    return [len(train), len(valid), train.X.shape[1], int(train.y.sum()), int(valid.y.sum())]
+
+
+class Checkpoint:
+    """Model file plus JSON progress record for one model family."""
+
+    EXTENSIONS = {'lightgbm': 'txt', 'xgboost': 'json', 'random_forest': 'joblib'}
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.model_path = os.path.join(directory, f'{name}.{self.EXTENSIONS[name]}')
+        self.meta_path = os.path.join(directory, f'{name}.ckpt.json')
+
+    def exists(self):
+        return os.path.exists(self.model_path) and os.path.exists(self.meta_path)
+
+    def read(self):
+        with open(self.meta_path) as f:
+            return json.load(f)
+
+    def write(self, save_model, meta):
+        """Save through ``save_model(path)`` and the JSON record, each via a temporary file."""
+        os.makedirs(self.directory, exist_ok=True)
+        # Keep the extension last; XGBoost picks its file format from it
+        root, ext = os.path.splitext(self.model_path)
+        tmp = f'{root}.tmp{ext}'
+        save_model(tmp)
+        os.replace(tmp, self.model_path)
+        tmp = f'{self.meta_path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.meta_path)
+
+    def clear(self):
+        for path in (self.model_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class Progress:
+    """Early stopping state, shared by every family and saved with each checkpoint.
+
+    Seeding it from a checkpoint lets a resumed run keep counting from the
+    best iteration reached before the interruption.
+    """
+
+    def __init__(self, rounds, meta, prune=None):
+        self.rounds = rounds
+        self.built = meta.get('iteration', 0)
+        self.best = meta.get('best', 0)
+        self.best_score = meta.get('best_score', math.inf)
+        self.prune = prune
+        self.pruned = False
+
+    def update(self, built, score):
+        """Record the validation log loss after ``built`` trees; True means stop."""
+        self.built = built
+        if score < self.best_score:
+            self.best, self.best_score = built, score
+        if self.prune is not None and self.prune(built, self.best_score):
+            self.pruned = True
+            return True
+        return built - self.best >= self.rounds
+
+    def state(self):
+        return {'iteration': self.built, 'best': self.best, 'best_score': self.best_score}
+
+
+def _fit_lightgbm(train, valid, n_estimators, progress, checkpoint, every, meta, random_state, params,
+                  fit_kwargs):
+    import lightgbm as lgbm
+
+    start = progress.built
+
+    def callback(env):
+        stop = progress.update(env.iteration + 1, env.evaluation_result_list[0][2])
+        if checkpoint is not None and progress.built % every == 0:
+            checkpoint.write(env.model.save_model, dict(meta, **progress.state()))
+        if stop:
+            raise lgbm.callback.EarlyStopException(progress.best - 1, env.evaluation_result_list)
+
+    model = make_model('lightgbm', n_estimators=n_estimators - start, random_state=random_state, **params)
+    model.fit(train.X, train.y, eval_metric='binary_logloss', callbacks=[callback],
+              init_model=checkpoint.model_path if start else None, **eval_kwargs(model, valid.X, valid.y),
+              **fit_kwargs)
+    # Predict with the best iteration, which may predate a resume
+    model.booster_.best_iteration = progress.best
+    model._best_iteration = progress.best
+    return model
+
+
+def _fit_xgboost(train, valid, n_estimators, progress, checkpoint, every, meta, random_state, params,
+                 fit_kwargs):
+    import xgboost as xgb
+
+    start = progress.built
+
+    class Callback(xgb.callback.TrainingCallback):
+        def after_iteration(self, model, epoch, evals_log):
+            # Epochs restart at 0 when continuing from a checkpoint
+            stop = progress.update(start + epoch + 1, evals_log['validation_0']['logloss'][-1])
+            if checkpoint is not None and progress.built % every == 0:
+                checkpoint.write(model.save_model, dict(meta, **progress.state()))
+            return stop
+
+        def after_training(self, model):
+            # The sklearn wrapper predicts up to the booster's best_iteration attribute
+            model.set_attr(best_iteration=str(progress.best - 1), best_score=str(progress.best_score))
+            return model
+
+    model = make_model('xgboost', n_estimators=n_estimators - start, random_state=random_state,
+                       callbacks=[Callback()], **params)
+    model.fit(train.X, train.y, eval_set=[(valid.X, valid.y)], verbose=False,
+              xgb_model=checkpoint.model_path if start else None, **fit_kwargs)
+    # The callback closes over this run's state and cannot be pickled with the model
+    model.set_params(callbacks=None)
+    return model
+
+
+def _fit_random_forest(train, valid, n_estimators, progress, checkpoint, every, meta, random_state, params,
+                       step):
+    import joblib
+
+    if progress.built:
+        model = joblib.load(checkpoint.model_path)
+    else:
+        model = make_model('random_forest', n_estimators=step, random_state=random_state, warm_start=True, **params)
+    # Running sum of the trees' validation probabilities, so each step only scores its new trees
+    proba_sum = np.zeros(len(valid))
+    for tree in getattr(model, 'estimators_', []):
+        proba_sum += tree.predict_proba(valid.X)[:, 1]
+
+    built = progress.built
+    while built < n_estimators:
+        model.n_estimators = min(built + step, n_estimators)
+        model.fit(train.X, train.y)
+        for tree in model.estimators_[built:]:
+            proba_sum += tree.predict_proba(valid.X)[:, 1]
+        built = len(model.estimators_)
+        stop = progress.update(built, logloss(valid.y, proba_sum / built))
+        if checkpoint is not None and built % every < step:
+            checkpoint.write(lambda path: joblib.dump(model, path), dict(meta, **progress.state()))
+        if stop:
+            break
+
+    # Keep only the trees up to the best validation score
+    model.estimators_ = model.estimators_[:progress.best]
+    model.n_estimators = progress.best
+    model.warm_start = False
+    return model
+
+
+def fit(name, train, valid, n_estimators=None, early_stopping_rounds=150, checkpoint_dir=None,
+        checkpoint_every=500, resume=False, random_state=None, params=None, fit_kwargs=None, forest_step=50,
+        prune=None):
+    """Fit one model family with early stopping on ``valid``.
+
+    ``train`` and ``valid`` are :class:`FeatureMatrix` objects. Returns the
+    fitted model and a report with trees built versus kept, validation log
+    loss, wall time and the iteration a resumed run started from.
+
+    ``prune(built, best_score)``, if given, is called after every round (every
+    forest step) and stops training when it returns True; the report then
+    has ``pruned`` set.
+    """
+    n_estimators = n_estimators or DEFAULT_N_ESTIMATORS[name]
+    params = dict(params or {})
+    checkpoint = Checkpoint(checkpoint_dir, name) if checkpoint_dir else None
+    meta = {'fingerprint': _fingerprint(train, valid), 'n_estimators': n_estimators, 'iteration': 0}
+
+    start = 0
+    if checkpoint is not None and checkpoint.exists():
+        if not resume:
+            checkpoint.clear()
+        else:
+            saved = checkpoint.read()
+            if saved['fingerprint'] != meta['fingerprint']:
+                raise ValueError(f'checkpoint {checkpoint.model_path} was written for different training data')
+            meta.update(saved)
+            meta['n_estimators'] = n_estimators
+            start = saved['iteration']
+
+    progress = Progress(early_stopping_rounds, meta if start else {}, prune)
+    t0 = time.perf_counter()
+    with instrument.stage('fit', detail=name, rows=len(train)):
+        if name == 'random_forest':
+            model = _fit_random_forest(train, valid, n_estimators, progress, checkpoint, checkpoint_every, meta,
+                                       random_state, params, forest_step)
+        else:
+            fitter = _fit_lightgbm if name == 'lightgbm' else _fit_xgboost
+            model = fitter(train, valid, n_estimators, progress, checkpoint, checkpoint_every, meta, random_state,
+                           params, fit_kwargs or {})
+    seconds = time.perf_counter() - t0
+
+    with instrument.stage('predict_proba', detail=name, rows=len(valid)):
+        proba = model.predict_proba(valid.X)[:, 1]
+    report = {
+        'model': name,
+        'trees_built': progress.built,
+        'trees_kept': progress.best,
+        'resumed_from': int(start),
+        'pruned': progress.pruned,
+        'seconds': seconds,
+        'logloss': logloss(valid.y, proba),
+        'accuracy': float(np.mean((proba > 0.5) == valid.y)),
+    }
+    if checkpoint is not None:
+        # The run finished, so the next one starts fresh
+        checkpoint.clear()
+    return model, report
+
+
+def format_report(report):
+    return (f"{report['model']}: {report['trees_kept']} of {report['trees_built']} trees kept"
+            f"{' (resumed at ' + str(report['resumed_from']) + ')' if report['resumed_from'] else ''}, "
+            f"logloss {report['logloss']:.5f}, accuracy {report['accuracy']:.5f}, {report['seconds']:.1f}s")
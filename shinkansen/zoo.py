@@ -0,0 +1,126 @@
+"""Train the three model families side by side on a core budget.
+
+The notebook fits LightGBM, XGBoost and RandomForest one after the other,
+each library grabbing every core for itself. Here each family runs in its own
+worker process with a share of the cores, so the three fits overlap instead
+of queueing. The encoded train and held-out matrices are copied once into
+shared memory and mapped by every worker, rather than pickled into each.
+
+Workers are spawned, not forked: the boosters' OpenMP runtimes do not
+survive a fork, and a fresh process also picks up ``OMP_NUM_THREADS`` before
+any library creates its thread pool.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from shinkansen.matrix import SharedFeatureMatrix, attach
+from shinkansen.models import MODEL_NAMES
+
+# Relative core shares. The forest parallelises perfectly over trees and is
+# the slowest family, so it gets twice the boosters' share.
+CORE_WEIGHTS = {'lightgbm': 1, 'xgboost': 1, 'random_forest': 2}
+
+
+def split_cores(total, names, weights=None):
+    """Thread counts per model, proportional to ``weights`` and at least one each."""
+    weights = weights or CORE_WEIGHTS
+    total = max(total, len(names))
+    spare = total - len(names)
+    weight_sum = sum(weights.get(name, 1) for name in names)
+    shares = {name: spare * weights.get(name, 1) / weight_sum for name in names}
+    cores = {name: 1 + int(share) for name, share in shares.items()}
+    # Hand out what rounding down left over, largest remainder first
+    leftover = total - sum(cores.values())
+    for name in sorted(names, key=lambda name: shares[name] - int(shares[name]), reverse=True)[:leftover]:
+        cores[name] += 1
+    return cores
+
+
+def _fit_member(name, train_spec, valid_spec, n_jobs, options):
+    """Worker entry point: map the shared matrices and fit one family."""
+    os.environ['OMP_NUM_THREADS'] = str(n_jobs)
+    from shinkansen import training
+
+    train, train_blocks = attach(train_spec)
+    valid, valid_blocks = attach(valid_spec)
+    try:
+        model, report = training.fit(name, train, valid, params={'n_jobs': n_jobs}, **options)
+    finally:
+        # The arrays view the shared blocks and must go before the blocks close
+        del train, valid
+        for block in train_blocks + valid_blocks:
+            block.close()
+    report['n_jobs'] = n_jobs
+    return model, report
+
+
+def fit_parallel(train, valid, names=MODEL_NAMES, cores=None, **options):
+    """Fit every family in ``names`` concurrently, one worker process each.
+
+    ``options`` go to :func:`shinkansen.training.fit`. Returns the models and
+    reports keyed by name, and the wall-clock seconds for the whole zoo.
+    """
+    import multiprocessing
+
+    budget = split_cores(cores or os.cpu_count() or 1, names)
+    start = time.perf_counter()
+    with SharedFeatureMatrix(train) as shared_train, SharedFeatureMatrix(valid) as shared_valid:
+        with ProcessPoolExecutor(max_workers=len(names), mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {name: pool.submit(_fit_member, name, shared_train.spec, shared_valid.spec, budget[name],
+                                         options)
+                       for name in names}
+            results = {name: future.result() for name, future in futures.items()}
+    return results, time.perf_counter() - start
+
+
+def fit_sequential(train, valid, names=MODEL_NAMES, cores=None, **options):
+    """Fit the families one after the other with every core, as the notebook does."""
+    from shinkansen import training
+
+    n_jobs = cores or os.cpu_count() or 1
+    results = {}
+    start = time.perf_counter()
+    for name in names:
+        model, report = training.fit(name, train, valid, params={'n_jobs': n_jobs}, **options)
+        report['n_jobs'] = n_jobs
+        results[name] = model, report
+    return results, time.perf_counter() - start
+
+
+def pick_winner(reports):
+    """Name of the model with the lowest held-out log loss, ties going to accuracy."""
+    return min(reports, key=lambda name: (reports[name]['logloss'], -reports[name]['accuracy']))
+
+
+def run(travel_path, survey_path, model_path, names=MODEL_NAMES, cores=None, compare_sequential=False,
+        test_size=0.2, random_state=None, cache_dir=None, encoding='onehot', **options):
+    """Train the zoo in parallel, keep the winner and report wall clock.
+
+    With ``compare_sequential`` the zoo is trained a second time one family
+    after another, and both wall-clock times are reported.
+    """
+    from shinkansen import pipeline, training
+
+    preprocessor, train_set, test_set = pipeline.prepare(travel_path, survey_path, test_size, random_state,
+                                                         cache_dir, encoding)
+    options['random_state'] = random_state
+    results, seconds = fit_parallel(train_set, test_set, names, cores, **options)
+    reports = {name: report for name, (_, report) in results.items()}
+    for report in reports.values():
+        print(f"{training.format_report(report)} with {report['n_jobs']} threads")
+
+    summary = {'parallel_seconds': seconds}
+    print(f"Zoo trained in parallel in {seconds:.1f}s")
+    if compare_sequential:
+        _, sequential_seconds = fit_sequential(train_set, test_set, names, cores, **options)
+        summary['sequential_seconds'] = sequential_seconds
+        print(f"Sequentially: {sequential_seconds:.1f}s ({sequential_seconds / seconds:.2f}x the parallel time)")
+
+    winner = pick_winner(reports)
+    print(f"Winner: {winner}")
+    model, report = results[winner]
+    pipeline.save_model(model_path, model, preprocessor, report, zoo=dict(summary, reports=reports),
+                        holdout_ids=test_set.ids)
+    return reports, summary
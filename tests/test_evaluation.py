@@ -0,0 +1,61 @@
+"""Metrics from one sort, and bootstrap metrics from the count matrix, against scikit-learn."""
+
+import numpy as np
+import pytest
+from sklearn import metrics as skm
+
+from shinkansen import evaluation
+
+
+def _data(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    y = rng.integers(0, 2, n)
+    # Rounded so many rows share a score, which is where the cumulative counts can go wrong
+    proba = np.clip(np.round(0.3 * y + 0.7 * rng.random(n), 2), 0.01, 0.99)
+    return y, proba
+
+
+@pytest.mark.parametrize('threshold', [0.5, 0.3, 0.72])
+def test_metrics_match_sklearn(threshold):
+    y, proba = _data()
+    result = evaluation.metrics(y, proba, threshold)
+    pred = (proba > threshold).astype(int)
+    tn, fp, fn, tp = skm.confusion_matrix(y, pred).ravel()
+    assert (result['tn'], result['fp'], result['fn'], result['tp']) == (tn, fp, fn, tp)
+    assert result['logloss'] == pytest.approx(skm.log_loss(y, proba))
+    assert result['accuracy'] == pytest.approx(skm.accuracy_score(y, pred))
+    assert result['precision'] == pytest.approx(skm.precision_score(y, pred))
+    assert result['recall'] == pytest.approx(skm.recall_score(y, pred))
+    assert result['f1'] == pytest.approx(skm.f1_score(y, pred))
+    assert result['roc_auc'] == pytest.approx(skm.roc_auc_score(y, proba))
+    assert result['average_precision'] == pytest.approx(skm.average_precision_score(y, proba))
+
+
+def test_best_threshold_is_the_most_accurate():
+    y, proba = _data(seed=1)
+    result = evaluation.metrics(y, proba)
+    best = max(skm.accuracy_score(y, proba >= t) for t in np.unique(proba))
+    assert result['best_accuracy'] == pytest.approx(best)
+    assert skm.accuracy_score(y, proba >= result['best_threshold']) == pytest.approx(best)
+
+
+def test_bootstrap_block_matches_weighted_sklearn():
+    y, proba = _data(n=500, seed=2)
+    seed = np.random.SeedSequence(7)
+    block = evaluation._bootstrap_block(y, {'m': proba}, 5, seed, 0.5)['m']
+    counts = evaluation._resample_counts(np.random.default_rng(seed), 5, len(y))
+    pred = (proba > 0.5).astype(int)
+    for i, weights in enumerate(counts):
+        assert block['logloss'][i] == pytest.approx(skm.log_loss(y, proba, sample_weight=weights))
+        assert block['accuracy'][i] == pytest.approx(skm.accuracy_score(y, pred, sample_weight=weights))
+        assert block['f1'][i] == pytest.approx(skm.f1_score(y, pred, sample_weight=weights))
+        assert block['roc_auc'][i] == pytest.approx(skm.roc_auc_score(y, proba, sample_weight=weights))
+        assert block['average_precision'][i] == pytest.approx(
+            skm.average_precision_score(y, proba, sample_weight=weights))
+
+
+def test_bootstrap_is_reproducible():
+    y, proba = _data(n=300, seed=3)
+    first = evaluation.bootstrap(y, {'m': proba}, n_boot=20, workers=1, random_state=5)
+    second = evaluation.bootstrap(y, {'m': proba}, n_boot=20, workers=1, random_state=5)
+    np.testing.assert_array_equal(first['m']['roc_auc'], second['m']['roc_auc'])
@@ -0,0 +1,63 @@
+"""Flat trees reproduce the probabilities of the models they were built from."""
+
+import pickle
+
+import numpy as np
+import pytest
+
+from shinkansen.forest import CompactForest
+
+
+def _data(n=3000, columns=8, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, columns)).astype(np.float32)
+    # Coarse values put rows exactly on split thresholds
+    X[:, :3] = np.round(X[:, :3], 1)
+    logit = X[:, 0] - 2 * X[:, 1] * X[:, 2] + np.sin(X[:, 3])
+    y = (rng.random(n) < 1 / (1 + np.exp(-logit))).astype(int)
+    return X, y
+
+
+def test_random_forest():
+    from sklearn.ensemble import RandomForestClassifier
+
+    X, y = _data()
+    model = RandomForestClassifier(n_estimators=20, max_leaf_nodes=64, random_state=0).fit(X[:2000], y[:2000])
+    flat = CompactForest.from_forest(model)
+    np.testing.assert_allclose(flat.predict_proba(X[2000:]), model.predict_proba(X[2000:]), atol=1e-6)
+
+
+def test_lightgbm():
+    lgbm = pytest.importorskip('lightgbm')
+
+    X, y = _data(seed=1)
+    model = lgbm.LGBMClassifier(n_estimators=50, num_leaves=15, verbose=-1).fit(X[:2000], y[:2000])
+    flat = CompactForest.from_lightgbm(model.booster_)
+    np.testing.assert_allclose(flat.predict_proba(X[2000:]), model.predict_proba(X[2000:]), atol=1e-10)
+
+
+def test_lightgbm_rejects_categorical_splits():
+    lgbm = pytest.importorskip('lightgbm')
+
+    X, y = _data(seed=2)
+    X[:, 0] = np.abs(np.round(X[:, 0] * 3))
+    model = lgbm.LGBMClassifier(n_estimators=5, verbose=-1).fit(X, y, categorical_feature=[0])
+    with pytest.raises(ValueError):
+        CompactForest.from_lightgbm(model.booster_)
+
+
+def test_xgboost():
+    xgb = pytest.importorskip('xgboost')
+
+    X, y = _data(seed=3)
+    model = xgb.XGBClassifier(n_estimators=50, max_depth=4).fit(X[:2000], y[:2000])
+    flat = CompactForest.from_xgboost(model.get_booster())
+    np.testing.assert_allclose(flat.predict_proba(X[2000:]), model.predict_proba(X[2000:]), atol=1e-6)
+
+
+def test_pickle_round_trip():
+    from sklearn.ensemble import RandomForestClassifier
+
+    X, y = _data(seed=4)
+    flat = CompactForest.from_forest(RandomForestClassifier(n_estimators=5, random_state=0).fit(X, y))
+    np.testing.assert_array_equal(pickle.loads(pickle.dumps(flat)).predict_proba(X), flat.predict_proba(X))
@@ -0,0 +1,67 @@
+"""Every way of encoding the same passengers gives the same matrix, before and after a JSON round-trip."""
+
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from shinkansen import config, pipeline, synth
+from shinkansen.preprocess import Preprocessor
+
+
+@pytest.fixture(scope='module')
+def frames(tmp_path_factory):
+    paths = synth.generate(str(tmp_path_factory.mktemp('preprocess')), scale=0.01)
+    train = pipeline.merge(*pipeline.load_raw(paths['travel_train'], paths['survey_train']))
+    test = pipeline.merge(*pipeline.load_raw(paths['travel_test'], paths['survey_test']))
+    return train, test
+
+
+def _records(data):
+    """Plain dicts as a client would post them, with None for missing values."""
+    data = data.astype(object).where(data.notna(), None)
+    return data.to_dict('records')
+
+
+def _awkward(data):
+    """A copy with missing values and a level the training data never had."""
+    data = data.copy()
+    data['Gender'] = data['Gender'].astype(object)
+    data.loc[data.index[:5], 'Gender'] = 'Unknown'
+    data.loc[data.index[5:10], 'Age'] = np.nan
+    data.loc[data.index[10:15], config.CATEGORY_COL[-1]] = np.nan
+    return data
+
+
+@pytest.mark.parametrize('encoding', ['onehot', 'ordinal'])
+def test_records_match_matrix(frames, encoding):
+    train, test = frames
+    preprocessor = Preprocessor(encoding=encoding).fit(train)
+    test = _awkward(test)
+    expected = preprocessor.transform_matrix(test)
+    assert expected.shape == (len(test), len(preprocessor.feature_names))
+    np.testing.assert_array_equal(preprocessor.transform_records(_records(test)), expected)
+    np.testing.assert_array_equal(preprocessor.transform(test).to_numpy(dtype=np.float32), expected)
+
+
+@pytest.mark.parametrize('encoding', ['onehot', 'ordinal'])
+def test_json_round_trip(frames, tmp_path, encoding):
+    train, test = frames
+    preprocessor = Preprocessor(encoding=encoding).fit(train)
+    expected = preprocessor.transform_matrix(test)
+
+    restored = Preprocessor.from_dict(json.loads(json.dumps(preprocessor.to_dict())))
+    assert restored.feature_names == preprocessor.feature_names
+    np.testing.assert_array_equal(restored.transform_matrix(test), expected)
+
+    path = str(tmp_path / 'preprocessor.json')
+    preprocessor.save(path)
+    loaded = Preprocessor.load(path)
+    np.testing.assert_array_equal(loaded.transform_records(_records(test)), expected)
+
+
+def test_empty_records(frames):
+    preprocessor = Preprocessor().fit(frames[0])
+    assert preprocessor.transform_records([]).shape == (0, len(preprocessor.feature_names))
+    assert isinstance(preprocessor.transform(frames[1].head(0)), pd.DataFrame)
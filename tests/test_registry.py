@@ -0,0 +1,54 @@
+"""A model saved by ``train`` registers, loads back and predicts the same."""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from shinkansen import cli, config, pipeline, synth
+from shinkansen.matrix import FeatureMatrix
+from shinkansen.registry import Registry
+
+
+@pytest.fixture(scope='module')
+def trained(tmp_path_factory):
+    pytest.importorskip('lightgbm')
+    root = tmp_path_factory.mktemp('registry')
+    paths = synth.generate(str(root / 'data'), scale=0.02)
+    model_dir = str(root / 'models')
+    args = ['--no-cache', '--no-instrument', '--model-dir', model_dir]
+    assert cli.main(args + ['train', '--data-dir', str(root / 'data'), '--n-estimators', '30', '--seed', '0']) == 0
+    assert cli.main(args + ['register', '--data-dir', str(root / 'data'), '--name', 'sat']) == 0
+    return model_dir, paths
+
+
+def test_register_keeps_arrays_out_of_meta(trained):
+    model_dir, _ = trained
+    registry = Registry(os.path.join(model_dir, 'registry'))
+    directory = registry.path('sat', 1)
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    assert meta['arrays'] == ['holdout_ids']
+    saved = pipeline.load_model(os.path.join(model_dir, config.MODEL_FILE))
+    np.testing.assert_array_equal(registry.load('sat').artifact()['holdout_ids'], saved['holdout_ids'])
+
+
+@pytest.mark.parametrize('native', [False, True])
+def test_registered_model_predicts_like_the_artifact(trained, native):
+    model_dir, paths = trained
+    saved = pipeline.load_model(os.path.join(model_dir, config.MODEL_FILE))
+    artifact = Registry(os.path.join(model_dir, 'registry')).load('sat', native=native).artifact()
+    data = pipeline.merge(*pipeline.load_raw(paths['travel_test'], paths['survey_test']))
+    X = FeatureMatrix.build(data, artifact['preprocessor']).X
+    np.testing.assert_array_equal(X, FeatureMatrix.build(data, saved['preprocessor']).X)
+    np.testing.assert_allclose(artifact['model'].predict_proba(X), saved['model'].predict_proba(X), atol=1e-5)
+
+
+def test_second_registration_is_the_next_version(trained):
+    model_dir, _ = trained
+    assert cli.main(['--no-cache', '--no-instrument', '--model-dir', model_dir, 'register', '--data-dir',
+                     os.path.join(os.path.dirname(model_dir), 'data'), '--name', 'sat']) == 0
+    registry = Registry(os.path.join(model_dir, 'registry'))
+    assert registry.versions('sat') == [1, 2]
+    assert list(registry.table()['version']) == [1, 2]
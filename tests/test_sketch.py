@@ -0,0 +1,77 @@
+"""The quantile sketch stays within its rank error bound, alone and merged."""
+
+import json
+import math
+
+import numpy as np
+import pytest
+
+from shinkansen.sketch import QuantileSketch, rank_error
+
+QUANTILES = (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99)
+# Well above the errors seen at k=200, well below what a broken compactor gives
+BOUND = 0.01
+
+
+def _values(n, seed):
+    rng = np.random.default_rng(seed)
+    # Skewed and tied, like delays in minutes
+    return np.round(rng.lognormal(2, 1.5, size=n))
+
+
+def _weight(sketch):
+    return sum(len(items) * 2 ** level for level, items in enumerate(sketch.levels))
+
+
+def test_small_streams_are_exact():
+    values = _values(500, seed=0)
+    sketch = QuantileSketch(k=1000).update(values)
+    assert len(sketch) == 500
+    for q in QUANTILES:
+        assert rank_error(values, sketch.quantile(q), q) == 0
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_error_bound(seed):
+    values = _values(200_000, seed)
+    sketch = QuantileSketch(k=200, seed=seed)
+    for chunk in np.array_split(values, 40):
+        sketch.update(chunk)
+
+    assert sketch.n == len(values)
+    # Compaction promotes half of an even number of items at twice the weight
+    assert _weight(sketch) == sketch.n
+    assert len(sketch) < 3 * sketch.k + len(sketch.levels)
+    for q in QUANTILES:
+        assert rank_error(values, sketch.quantile(q), q) < BOUND
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_merge(seed):
+    values = _values(200_000, seed)
+    parts = [QuantileSketch(k=200, seed=seed + i).update(chunk)
+             for i, chunk in enumerate(np.array_split(values, 7))]
+    merged = parts[0]
+    for part in parts[1:]:
+        merged.merge(part)
+
+    assert merged.n == len(values)
+    assert _weight(merged) == merged.n
+    assert len(merged) < 3 * merged.k + len(merged.levels)
+    for q in QUANTILES:
+        assert rank_error(values, merged.quantile(q), q) < BOUND
+
+
+def test_nan_empty_and_round_trip():
+    sketch = QuantileSketch(k=50)
+    assert math.isnan(sketch.median())
+    values = _values(5000, seed=4)
+    sketch.update(np.concatenate([values, [np.nan] * 10]))
+    assert sketch.n == len(values)
+
+    restored = QuantileSketch.from_dict(json.loads(json.dumps(sketch.to_dict())))
+    assert restored.n == sketch.n
+    assert [restored.quantile(q) for q in QUANTILES] == [sketch.quantile(q) for q in QUANTILES]
+
+    with pytest.raises(ValueError, match='k=50 and k=60'):
+        sketch.merge(QuantileSketch(k=60))
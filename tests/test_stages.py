@@ -0,0 +1,101 @@
+"""Stage cache entries are found again, missed when their inputs change and evicted least recently used first."""
+
+import os
+
+import numpy as np
+import pytest
+
+from shinkansen import stages, synth
+from shinkansen.stages import StageCache
+
+
+def _write(directory, payload):
+    with open(os.path.join(directory, 'payload.bin'), 'wb') as f:
+        f.write(payload)
+
+
+def _touch(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+    # Make sure the digest memo sees a new mtime even on coarse clocks
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_hit_and_miss(tmp_path):
+    source = str(tmp_path / 'source.csv')
+    _touch(source, 'ID,Age\n1,30\n')
+    cache = StageCache(str(tmp_path / 'cache'))
+
+    key = cache.key('merged', [source])
+    assert cache.get('merged', key) is None
+    path = cache.put('merged', key, lambda directory: _write(directory, b'x'))
+    assert cache.get('merged', key) == path
+    assert StageCache(str(tmp_path / 'cache')).key('merged', [source]) == key
+    assert [entry[0] for entry in cache.entries()] == [path]
+
+
+def test_changes_invalidate(tmp_path):
+    source = str(tmp_path / 'source.csv')
+    _touch(source, 'ID,Age\n1,30\n')
+    cache = StageCache(str(tmp_path / 'cache'))
+    key = cache.key('matrix', [source], {'encoding': 'onehot'})
+    cache.put('matrix', key, lambda directory: _write(directory, b'x'))
+
+    assert cache.key('matrix', [source], {'encoding': 'ordinal'}) != key
+    assert cache.key('nullity', [source], {'encoding': 'onehot'}) != key
+    _touch(source, 'ID,Age\n1,31\n')
+    changed = cache.key('matrix', [source], {'encoding': 'onehot'})
+    assert changed != key
+    assert cache.get('matrix', changed) is None
+    # Restoring the contents finds the old entry again, whatever the mtime
+    _touch(source, 'ID,Age\n1,30\n')
+    assert cache.get('matrix', cache.key('matrix', [source], {'encoding': 'onehot'})) is not None
+
+
+def test_eviction_is_least_recently_used(tmp_path):
+    cache = StageCache(str(tmp_path / 'cache'), max_bytes=10**6)
+    paths = {}
+    for i, name in enumerate('abc'):
+        paths[name] = cache.put('merged', name, lambda directory: _write(directory, b'x' * 1000))
+        # Spread the last-used times so the order does not depend on clock resolution
+        os.utime(paths[name], (i, i))
+    os.utime(paths['a'], (10, 10))
+    assert [entry[0] for entry in cache.entries()] == [paths['b'], paths['c'], paths['a']]
+
+    cache.max_bytes = 2500
+    cache.put('merged', 'd', lambda directory: _write(directory, b'x' * 1000))
+    remaining = [os.path.basename(entry[0]) for entry in cache.entries()]
+    assert sorted(remaining) == ['merged-a', 'merged-d']
+
+
+def test_feature_matrix_hit_matches_miss(tmp_path):
+    paths = synth.generate(str(tmp_path / 'data'), scale=0.01)
+    pair = paths['travel_train'], paths['survey_train']
+    cache_dir = str(tmp_path / 'cache')
+
+    fresh_pre, fresh = stages.feature_matrix(*pair, cache_dir=cache_dir)
+    cached_pre, cached = stages.feature_matrix(*pair, cache_dir=cache_dir)
+    # A hit maps the stored arrays instead of encoding again
+    assert isinstance(cached.X.base, np.memmap)
+    assert not isinstance(fresh.X.base, np.memmap)
+    assert cached_pre.to_dict() == fresh_pre.to_dict()
+    np.testing.assert_array_equal(cached.X, fresh.X)
+    np.testing.assert_array_equal(cached.y, fresh.y)
+    np.testing.assert_array_equal(cached.ids, fresh.ids)
+
+    _, uncached = stages.feature_matrix(*pair)
+    np.testing.assert_array_equal(uncached.X, fresh.X)
+
+
+def test_failed_write_leaves_no_entry(tmp_path):
+    cache = StageCache(str(tmp_path / 'cache'))
+
+    def write(directory):
+        _write(directory, b'partial')
+        raise RuntimeError('disk full')
+
+    with pytest.raises(RuntimeError):
+        cache.put('merged', 'k', write)
+    assert cache.get('merged', 'k') is None
+    assert cache.entries() == []
@@ -0,0 +1,94 @@
+"""RecordStore emits what a full merge of everything upserted would."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from shinkansen import config, pipeline, synth
+from shinkansen.store import RecordStore
+
+
+@pytest.fixture(scope='module')
+def files(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('data')
+    travel, survey = directory / 'travel.csv', directory / 'survey.csv'
+    synth.write_pair(str(travel), str(survey), 3000, synth.TRAIN_FIRST_ID, True, seed=0)
+    return pipeline.load_raw(str(travel), str(survey))
+
+
+def _sorted(frame):
+    return frame.sort_values(config.ID_COL).reset_index(drop=True)
+
+
+def test_take_matches_merge_after_out_of_order_repeated_upserts(files, tmp_path):
+    travel, survey = files
+    rng = np.random.default_rng(0)
+    store = RecordStore(str(tmp_path / 'store'))
+    # Surveys may land before their travel record, in any order, in batches of uneven size
+    batches = [('travel', travel.iloc[rows]) for rows in np.array_split(rng.permutation(len(travel)), 7)]
+    batches += [('survey', survey.iloc[rows]) for rows in np.array_split(rng.permutation(len(survey)), 5)]
+    batches = [batches[i] for i in rng.permutation(len(batches))]
+    # Corrections: later rows for IDs already sent, some of them twice in one batch
+    changed = travel.sample(300, random_state=1).copy()
+    changed['Age'] += 1
+    changed = pd.concat([changed.assign(Age=changed['Age'] * 0 - 1), changed])
+    batches.append(('travel', changed))
+
+    taken = []
+    for side, frame in batches:
+        store.upsert(frame, side)
+        taken.append(store.take())
+    emitted = pd.concat(taken)
+    final = pd.concat([travel, changed]).drop_duplicates(config.ID_COL, keep='last')
+    expected = pipeline.merge(final, survey)
+
+    last = _sorted(emitted.drop_duplicates(config.ID_COL, keep='last'))
+    pd.testing.assert_frame_equal(last, _sorted(expected))
+    # A passenger comes out once, and once more only if it was corrected after coming out
+    counts = emitted[config.ID_COL].value_counts()
+    assert counts.max() <= 2
+    assert set(counts[counts == 2].index) <= set(changed[config.ID_COL])
+    assert len(store) == len(expected)
+    assert store.summary()['queued'] == 0
+
+
+def test_pending_stays_queued_until_commit(files, tmp_path):
+    travel, survey = files
+    root = str(tmp_path / 'store')
+    store = RecordStore(root)
+    store.upsert(travel.iloc[:1000], 'travel')
+    store.upsert(survey.iloc[:600], 'survey')
+    first = store.pending()
+    assert len(first) == 600
+
+    # Nothing was committed, so a fresh process sees the same queue
+    reopened = RecordStore(root)
+    pd.testing.assert_frame_equal(reopened.pending(), first)
+    reopened.upsert(survey.iloc[600:800], 'survey')
+    reopened.commit(first)
+    rest = reopened.take()
+    assert list(rest[config.ID_COL]) == list(survey[config.ID_COL].iloc[600:800])
+    assert len(reopened.take()) == 0
+    with pytest.raises(ValueError):
+        reopened.commit(first)
+
+
+def test_unlabelled_surveys_leave_out_the_target(files, tmp_path):
+    travel, survey = files
+    store = RecordStore(str(tmp_path / 'store'))
+    store.upsert(travel.iloc[:50], 'travel')
+    store.upsert(survey.iloc[:50].drop(columns=config.TARGET_COL), 'survey')
+    frame = store.take()
+    assert config.TARGET_COL not in frame
+    pd.testing.assert_frame_equal(_sorted(frame), _sorted(
+        pipeline.merge(travel.iloc[:50], survey.iloc[:50].drop(columns=config.TARGET_COL))))
+
+
+def test_rejects_ids_outside_the_range(files, tmp_path):
+    travel, _ = files
+    store = RecordStore(str(tmp_path / 'store'))
+    store.upsert(travel.iloc[:10], 'travel')
+    with pytest.raises(ValueError):
+        store.upsert(travel.iloc[:1].assign(ID=store.base - 1), 'travel')
+    with pytest.raises(ValueError):
+        store.upsert(travel.iloc[:1].drop(columns='Age'), 'travel')
@@ -0,0 +1,68 @@
+"""A run interrupted after a checkpoint and resumed ends where an uninterrupted run does."""
+
+import numpy as np
+import pytest
+
+from shinkansen import training
+from shinkansen.matrix import FeatureMatrix
+
+
+class Interrupted(Exception):
+    pass
+
+
+def _matrices(n=3000, columns=8, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, columns)).astype(np.float32)
+    logit = X[:, 0] - 2 * X[:, 1] * X[:, 2] + np.sin(X[:, 3])
+    y = (rng.random(n) < 1 / (1 + np.exp(-logit))).astype(np.int8)
+    names = [f'x{i}' for i in range(columns)]
+    matrix = FeatureMatrix(X, y, np.arange(n), names)
+    return matrix.take(np.arange(2400)), matrix.take(np.arange(2400, n))
+
+
+def _interrupt_at(built):
+    """A prune hook that kills the run once ``built`` trees exist, like a crash mid-training."""
+    def prune(done, best_score):
+        if done >= built:
+            raise Interrupted
+        return False
+    return prune
+
+
+@pytest.mark.parametrize('name, n_estimators, every, params', [
+    ('lightgbm', 120, 20, {'num_leaves': 15}),
+    ('xgboost', 120, 20, {'max_depth': 4}),
+    ('random_forest', 100, 20, {'max_leaf_nodes': 32}),
+])
+def test_resume_matches_uninterrupted(tmp_path, name, n_estimators, every, params):
+    if name != 'random_forest':
+        pytest.importorskip(name)
+    train, valid = _matrices()
+    kwargs = dict(n_estimators=n_estimators, early_stopping_rounds=1000, random_state=0, params=params,
+                  forest_step=10)
+    reference, reference_report = training.fit(name, train, valid, **kwargs)
+
+    checkpoint_dir = str(tmp_path)
+    with pytest.raises(Interrupted):
+        training.fit(name, train, valid, checkpoint_dir=checkpoint_dir, checkpoint_every=every,
+                     prune=_interrupt_at(70), **kwargs)
+    assert training.Checkpoint(checkpoint_dir, name).exists()
+    model, report = training.fit(name, train, valid, checkpoint_dir=checkpoint_dir, checkpoint_every=every,
+                                 resume=True, **kwargs)
+
+    assert report['resumed_from'] == 60
+    assert report['trees_kept'] == reference_report['trees_kept']
+    np.testing.assert_allclose(model.predict_proba(valid.X), reference.predict_proba(valid.X), atol=1e-6)
+    assert not training.Checkpoint(checkpoint_dir, name).exists()
+
+
+def test_resume_refuses_other_data(tmp_path):
+    train, valid = _matrices()
+    kwargs = dict(n_estimators=40, random_state=0, params={'max_leaf_nodes': 16}, forest_step=10,
+                  checkpoint_dir=str(tmp_path), checkpoint_every=10)
+    with pytest.raises(Interrupted):
+        training.fit('random_forest', train, valid, prune=_interrupt_at(20), **kwargs)
+    other, _ = _matrices(seed=1)
+    with pytest.raises(ValueError, match='different training data'):
+        training.fit('random_forest', other, valid, resume=True, **kwargs)